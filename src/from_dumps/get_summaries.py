@@ -2,10 +2,28 @@
 
 from argparse import ArgumentParser
 import bz2
+from concurrent.futures import ProcessPoolExecutor
 from configparser import ConfigParser
 import glob
+import json
 import logging
-from xml.dom import pulldom
+import os
+import shutil
+import sys
+import tempfile
+import time
+import xml.sax
+
+from load.comment_classifier import classify
+from load.stats import STATS
+
+
+# How often (in documents) to log progress through each file.
+PROGRESS_INTERVAL = 100000
+
+_DOCUMENTS = STATS.key('documents')
+_EMPTY = STATS.key('rows_filtered', reason='empty')
+_AUTOSUMMARY = STATS.key('rows_filtered', reason='autosummary')
 
 
 def main():
@@ -15,6 +33,8 @@ def main():
                         help='config file (default %(default)s)')
     parser.add_argument('--file', '-f',
                         help='input file (over-rides config')
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help='number of files to process at once (default: one at a time)')
     args = parser.parse_args()
 
     config = ConfigParser()
@@ -22,62 +42,180 @@ def main():
 
     if args.file:
         logging.info('Processing command-line file "%s"', args.file)
-        process_path(args.file)
+        paths = [args.file]
     else:
         pattern = config.get('dumps', 'path_glob')
         logging.info('Processing directory "%s"', pattern)
-        for path in glob.iglob(pattern):
-            process_path(path)
-
+        paths = sorted(glob.glob(pattern))
 
-def process_path(path):
-    logging.info('Processing file "%s"', path)
-    if path.endswith('.bz2'):
-        with bz2.open(path) as stream:
-            process_stream(stream)
+    if args.workers:
+        process_paths(paths, args.workers, sys.stdout)
     else:
-        with open(path) as stream:
-            process_stream(stream)
-
+        for path in paths:
+            process_path(path, sys.stdout)
 
-def process_stream(stream):
-    doc = pulldom.parse(stream)
-    for event, node in doc:
-        if event == pulldom.START_ELEMENT and node.tagName == 'page':
-            doc.expandNode(node)
 
-            for revision in node.getElementsByTagName('revision'):
-                id = revision.getElementsByTagName('id')[0].childNodes[0].nodeValue
+def process_paths(paths, workers, out):
+    """Process paths in a pool of worker processes.
 
-                contributor = revision.getElementsByTagName('contributor')[0]
-                usernames = contributor.getElementsByTagName('username')
-                if usernames:
-                    user_node = usernames[0]
-                else:
-                    user_node = contributor.getElementsByTagName('ip')[0]
-                user = user_node.childNodes[0].nodeValue
-                    
-                comment_nodes = revision.getElementsByTagName('comment')
-                if comment_nodes:
-                    comment = comment_nodes[0].childNodes[0].nodeValue
-                else:
-                    comment = ''
+    The biggest files are started first, so a big file picked up at
+    the end doesn't leave the other workers idle while it finishes.
+    Each worker writes its documents to a temporary file, and those are
+    copied to out in the original order of paths.
 
-                logging.debug('%s: [%s], "%s"', id, user, comment)
+    """
+    with tempfile.TemporaryDirectory() as spool_dir, ProcessPoolExecutor(workers) as executor:
+        futures = {}
+        for path in sorted(paths, key=os.path.getsize, reverse=True):
+            futures[path] = executor.submit(_spool_path, path, spool_dir)
+        for path in paths:
+            spool_path = futures.pop(path).result()
+            with open(spool_path) as spool:
+                shutil.copyfileobj(spool, out)
+            os.remove(spool_path)
 
 
+def _spool_path(path, spool_dir):
+    fd, spool_path = tempfile.mkstemp(dir=spool_dir, suffix='.jsonl')
+    with open(fd, 'w') as out:
+        process_path(path, out)
+    return spool_path
 
 
+def process_path(path, out):
+    """Write the documents from the dump file at path to out, as JSON lines."""
+    logging.info('Processing file "%s"', path)
+    t0 = time.perf_counter()
+    if path.endswith('.bz2'):
+        with bz2.open(path) as stream:
+            count = process_stream(stream, out, path)
+    else:
+        with open(path) as stream:
+            count = process_stream(stream, out, path)
+    elapsed = time.perf_counter() - t0
+    size = os.path.getsize(path) / 2**20
+    logging.info('Finished file "%s": %d documents, %.1f MB in %.1fs (%.1f MB/s)',
+                 path, count, size, elapsed, size / elapsed if elapsed else 0)
+
+
+def process_stream(stream, out, name='stream'):
+    """Write the documents from stream to out.  Return how many there were."""
+    count = 0
+    for document in get_documents(stream):
+        logging.debug('%s: [%s], "%s"', document['id'], document['un'], document['co'])
+        out.write(json.dumps(document) + '\n')
+        count += 1
+        if count % PROGRESS_INTERVAL == 0:
+            logging.info('%s: %d documents', name, count)
+    return count
+
+
+def get_documents(stream):
+    """Iterate over documents which should be inserted into the index.
+
+    These are the same shape as load.load_comments.get_documents()
+    produces from the tsv history files, so XML dumps can be loaded the
+    same way.  The XML dumps don't say who is a bot, so bot edits are
+    not filtered out.
+
+    """
+    for revision in iter_revisions(stream):
+        if not revision['comment']:
+            STATS.counters[_EMPTY] += 1
+            continue
+        comment = classify(revision['comment'])
+        if not comment.text:
+            STATS.counters[_AUTOSUMMARY] += 1
+            continue
+        STATS.counters[_DOCUMENTS] += 1
+        yield {'id': revision['id'],
+               'db': revision['db'],
+               'ts': revision['timestamp'].replace('T', ' ').replace('Z', '.0'),
+               'co': comment.text,
+               'un': revision['user'],
+               'se': comment.section,
+               'tg': list(comment.tags),
+               }
+
+
+def iter_revisions(stream):
+    """Iterate over the revisions in a pages-meta-history XML stream.
+
+    Each revision is a dict with db (the wiki's database name, from the
+    siteinfo), id, timestamp, user and comment keys.  Missing (e.g.
+    deleted) values are empty strings.
+
+    stream may be a file object, opened in either text or binary mode,
+    or an iterable of lines.  The XML is parsed incrementally, and only
+    the text of the elements we want is kept; in particular revision
+    text, which can be huge, is never buffered.
+
+    """
+    if hasattr(stream, 'read'):
+        chunks = iter(lambda: stream.read(2**20), stream.read(0))
+    else:
+        chunks = stream
+    handler = _RevisionHandler()
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from handler.revisions
+        handler.revisions.clear()
+    parser.close()
+    yield from handler.revisions
+
+
+class _RevisionHandler(xml.sax.handler.ContentHandler):
+    # Maps (parent, element) to the revision key its text is stored under.
+    FIELDS = {('revision', 'id'): 'id',
+              ('revision', 'timestamp'): 'timestamp',
+              ('revision', 'comment'): 'comment',
+              ('contributor', 'username'): 'user',
+              ('contributor', 'ip'): 'user',
+              }
+    # The same, for elements outside revisions; these are copied into
+    # every revision.
+    SITE_FIELDS = {('siteinfo', 'dbname'): 'db'}
+
+
+    def __init__(self):
+        super().__init__()
+        self.revisions = []
+        self.site = {'db': ''}
+        self.path = []
+        self.revision = None
+        self.field = None
+        self.text = []
+
+
+    def startElement(self, name, attrs):
+        parent = self.path[-1] if self.path else None
+        self.path.append(name)
+        if name == 'revision':
+            self.revision = dict(self.site, id='', timestamp='', user='', comment='')
+        elif self.revision is not None:
+            self.field = self.FIELDS.get((parent, name))
+        else:
+            self.field = self.SITE_FIELDS.get((parent, name))
+
+
+    def characters(self, content):
+        if self.field:
+            self.text.append(content)
+
+
+    def endElement(self, name):
+        self.path.pop()
+        if self.field:
+            fields = self.site if self.revision is None else self.revision
+            fields[self.field] = ''.join(self.text)
+            self.field = None
+            self.text = []
+        elif name == 'revision':
+            self.revisions.append(self.revision)
+            self.revision = None
 
 
-
-            # title = node.getElementsByTagName('title')[0].childNodes[0].nodeValue
-            # if not ns == '0':
-            #     continue
-
-            # cdataNodes = node.getElementsByTagName('text')[0].childNodes
-            # content = ' '.join(node.nodeValue for node in cdataNodes).lower()
-
-    
 if __name__ == '__main__':
     main()
@@ -0,0 +1,56 @@
+import bz2
+import io
+import json
+from pathlib import Path
+
+from get_summaries import get_documents, iter_revisions, process_paths
+
+
+PAGE_PATH = Path(__file__).parent / 'test' / 'pages-meta-history-one-page.xml'
+
+
+def test_iter_revisions_extracts_fields():
+    with open(PAGE_PATH, 'rb') as stream:
+        revisions = list(iter_revisions(stream))
+    assert len(revisions) == 14
+    assert revisions[1] == {'db': 'enwiki',
+                            'id': '862220',
+                            'timestamp': '2002-02-25T15:43:11Z',
+                            'user': 'Conversion script',
+                            'comment': 'Automated conversion',
+                            }
+
+
+def test_iter_revisions_accepts_lines():
+    with open(PAGE_PATH) as stream:
+        from_lines = list(iter_revisions(stream.readlines()))
+    with open(PAGE_PATH, 'rb') as stream:
+        assert from_lines == list(iter_revisions(stream))
+
+
+def test_get_documents_matches_tsv_document_shape():
+    with open(PAGE_PATH) as stream:
+        documents = list(get_documents(stream))
+    assert documents[0] == {'id': '862220',
+                            'db': 'enwiki',
+                            'ts': '2002-02-25 15:43:11.0',
+                            'co': 'Automated conversion',
+                            'un': 'Conversion script',
+                            'se': '',
+                            'tg': [],
+                            }
+    assert all(document['co'] for document in documents)
+
+
+def test_process_paths_keeps_file_order(tmp_path):
+    small = tmp_path / 'small.xml'
+    small.write_text(PAGE_PATH.read_text().replace('<id>862220</id>', '<id>1</id>'))
+    big = tmp_path / 'big.xml.bz2'
+    big.write_bytes(bz2.compress(PAGE_PATH.read_bytes()))
+    paths = [str(small), str(big), str(PAGE_PATH)]
+    out = io.StringIO()
+    process_paths(paths, 2, out)
+    ids = [json.loads(line)['id'] for line in out.getvalue().splitlines()]
+    assert len(ids) == 33
+    assert ids[0] == '1'
+    assert ids[11] == '862220'
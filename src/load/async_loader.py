@@ -0,0 +1,131 @@
+"""
+Send documents to opensearch with asyncio, so waiting on the cluster never stalls parsing.
+
+This is what load-comments --async uses.  The input is read and parsed
+in a worker thread (which may hand the work on to load.pipeline's
+process pools), and batches of actions are passed to the event loop
+through a bounded asyncio.Queue.  Up to concurrency bulk requests are
+in flight at once, over the connection pool of an AsyncOpenSearch
+client.  When they're all busy the queue fills up and the reader
+waits, as with BulkIndexer.
+
+This needs aiohttp, which is an optional dependency:
+
+    pip install 'edit-summaries[async]'
+
+"""
+
+
+import asyncio
+import threading
+import time
+
+import opensearchpy
+
+from load.load_comments import BulkIndexer, bulk_items
+
+
+def make_client(hosts, concurrency=1, **kwargs):
+    """Return an AsyncOpenSearch client with a pool of concurrency connections.
+
+    kwargs are passed on to AsyncOpenSearch.
+
+    """
+    AsyncOpenSearch = _async_opensearch()
+    return AsyncOpenSearch(hosts=hosts, maxsize=concurrency, **kwargs)
+
+
+class AsyncBulkIndexer(BulkIndexer):
+    """Send documents to an index in batches, from an event loop.
+
+    Batching, retries, dead-lettering and checkpoints work as for
+    BulkIndexer, but client must be an AsyncOpenSearch (see
+    make_client()), and documents are given all at once to load().
+
+    """
+    def __init__(self, client, index, batch_size, max_bytes=None, concurrency=1, **kwargs):
+        # concurrency=1 stops BulkIndexer starting a thread pool; the
+        # concurrency here comes from sender tasks instead.
+        super().__init__(client, index, batch_size, max_bytes, concurrency=1, **kwargs)
+        self.concurrency = concurrency
+
+
+    async def load(self, documents):
+        """Index all of documents, then close the client.
+
+        documents is an ordinary iterable, which is read in a separate
+        thread.  Returns once every batch has been acknowledged.
+
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(2 * self.concurrency)
+        stopped = threading.Event()
+
+        def put(item):
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce():
+            try:
+                for doc in documents:
+                    if stopped.is_set():
+                        return
+                    if self._add(doc):
+                        put(self._take_batch())
+                if self.docs:
+                    put(self._take_batch())
+            finally:
+                for _ in range(self.concurrency):
+                    put(None)
+
+        try:
+            producer = loop.run_in_executor(None, produce)
+            senders = [asyncio.create_task(self._sender(queue)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*senders)
+            except BaseException:
+                # Stop the reader, and keep the queue empty until it
+                # notices, so it isn't left blocked on a put.
+                stopped.set()
+                for sender in senders:
+                    sender.cancel()
+                while not producer.done():
+                    while not queue.empty():
+                        queue.get_nowait()
+                    await asyncio.wait([producer], timeout=0.05)
+                raise
+            await producer
+            if self.checkpoint:
+                # Account for any input after the last document.
+                self.checkpoint.finish_batch(self.checkpoint.start_batch())
+            print(self.prefix + self.report())
+        finally:
+            await self.client.close()
+
+
+    async def _sender(self, queue):
+        while (item := await queue.get()) is not None:
+            await self._send_async(*item)
+
+
+    async def _send_async(self, request, batch=None):
+        doc_count = len(request.docs)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            t0 = time.perf_counter()
+            try:
+                items = bulk_items(await self.client.bulk(body=request.body, index=self.index_name))
+            except opensearchpy.TransportError as ex:
+                items = [{'status': ex.status_code, 'error': str(ex)}] * len(request.docs)
+            request = self._handle_results(request, items, time.perf_counter() - t0, attempt)
+            if request is None:
+                break
+        self._finish_batch(doc_count, batch)
+
+
+def _async_opensearch():
+    try:
+        from opensearchpy import AsyncOpenSearch
+    except ImportError as ex:
+        raise RuntimeError('--async needs aiohttp; pip install "edit-summaries[async]"') from ex
+    return AsyncOpenSearch
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the record parsing strategies, and the field unescaping
+functions against their original versions.
+
+Run from the src directory:
+
+    python -m load.benchmark [--filename history.tsv.bz2]
+
+"""
+
+
+import argparse
+import bz2
+from collections import namedtuple
+from itertools import islice
+import re
+import time
+
+from load.schema import Row, field_names, build_row, make_decoder, unescape_tnr, expand_string_array
+
+
+EscapedRow = namedtuple("EscapedRow", field_names)
+
+SAMPLE_LINES = [
+    r'enwiki	revision	create	2001-01-15 19:27:13.0	*	11313587	Office.bomis.com	Office.bomis.com							false	false	true	false	2009-12-28 09:06:07.0	2009-12-28 09:06:09.0	2001-01-15 19:27:13.0	1		26323569	HomePage	HomePage	0	true	0	true	true	false	2010-02-24 14:25:49.0	2001-01-15 19:27:13.0	1																		908493298	0	false		false	26	26	hjnc5wxv75ckwvos9wsd0as31nmnice			false		false			false	true	',
+    r'enwiki	revision	create	2023-01-31 21:32:07.0	/* top */[[WP:AWB/GF|General fixes]], replaced: | nationality    \t= [[Israel]]\n| → | nationality    \t= Israeli\n|	15996738	BattyBot	BattyBot			bot	bot	name,group	name,group	false	false	true	false	2011-12-30 00:06:00.0	2011-12-30 00:06:01.0	2011-12-30 00:11:47.0	1582672	13	62661703	Dmitry_Bukhman	Dmitry_Bukhman	0	true	0	true	false	false	2019-12-25 10:45:29.0	2019-12-25 10:45:29.0	64	3070613																	1136732310	1129829523	false		false	5750	-3	b8tfg7j7xkyxfhj7e5qluocr33clvyb			false		false			false	false	AWB',
+    r'enwiki	user	alterblocks	2023-11-04 21:10:24.0																																	44332519	LoomCreek	LoomCreek			extendedconfirmed,ipblock-exempt	extendedconfirmed,ipblock-exempt			false	false	true	false	2022-08-11 16:36:04.0	2022-08-11 16:36:05.0	2022-08-12 23:26:29.0																		',
+]
+
+COMMENT_COLUMNS = ['event_entity', 'event_comment', 'event_user_is_bot_by']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filename',
+                        help='tsv.bz2 file to take records from (default: built-in samples)')
+    parser.add_argument('--count',
+                        type=int,
+                        default=100000,
+                        help='number of records to parse per strategy')
+    args = parser.parse_args()
+
+    lines = read_lines(args.filename, args.count)
+    for name, parse in get_strategies():
+        rate = measure(parse, lines)
+        print(f'{name:30} {rate:12,.0f} lines/s')
+    for name, function, fields in get_field_strategies(lines):
+        rate = measure(function, fields)
+        print(f'{name:30} {rate:12,.0f} fields/s')
+
+
+def get_strategies():
+    """Return (name, function) pairs for each parsing strategy."""
+    decode_all = make_decoder()
+    decode_comment = make_decoder(COMMENT_COLUMNS)
+    return [
+        ('legacy build_row', legacy_build_row),
+        ('build_row', build_row),
+        ('EscapedRow', lambda line: EscapedRow(*line.split('\t'))),
+        ('make_decoder(all)', decode_all),
+        ('make_decoder(comment)', decode_comment),
+    ]
+
+
+def get_field_strategies(lines):
+    """Return (name, function, fields) triples comparing the unescaping functions.
+
+    fields are all the values from lines of the columns each function
+    is used for.
+
+    """
+    split_lines = [line.rstrip('\n').split('\t') for line in lines]
+    string_fields = []
+    array_fields = []
+    for index, type in enumerate(Row.__annotations__.values()):
+        if type == str:
+            string_fields.extend(fields[index] for fields in split_lines)
+        elif type == list[str]:
+            array_fields.extend(fields[index] for fields in split_lines)
+    return [
+        ('legacy unescape_tnr', legacy_unescape_tnr, string_fields),
+        ('unescape_tnr', unescape_tnr, string_fields),
+        ('legacy expand_string_array', legacy_expand_string_array, array_fields),
+        ('expand_string_array', expand_string_array, array_fields),
+    ]
+
+
+def read_lines(filename, count):
+    if filename is None:
+        return [SAMPLE_LINES[i % len(SAMPLE_LINES)] for i in range(count)]
+    with bz2.open(filename, 'rt') as f:
+        return list(islice(f, count))
+
+
+def measure(function, lines):
+    """Return the rate, in items per second, at which function consumes lines (or any items)."""
+    t0 = time.perf_counter()
+    for line in lines:
+        function(line)
+    return len(lines) / (time.perf_counter() - t0)
+
+
+def legacy_build_row(tsv_string):
+    """The original per-field annotation loop, kept as a baseline."""
+    fields = tsv_string.split('\t')
+    name_types = Row.__annotations__
+    args = {}
+    for value, name, type in zip(fields, name_types.keys(), name_types.values()):
+        if type == str:
+            args[name] = unescape_tnr(value)
+        elif type == int:
+            args[name] = None if value == '' else int(value)
+        elif type == bool:
+            if value == '':
+                args[name] = None
+            elif value == 'true':
+                args[name] = True
+            elif value == 'false':
+                args[name] = False
+            else:
+                raise ValueError(f'{name=}, {type=}, value={repr(value)}')
+        elif type == list[str]:
+            args[name] = expand_string_array(value)
+        else:
+            raise RuntimeError(f'{type=}.  This should never happen!')
+    return Row(**args)
+
+
+def legacy_unescape_tnr(s):
+    """The original unescape_tnr(), without the no-backslash fast path."""
+    return s.replace('\\t', '\t').replace('\\n', '\n').replace('\\r', '\r')
+
+
+def legacy_expand_string_array(input_string):
+    """The original expand_string_array(), which always used a regex split."""
+    if input_string == '':
+        return []
+    strings = re.split(r'(?<!\\),', input_string)
+    return [legacy_unescape_tnr(s).replace('\\,', ',') for s in strings]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark each stage of the loaders, and both CLIs end to end.
+
+The input is a synthetic dump from load.synthetic (generated if it
+doesn't exist), so results from different machines and revisions can
+be compared.  Each benchmark runs in a fresh process, so its peak RSS
+can be measured too.  Apart from decompress and the "keep rows"
+stages, the stage benchmarks read all their input into memory first,
+which is included in their RSS.  The "keep rows" stages decode every
+line and keep the rows, so their RSS compares row representations.
+The "dedup", "encode" and "bulk" stages count documents rather than
+lines.  "encode" just serializes the documents from load-comments for
+_bulk requests, while "bulk" also sends them to a load.bulk_stub
+server running in the same process, and records the bytes sent.
+
+Results are written as a JSON report; pass an earlier report as
+--compare to see what changed.
+
+Run from the src directory:
+
+    python -m load.benchmark_suite --output report.json [--compare old.json]
+
+"""
+
+
+import argparse
+import bz2
+from contextlib import redirect_stdout
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from load.benchmark import get_strategies
+from load.comment_classifier import classify, get_human_text
+from load.dedup import Deduplicator
+from load.extract_comments import process_as_tuples
+from load.bulk_stub import BulkStub
+from load.load_comments import BulkIndexer, get_documents
+from load.parallel_bz2 import Bz2LineReader
+from load.schema import build_row, decode_columns, field_names, make_decoder, unescape_tnr, expand_string_array
+from load.synthetic import GENERATOR_OPTIONS, write_dump
+
+
+REPORT_VERSION = 1
+
+COMMENT_INDEX = field_names.index('event_comment_escaped')
+GROUPS_INDEX = field_names.index('event_user_groups_string')
+
+# Numeric, boolean and timestamp columns, which decode_columns parses
+# without creating a Python object per value.
+TYPED_COLUMNS = ['event_timestamp', 'page_id', 'page_namespace', 'revision_id', 'revision_text_bytes_diff']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input',
+                        default='benchmark-{lines}.tsv.bz2',
+                        help='synthetic dump to use, generated if missing (default: %(default)s)')
+    parser.add_argument('--lines',
+                        type=int,
+                        default=200000,
+                        help='number of lines to generate (default: %(default)s)')
+    parser.add_argument('--output', '-o',
+                        help='file to write the JSON report to (default: stdout)')
+    parser.add_argument('--compare',
+                        help='earlier report to compare the results with')
+    parser.add_argument('--only',
+                        nargs='+',
+                        help='run only these benchmarks')
+    parser.add_argument('--stage',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    path = args.input.format(lines=args.lines)
+
+    if args.stage:
+        # Run one stage benchmark; this is how the suite runs each one.
+        print(json.dumps(run_stage(args.stage, path)))
+        return
+
+    if not os.path.exists(path):
+        print(f'generating {path}', file=sys.stderr)
+        write_dump(path, args.lines, **GENERATOR_OPTIONS)
+    report = {'version': REPORT_VERSION,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'environment': get_environment(),
+              'input': {'path': path,
+                        'lines': args.lines,
+                        'bytes': os.path.getsize(path),
+                        'generator': GENERATOR_OPTIONS,
+                        },
+              'results': {},
+              }
+    names = args.only or list(STAGES) + list(COMMANDS)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # load-comments needs a config file, even with --dry-run.
+        config_path = Path(temp_dir) / 'opensearch.ini'
+        config_path.write_text('[auth]\nuser = benchmark\npassword = benchmark\n')
+        config_path.chmod(0o600)
+        env = dict(os.environ, OPENSEARCH_CONFIG=str(config_path))
+        for name in names:
+            if name in STAGES:
+                command = [sys.executable, '-m', 'load.benchmark_suite', '--input', path, '--stage', name]
+                output, peak_rss = run_command(command, env, capture=True)
+                result = json.loads(output)
+            else:
+                t0 = time.perf_counter()
+                _, peak_rss = run_command(COMMANDS[name](path), env)
+                result = {'lines': args.lines, 'seconds': time.perf_counter() - t0}
+            result['lines_per_s'] = result['lines'] / result['seconds']
+            result['peak_rss_mb'] = peak_rss / 2**20
+            report['results'][name] = result
+            sent = f' {result["bytes_sent"] / 2**20:8.1f} MB sent' if 'bytes_sent' in result else ''
+            print(f'{name:30} {result["lines_per_s"]:12,.0f} lines/s {result["peak_rss_mb"]:8.1f} MB{sent}',
+                  file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'commit': commit,
+            }
+
+
+def run_command(command, env=None, capture=False):
+    """Run command, and return its output and peak RSS in bytes."""
+    with tempfile.TemporaryFile() as out:
+        process = subprocess.Popen(command, stdout=out if capture else subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL, env=env)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            raise RuntimeError(f'{" ".join(command)} failed with status {process.returncode}')
+        out.seek(0)
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return out.read().decode(), usage.ru_maxrss * scale
+
+
+def run_stage(name, path):
+    """Run one of STAGES on the lines in path, returning the line count and time taken."""
+    setup, function = STAGES[name]
+    items = setup(path)
+    t0 = time.perf_counter()
+    result = function(items)
+    seconds = time.perf_counter() - t0
+    if not isinstance(result, dict):
+        result = {'lines': result}
+    return dict(result, seconds=seconds)
+
+
+def print_comparison(old, new):
+    print(f'{"":30} {"old":>12} {"new":>12} {"change":>8}', file=sys.stderr)
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['lines_per_s']
+        after = result['lines_per_s']
+        print(f'{name:30} {before:12,.0f} {after:12,.0f} {after / before - 1:+8.1%}', file=sys.stderr)
+
+
+def read_lines(path):
+    with bz2.open(path, 'rt', encoding='utf-8') as f:
+        return f.readlines()
+
+
+def read_byte_lines(path):
+    with bz2.open(path, 'rb') as f:
+        return f.readlines()
+
+
+def read_block(path):
+    with bz2.open(path, 'rb') as f:
+        return f.read()
+
+
+def read_fields(index):
+    def setup(path):
+        return [line.split('\t')[index] for line in read_lines(path)]
+    return setup
+
+
+def read_comments(path):
+    return [unescape_tnr(comment) for comment in read_fields(COMMENT_INDEX)(path)]
+
+
+def read_documents(path):
+    return list(get_documents(read_lines(path)))
+
+
+def count_lines(lines):
+    count = 0
+    for _ in lines:
+        count += 1
+    return count
+
+
+def apply(function):
+    def run(items):
+        for item in items:
+            function(item)
+        return len(items)
+    return run
+
+
+def decode_block(columns):
+    def run(block):
+        return len(next(iter(decode_columns(block, columns).values())))
+    return run
+
+
+def keep(make_decode):
+    def run(lines):
+        decode = make_decode()
+        rows = [decode(line) for line in lines]
+        return len(rows)
+    return run
+
+
+def consume(function):
+    def run(lines):
+        for _ in function(lines):
+            pass
+        return len(lines)
+    return run
+
+
+def bulk(**client_options):
+    def run(documents):
+        import opensearchpy
+
+        with BulkStub() as stub, redirect_stdout(sys.stderr):
+            client = opensearchpy.OpenSearch(hosts=[stub.url], **client_options)
+            indexer = BulkIndexer(client, 'benchmark', BULK_BATCH_SIZE)
+            for document in documents:
+                indexer.index(document)
+            indexer.close()
+        return {'lines': len(documents), 'bytes_sent': stub.wire_bytes}
+    return run
+
+
+def legacy_bulk(documents):
+    """Send documents as BulkIndexer did before it built request bodies itself."""
+    import opensearchpy.helpers
+
+    with BulkStub() as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        for start in range(0, len(documents), BULK_BATCH_SIZE):
+            actions = [{'_index': 'benchmark', '_source': document}
+                       for document in documents[start:start + BULK_BATCH_SIZE]]
+            for _ in opensearchpy.helpers.streaming_bulk(client, actions, chunk_size=len(actions),
+                                                         raise_on_error=False, raise_on_exception=False):
+                pass
+    return {'lines': len(documents), 'bytes_sent': stub.wire_bytes}
+
+
+def encode_bulk(documents):
+    indexer = BulkIndexer(None, 'benchmark', BULK_BATCH_SIZE)
+    for document in documents:
+        if indexer._add(document):
+            indexer._take_batch()
+    return len(documents)
+
+
+def legacy_encode_bulk(documents):
+    """Serialize documents the way opensearchpy.helpers.streaming_bulk does."""
+    from opensearchpy.helpers import expand_action
+    from opensearchpy.serializer import JSONSerializer
+
+    serializer = JSONSerializer()
+    for document in documents:
+        action, source = expand_action({'_index': 'benchmark', '_source': document})
+        serializer.dumps(action).encode()
+        serializer.dumps(source).encode()
+    return len(documents)
+
+
+BULK_BATCH_SIZE = 1000
+
+# Maps stage names to (setup, function) pairs.  setup(path) prepares
+# the input, and isn't timed; function(input) is, and returns the
+# number of lines it processed, or a dict of measurements including
+# that as 'lines'.
+STAGES = {
+    'decompress': (Bz2LineReader, count_lines),
+    **{f'parse: {name}': (read_lines, apply(parse)) for name, parse in get_strategies()},
+    'parse: decode_columns': (read_block, decode_block(None)),
+    'parse: decode_columns, typed': (read_block, decode_block(TYPED_COLUMNS)),
+    'keep rows: build_row': (Bz2LineReader, keep(lambda: build_row)),
+    'keep rows: make_decoder': (Bz2LineReader, keep(make_decoder)),
+    'keep rows: make_decoder, interned': (Bz2LineReader, keep(lambda: make_decoder(intern=True))),
+    'unescape_tnr': (read_fields(COMMENT_INDEX), apply(unescape_tnr)),
+    'expand_string_array': (read_fields(GROUPS_INDEX), apply(expand_string_array)),
+    'get_human_text': (read_comments, apply(get_human_text)),
+    'classify': (read_comments, apply(classify)),
+    'filter: extract_comments': (read_lines, consume(process_as_tuples)),
+    'filter: load_comments': (read_lines, consume(get_documents)),
+    'filter: load_comments, bytes': (read_byte_lines, consume(get_documents)),
+    'dedup: drop': (read_documents, consume(lambda documents: Deduplicator('drop').filter(documents))),
+    'encode: streaming_bulk': (read_documents, legacy_encode_bulk),
+    'encode: BulkIndexer': (read_documents, encode_bulk),
+    'bulk: streaming_bulk': (read_documents, legacy_bulk),
+    'bulk: BulkIndexer': (read_documents, bulk()),
+    'bulk: BulkIndexer, gzip': (read_documents, bulk(http_compress=True)),
+}
+
+
+# Maps end-to-end benchmark names to functions returning the command
+# line for an input path.
+COMMANDS = {
+    'extract-comments': lambda path: [sys.executable, '-m', 'load.extract_comments', path,
+                                      '--no-cache', '--stats-interval', '0'],
+    'extract-comments --workers 2': lambda path: [sys.executable, '-m', 'load.extract_comments', path,
+                                                  '--no-cache', '--stats-interval', '0', '--workers', '2'],
+    'load-comments --dry-run': lambda path: [sys.executable, '-m', 'load.load_comments', '--host', 'localhost',
+                                             '--filename', path, '--dry-run', '--no-cache',
+                                             '--stats-interval', '0'],
+}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+"""
+Skip the bzip2 blocks of a .tsv.bz2 dump which can't have wanted rows.
+
+An index file (the dump's path plus INDEX_SUFFIX) summarizes the rows
+starting in each block: the range of their event_timestamps and
+page_ids, and the set of their page_namespaces.  A dump is in
+timestamp order, so a time range (or a rare namespace) rules out most
+blocks, and BlockReader only decompresses the rest, plus as much of
+the following block as it takes to finish a selected block's last row.
+
+The summaries are conservative: a block is selected whenever a row
+starting in it could pass a RowFilter with the same since, until and
+namespaces, so filtering BlockReader's lines gives the same rows as
+filtering the whole dump.
+
+Run from the src directory:
+
+    python -m load.block_index build history.tsv.bz2 [--workers 4]
+
+"""
+
+
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+from pathlib import Path
+import struct
+import sys
+import time
+
+from load.parallel_bz2 import decompress_blocks, iter_blocks
+from load.row_filter import NAMESPACE_INDEX, TIMESTAMP_INDEX
+from load.row_index import PAGE_INDEX, decompress_each
+from load.stats import STATS
+
+
+INDEX_SUFFIX = '.blkidx'
+INDEX_VERSION = 1
+
+# magic, version, dump size, block count.
+_HEADER = struct.Struct('<4sIQQ')
+_MAGIC = b'BIDX'
+# start bit, end bit and CRC of a block (as from iter_blocks()), its
+# decompressed length, the offset of the first row starting in it (or
+# NO_ROW), the number of rows starting in it, their minimum and maximum
+# event_timestamp and page_id, and a bitmask of their namespaces.
+_SUMMARY = struct.Struct('<QQIIII24s24sqqQ')
+
+NO_ROW = 0xFFFFFFFF
+
+# Namespaces 0 to 62 have a bit of their own; all others share bit 63.
+_OTHER_NAMESPACES = 63
+
+# BlockReader decompresses at most this many consecutive blocks at a time.
+_BLOCKS_PER_READ = 16
+
+_BLOCKS_SKIPPED = STATS.key('blocks_skipped')
+
+
+class BlockFilter(namedtuple('BlockFilter', ['since', 'until', 'namespaces'])):
+    """Which rows are wanted: as for the RowFilter arguments of the same names.
+
+    since and until are event_timestamp strings (since inclusive, until
+    exclusive), and namespaces a collection of ints; any may be None.
+
+    """
+    __slots__ = ()
+
+
+class BlockSummary(namedtuple('BlockSummary', ['block', 'length', 'first_row', 'row_count', 'min_timestamp',
+                                               'max_timestamp', 'min_page_id', 'max_page_id', 'namespaces'])):
+    """What the index records about one block (see _SUMMARY)."""
+    __slots__ = ()
+
+
+    def matches(self, block_filter):
+        """Return whether any row starting in this block could pass block_filter."""
+        since, until, namespaces = block_filter
+        if not self.row_count:
+            return False
+        if since is not None or until is not None:
+            # Rows with no timestamp never pass a time range.
+            if not self.max_timestamp:
+                return False
+            if since is not None and self.max_timestamp < since:
+                return False
+            if until is not None and self.min_timestamp >= until:
+                return False
+        if namespaces is not None and not self.namespaces & namespace_mask(namespaces):
+            return False
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build',
+                                         help='index dumps')
+    build_parser.add_argument('filename',
+                              nargs='+',
+                              help='dumps to index (must be in tsv-bz2 format)')
+    build_parser.add_argument('--workers',
+                              type=int,
+                              default=0,
+                              help='number of processes to decompress with (default: decompress inline)')
+    args = parser.parse_args()
+
+    for filename in args.filename:
+        summaries = build_block_index(filename, workers=args.workers)
+        timed = [summary for summary in summaries if summary.max_timestamp]
+        span = ''
+        if timed:
+            span = (f', {min(summary.min_timestamp for summary in timed)} '
+                    f'to {max(summary.max_timestamp for summary in timed)}')
+        print(f'{filename}: indexed {len(summaries)} blocks{span}', file=sys.stderr)
+
+
+def namespace_mask(namespaces):
+    """Return the bitmask for a collection of namespace numbers."""
+    mask = 0
+    for namespace in namespaces:
+        mask |= 1 << (namespace if 0 <= namespace < _OTHER_NAMESPACES else _OTHER_NAMESPACES)
+    return mask
+
+
+def build_block_index(path, index_path=None, workers=0):
+    """Index the dump at path, and return its list of BlockSummary.
+
+    Each block is decompressed once, in a pool of workers processes if
+    workers isn't 0.  A row is counted in the block it starts in.
+
+    """
+    index_path = Path(index_path or str(path) + INDEX_SUFFIX)
+    blocks = list(iter_blocks(path))
+    summaries = []
+    stats = None
+    carry = b''
+    for number, data in enumerate(decompress_each(path, blocks, workers)):
+        position = 0
+        if carry:
+            end = data.find(b'\n')
+            if end < 0:
+                carry += data
+                summaries.append(_Stats(len(data), NO_ROW))
+                continue
+            stats.add(carry + data[:end])
+            carry = b''
+            position = end + 1
+        stats = _Stats(len(data), position if position < len(data) else NO_ROW)
+        summaries.append(stats)
+        while (end := data.find(b'\n', position)) >= 0:
+            stats.add(data[position:end])
+            position = end + 1
+        carry = data[position:]
+    if carry:
+        stats.add(carry)
+    summaries = [BlockSummary(block, *stats.summary()) for block, stats in zip(blocks, summaries)]
+
+    temp_path = index_path.with_name(index_path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, INDEX_VERSION, os.path.getsize(path), len(blocks)))
+        for summary in summaries:
+            f.write(_SUMMARY.pack(*summary.block, *summary[1:4],
+                                  summary.min_timestamp.encode(), summary.max_timestamp.encode(),
+                                  *summary[6:]))
+    os.replace(temp_path, index_path)
+    return summaries
+
+
+def read_block_index(path, index_path=None):
+    """Return the list of BlockSummary from the index of the dump at path.
+
+    Raises ValueError if the index doesn't exist, isn't an index, or
+    was built for a different version of the dump.
+
+    """
+    index_path = index_path or str(path) + INDEX_SUFFIX
+    try:
+        with open(index_path, 'rb') as f:
+            data = f.read()
+    except OSError as ex:
+        raise ValueError(f'{index_path}: cannot open index ({ex}); build it with "block-index build {path}"') from ex
+    try:
+        magic, version, size, block_count = _HEADER.unpack_from(data)
+    except struct.error:
+        magic = version = None
+    if magic != _MAGIC or version != INDEX_VERSION:
+        raise ValueError(f'{index_path}: not a version {INDEX_VERSION} block index')
+    if size != os.path.getsize(path):
+        raise ValueError(f'{index_path}: built for a different version of {path}; rebuild it')
+    summaries = []
+    for fields in _SUMMARY.iter_unpack(data[_HEADER.size:_HEADER.size + block_count * _SUMMARY.size]):
+        summaries.append(BlockSummary(fields[:3], *fields[3:6],
+                                      fields[6].rstrip(b'\0').decode(), fields[7].rstrip(b'\0').decode(),
+                                      *fields[8:]))
+    return summaries
+
+
+def has_block_index(path):
+    """Return whether the dump at path has a block index file (current or not)."""
+    return os.path.exists(str(path) + INDEX_SUFFIX)
+
+
+class BlockReader:
+    """Iterate over the lines of the dump at path which start in blocks matching block_filter.
+
+    The dump must have been indexed by build_block_index().  Runs of
+    selected blocks are decompressed in a pool of workers processes if
+    workers isn't 0.  Lines are as from parallel_bz2.Bz2LineReader: str
+    decoded as encoding, or bytes if encoding is None, with their
+    trailing newline.
+
+    Rows are assumed to span at most a few blocks; one that ends more
+    than _BLOCKS_PER_READ blocks after it starts is still read whole,
+    just less efficiently.
+
+    """
+    def __init__(self, path, block_filter, workers=0, encoding='utf-8'):
+        self.path = path
+        self.block_filter = block_filter
+        self.workers = workers
+        self.encoding = encoding
+        self.summaries = read_block_index(path)
+        self.selected = [number for number, summary in enumerate(self.summaries)
+                         if summary.matches(block_filter)]
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.elapsed = 0.0
+
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        STATS.counters[_BLOCKS_SKIPPED] += len(self.summaries) - len(self.selected)
+        try:
+            for data in self._read(self._reads()):
+                if self.encoding is None:
+                    yield from io.BytesIO(data)
+                else:
+                    yield from io.StringIO(data.decode(self.encoding), newline='\n')
+        finally:
+            self.elapsed = time.perf_counter() - t0
+
+
+    def report(self):
+        """Return a one-line summary of the blocks read and the decompression throughput."""
+        elapsed = self.elapsed or float('nan')
+        mb_in = self.compressed_bytes / 2**20
+        mb_out = self.decompressed_bytes / 2**20
+        return (f'{self.path}: read {len(self.selected)} of {len(self.summaries)} blocks, '
+                f'{mb_in:.1f} MB -> {mb_out:.1f} MB in {elapsed:.1f}s '
+                f'({mb_in / elapsed:.1f} MB/s compressed, {self.workers} workers)')
+
+
+    def _reads(self):
+        """Iterate over (blocks, start, end) for the runs of selected blocks.
+
+        The rows starting in a run are those from start to end in the
+        decompressed data of blocks, which runs on to the block where
+        the next row starts.
+
+        """
+        run = []
+        for number in self.selected:
+            if run and (number != run[-1] + 1 or len(run) >= _BLOCKS_PER_READ):
+                yield self._read_for(run)
+                run = []
+            run.append(number)
+        if run:
+            yield self._read_for(run)
+
+
+    def _read_for(self, run):
+        summaries = self.summaries
+        end = sum(summaries[number].length for number in run)
+        blocks = [summaries[number].block for number in run]
+        following = run[-1] + 1
+        while following < len(summaries):
+            blocks.append(summaries[following].block)
+            if summaries[following].first_row != NO_ROW:
+                end += summaries[following].first_row
+                break
+            end += summaries[following].length
+            following += 1
+        return blocks, summaries[run[0]].first_row, end
+
+
+    def _read(self, reads):
+        """Iterate over the data for each of reads, in order."""
+        if not self.workers:
+            for read in reads:
+                yield self._count(read, _read_rows(self.path, *read))
+            return
+        with ProcessPoolExecutor(self.workers) as executor:
+            pending = deque()
+            while True:
+                for read in reads:
+                    pending.append((read, executor.submit(_read_rows, self.path, *read)))
+                    if len(pending) >= 2 * self.workers:
+                        break
+                if not pending:
+                    break
+                read, future = pending.popleft()
+                t0 = time.perf_counter()
+                data = future.result()
+                STATS.add_time('decompress', time.perf_counter() - t0)
+                yield self._count(read, data)
+
+
+    def _count(self, read, data):
+        compressed_bytes = sum(end - start for start, end, _ in read[0]) // 8
+        self.compressed_bytes += compressed_bytes
+        self.decompressed_bytes += len(data)
+        STATS.count('bytes_read', compressed_bytes)
+        STATS.count('bytes_decompressed', len(data))
+        return data
+
+
+def _read_rows(path, blocks, start, end):
+    with STATS.timer('decompress'):
+        return decompress_blocks(path, blocks)[start:end]
+
+
+class _Stats:
+    """The summary of the rows starting in a block, as they're added."""
+    def __init__(self, length, first_row):
+        self.length = length
+        self.first_row = first_row
+        self.row_count = 0
+        self.min_timestamp = self.max_timestamp = b''
+        self.min_page_id = self.max_page_id = -1
+        self.namespaces = 0
+
+
+    def add(self, line):
+        self.row_count += 1
+        fields = line.split(b'\t', max(TIMESTAMP_INDEX, PAGE_INDEX, NAMESPACE_INDEX) + 1)
+        if len(fields) <= NAMESPACE_INDEX:
+            return
+        timestamp = fields[TIMESTAMP_INDEX]
+        if timestamp:
+            if len(timestamp) > 24:
+                raise ValueError(f'event_timestamp too long to index: {timestamp!r}')
+            if not self.max_timestamp:
+                self.min_timestamp = self.max_timestamp = timestamp
+            self.min_timestamp = min(self.min_timestamp, timestamp)
+            self.max_timestamp = max(self.max_timestamp, timestamp)
+        if fields[PAGE_INDEX]:
+            page_id = int(fields[PAGE_INDEX])
+            if self.max_page_id < 0:
+                self.min_page_id = self.max_page_id = page_id
+            self.min_page_id = min(self.min_page_id, page_id)
+            self.max_page_id = max(self.max_page_id, page_id)
+        if fields[NAMESPACE_INDEX]:
+            self.namespaces |= namespace_mask([int(fields[NAMESPACE_INDEX])])
+
+
+    def summary(self):
+        return (self.length, self.first_row, self.row_count, self.min_timestamp.decode(),
+                self.max_timestamp.decode(), self.min_page_id, self.max_page_id, self.namespaces)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""
+A stand-in for an opensearch server's _bulk endpoint.
+
+This accepts bulk requests over plain HTTP, gzipped or not, and
+acknowledges every action (except creating a document whose _id it has
+already seen, which conflicts as it would in opensearch), after an
+optional delay to simulate the round trip to a real cluster.  It also keeps track of
+indices, their settings and aliases, for the index admin calls the
+loaders make.  It's meant for testing and benchmarking the loaders
+without a cluster:
+
+    python -m load.bulk_stub --port 9200 --latency 0.05
+
+"""
+
+
+import argparse
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import unquote
+
+
+class BulkStub:
+    """Run a stand-in _bulk server in a background thread.
+
+    Use as a context manager; url is the address to point clients at.
+    The counters record what has been received: body_bytes is the size
+    of the bulk bodies and wire_bytes what was actually sent, which is
+    less if they were gzipped.  targets has the set of (index, routing)
+    pairs the actions in each bulk request were for.
+
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.request_count = 0
+        self.action_count = 0
+        self.body_bytes = 0
+        self.wire_bytes = 0
+        self.targets = []
+        self.ids = set()
+        self.indices = {}
+        self.aliases = {}
+        self.admin_calls = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def respond(self, lines, default_index=None):
+        """Return the response items for the parsed lines of a bulk body.
+
+        default_index is the index named in the request's path, if any.
+
+        """
+        items = []
+        lines = iter(lines)
+        for action in lines:
+            (op_type, meta), = action.items()
+            source = None if op_type == 'delete' else next(lines)
+            status = self.status(op_type, meta, source)
+            item = {'_index': meta.get('_index', default_index),
+                    '_id': meta.get('_id', str(len(items))),
+                    'status': status,
+                    }
+            if status < 300:
+                item['result'] = 'created' if status == 201 else 'updated'
+            else:
+                item['error'] = {'type': 'stub_exception', 'reason': f'status {status}'}
+            items.append({op_type: item})
+        return items
+
+
+    def status(self, op_type, meta, source):
+        """Return the HTTP status for one action.
+
+        Everything succeeds, apart from creating a document with an _id
+        which has been seen before; subclasses can override this to
+        simulate rejections and failures.
+
+        """
+        if '_id' not in meta:
+            return 201
+        with self.lock:
+            if meta['_id'] in self.ids:
+                return 409 if op_type == 'create' else 200
+            self.ids.add(meta['_id'])
+        return 201
+
+
+    def admin(self, method, path, body):
+        """Handle a request other than _bulk; return the status and response body.
+
+        Only what the loaders use is supported: creating, deleting and
+        checking for indices, their settings, refresh, force-merge and
+        aliases.  Every call is recorded in admin_calls.
+
+        """
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        with self.lock:
+            self.admin_calls.append((method, '/'.join(parts)))
+            if parts == ['_aliases'] and method == 'POST':
+                for action in body['actions']:
+                    (op, args), = action.items()
+                    members = self.aliases.setdefault(args['alias'], set())
+                    if op == 'add':
+                        members.add(args['index'])
+                    else:
+                        members.discard(args['index'])
+                return 200, {'acknowledged': True}
+            if parts[0] == '_alias':
+                if not self.aliases.get(parts[1]):
+                    return 404, _error(404, f'alias [{parts[1]}] missing')
+                return 200, {index: {'aliases': {parts[1]: {}}} for index in self.aliases[parts[1]]}
+
+            name = parts[0]
+            index = self.indices.get(name)
+            if len(parts) == 1:
+                if method == 'PUT':
+                    if index is not None or self.aliases.get(name):
+                        return 400, _error(400, f'index [{name}] already exists')
+                    settings = body.get('settings', {}).get('index', {})
+                    self.indices[name] = {'settings': {key: value if isinstance(value, dict) else str(value)
+                                                       for key, value in settings.items()},
+                                          'mappings': body.get('mappings', {}),
+                                          }
+                    return 200, {'acknowledged': True, 'index': name}
+                if index is None and not self.aliases.get(name):
+                    return 404, _error(404, f'no such index [{name}]')
+                if method == 'DELETE' and index is not None:
+                    del self.indices[name]
+                    for members in self.aliases.values():
+                        members.discard(name)
+                    return 200, {'acknowledged': True}
+                return 200, {}
+            if index is None:
+                return 404, _error(404, f'no such index [{name}]')
+            if parts[1] == '_settings' and method == 'PUT':
+                for key, value in body['index'].items():
+                    if value is None:
+                        index['settings'].pop(key, None)
+                    else:
+                        index['settings'][key] = str(value)
+                return 200, {'acknowledged': True}
+            if parts[1] == '_settings':
+                return 200, {name: {'settings': {'index': dict(index['settings'])}}}
+            if parts[1] in ('_refresh', '_forcemerge'):
+                return 200, {'_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+        return 404, _error(404, f'no handler for {method} {path}')
+
+
+def _error(status, reason):
+    return {'error': {'type': 'stub_exception', 'reason': reason}, 'status': status}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        wire_bytes = len(body)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        path = self.path.split('?')[0]
+        if not path.endswith('/_bulk'):
+            self._reply(*stub.admin(self.command, path, json.loads(body) if body else None))
+            return
+        default_index = unquote(path[:-len('/_bulk')].strip('/')) or None
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        if stub.latency:
+            time.sleep(stub.latency)
+        items = stub.respond(lines, default_index)
+        with stub.lock:
+            stub.request_count += 1
+            stub.action_count += len(items)
+            stub.body_bytes += len(body)
+            stub.wire_bytes += wire_bytes
+            stub.targets.append({(meta.get('_index', default_index), meta.get('routing'))
+                                 for action in lines[::2] for meta in action.values()})
+        self._reply(200, {'took': int(stub.latency * 1000),
+                          'errors': any(item[next(iter(item))]['status'] >= 300 for item in items),
+                          'items': items,
+                          })
+
+    do_PUT = do_POST
+    do_DELETE = do_POST
+
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path != '/':
+            self._reply(*self.server.stub.admin('GET', path, None))
+            return
+        self._reply(200, {'name': 'bulk-stub', 'version': {'distribution': 'opensearch', 'number': '2.11.0'}})
+
+
+    def do_HEAD(self):
+        path = self.path.split('?')[0]
+        status = 200 if path == '/' else self.server.stub.admin('HEAD', path, None)[0]
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host',
+                        default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port',
+                        type=int,
+                        default=9200,
+                        help='port to listen on')
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0.0,
+                        help='seconds to wait before answering each bulk request')
+    args = parser.parse_args()
+
+    with BulkStub(args.host, args.port, args.latency) as stub:
+        print(f'listening on {stub.url}')
+        try:
+            stub.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Cache the output of processing a dump file, so reruns can skip it.
+
+Decompressing and parsing a dump takes far longer than reading back
+what came out of it, so the results for each file are saved in a cache
+directory, keyed by the file's path, size and modification time plus a
+version string which changes whenever the processing does.
+
+Each cache file is a header, a series of compressed chunks of JSON
+lines, an index of the chunks, and a footer pointing at the index.
+Chunks are compressed with zstd if the zstandard package is installed,
+and zlib otherwise.
+
+"""
+
+
+from functools import partial
+import hashlib
+import json
+import os
+from pathlib import Path
+import struct
+import tempfile
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b'ESC1'
+FOOTER = struct.Struct('<Q4s')
+DOCUMENTS_PER_CHUNK = 10000
+
+
+def default_directory():
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'edit-summaries'
+
+
+def function_version(function, version):
+    """Return a cache version string for the output of function.
+
+    version should be bumped whenever function's output changes.
+    function may be a functools.partial, in which case the arguments it
+    binds are part of the version, so they need a repr() which
+    identifies them.
+
+    """
+    arguments = ''
+    if isinstance(function, partial):
+        arguments = repr((function.args, sorted(function.keywords.items())))
+        function = function.func
+    return f'{function.__module__}.{function.__qualname__}{arguments}:{version}'
+
+
+class DocumentCache:
+    """A directory of cached processing results, limited to max_bytes in total.
+
+    version identifies what produced the results; entries written with
+    a different version are never used.  With rebuild=True, existing
+    entries are ignored (and replaced).
+
+    """
+    def __init__(self, directory, version, max_bytes=10 * 2**30, rebuild=False):
+        self.directory = Path(directory)
+        self.version = version
+        self.max_bytes = max_bytes
+        self.rebuild = rebuild
+
+
+    def entry_path(self, path):
+        stat = os.stat(path)
+        key = f'{os.path.abspath(path)}\t{stat.st_size}\t{stat.st_mtime_ns}\t{self.version}'
+        return self.directory / f'{hashlib.sha256(key.encode()).hexdigest()}.cache'
+
+
+    def open(self, path):
+        """Return a CacheReader for path's results, or None if there isn't one."""
+        if self.rebuild:
+            return None
+        entry_path = self.entry_path(path)
+        try:
+            reader = CacheReader(entry_path)
+        except (OSError, ValueError, struct.error):
+            return None
+        # Record the use, for least-recently-used eviction.
+        os.utime(entry_path)
+        return reader
+
+
+    def writer(self, path):
+        """Return a CacheWriter which will become the entry for path once committed."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return CacheWriter(self.entry_path(path), on_commit=self.evict)
+
+
+    def evict(self):
+        """Delete the least recently used entries until the total size is under max_bytes."""
+        entries = []
+        for entry_path in self.directory.glob('*.cache'):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total -= size
+
+
+class CacheWriter:
+    """Write a cache entry.
+
+    Nothing is visible at entry_path until commit() is called; an entry
+    which is abandoned part way through (e.g. because the run stopped
+    early) is discarded by abort().
+
+    """
+    def __init__(self, entry_path, on_commit=None):
+        self.entry_path = Path(entry_path)
+        self.on_commit = on_commit
+        fd, self.temp_path = tempfile.mkstemp(dir=self.entry_path.parent, suffix='.tmp')
+        self.file = open(fd, 'wb')
+        self.codec = b's' if zstandard else b'z'
+        self.compressor = zstandard.ZstdCompressor() if zstandard else None
+        self.file.write(MAGIC + self.codec)
+        self.chunks = []
+        self.documents = []
+        self.document_count = 0
+
+
+    def add(self, document):
+        self.documents.append(document)
+        if len(self.documents) >= DOCUMENTS_PER_CHUNK:
+            self._write_chunk()
+
+
+    def commit(self, line_count=None):
+        """Finish the entry.  line_count is the number of input lines it covers."""
+        if self.documents:
+            self._write_chunk()
+        index_offset = self.file.tell()
+        self.file.write(json.dumps({'chunks': self.chunks,
+                                    'documents': self.document_count,
+                                    'lines': line_count,
+                                    }).encode())
+        self.file.write(FOOTER.pack(index_offset, MAGIC))
+        self.file.close()
+        os.replace(self.temp_path, self.entry_path)
+        if self.on_commit:
+            self.on_commit()
+
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temp_path)
+
+
+    def _write_chunk(self):
+        data = b'\n'.join(_dumps(document) for document in self.documents)
+        if self.compressor:
+            data = self.compressor.compress(data)
+        else:
+            data = zlib.compress(data, 1)
+        self.chunks.append([self.file.tell(), len(data), len(self.documents)])
+        self.file.write(data)
+        self.document_count += len(self.documents)
+        self.documents = []
+
+
+class CacheReader:
+    """Iterate over the documents in a cache entry."""
+    def __init__(self, entry_path):
+        self.entry_path = Path(entry_path)
+        with open(self.entry_path, 'rb') as f:
+            header = f.read(len(MAGIC) + 1)
+            footer_offset = f.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if header[:len(MAGIC)] != MAGIC or magic != MAGIC:
+                raise ValueError(f'{self.entry_path} is not a cache file')
+            f.seek(index_offset)
+            index = json.loads(f.read(footer_offset - index_offset))
+        self.codec = header[len(MAGIC):]
+        if self.codec == b's' and zstandard is None:
+            raise ValueError(f'{self.entry_path} needs zstandard to read')
+        self.chunks = index['chunks']
+        self.document_count = index['documents']
+        self.line_count = index['lines']
+
+
+    def __iter__(self):
+        decompressor = zstandard.ZstdDecompressor() if self.codec == b's' else None
+        with open(self.entry_path, 'rb') as f:
+            for offset, length, _ in self.chunks:
+                f.seek(offset)
+                data = f.read(length)
+                data = decompressor.decompress(data) if decompressor else zlib.decompress(data)
+                for line in data.split(b'\n'):
+                    yield _loads(line)
+
+
+def _dumps(document):
+    return orjson.dumps(document) if orjson else json.dumps(document).encode()
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
@@ -0,0 +1,124 @@
+"""
+Split edit summaries into a section, the human-written text and tags.
+
+A summary may start with a /* section */ link, which MediaWiki adds
+when a section is edited.  Summaries which MediaWiki wrote itself
+(autosummaries, such as "Created page with ..." or the '*' early
+versions stored for an empty summary) have no human text.  Tags say
+what tool, if any, made the edit: undo, rollback, AWB, Twinkle and so
+on, in the wordings used on the larger wikis.
+
+All the tag patterns are compiled into a single regular expression, so
+a summary is scanned once for all of them, and only if it contains one
+of a few keywords (which takes a single fast scan).
+
+"""
+
+
+from collections import namedtuple
+import re
+
+
+Comment = namedtuple('Comment', ['section', 'text', 'tags'])
+
+AUTOSUMMARY_TAG = 'autosummary'
+
+# Autosummaries start with a link like [[WP:AES|←]] on most wikis;
+# older English ones have no link.
+AUTOSUMMARY_PATTERNS = [
+    r'\[\[[^\[\]|]*\|←\]\]',
+    r"Created page with '",
+    r'Redirected page to \[\[',
+    r'Removed redirect to \[\[',
+    r"Replaced content with '",
+    r'Blanked the page$',
+]
+
+# Maps tags to the patterns which identify them.
+TAG_PATTERNS = {
+    'undo': [r'Undid revision \d',
+             r'Undo revision \d',
+             r'Änderung \d+ von .*? rückgängig gemacht',
+             r'Annulation de(?:s modifications| la modification) \d',
+             r'Deshecha la edición \d',
+             r'Annullata la modifica \d',
+             r'Отмена правки \d',
+             r'Anulowanie wersji \d',
+             ],
+    'rollback': [r'Reverted (?:\d+ )?edits? by ',
+                 r'Änderungen von .*? rückgängig gemacht und letzte Version von',
+                 r'Révocation des modifications de',
+                 r'Revertidos los cambios de',
+                 r'Annullate le modifiche di',
+                 r'Wijzigingen door .*? hersteld',
+                 r'Откат правок',
+                 r'Wycofano edycje',
+                 ],
+    'awb': [r'\bAWB\b'],
+    'twinkle': [r'\[\[[^\[\]|]*:TW\b',
+                r'\bTwinkle\b',
+                ],
+    'huggle': [r'\[\[[^\[\]|]*:HG\b',
+               r'\bHuggle\b',
+               ],
+    'hotcat': [r'\bHotCat\b'],
+    'refill': [r'\b(?:REFILL|ReFill|Refill|reFill)\b'],
+    'iabot': [r'#IABot\b'],
+}
+
+# Every match of a TAG_PATTERN contains one of these.  Searching for
+# them first is much faster than trying all the patterns at every
+# position, especially as they start with characters which are
+# uncommon in summaries (so most positions are skipped in C), and
+# few summaries contain any of them.
+TAG_KEYWORDS = ['Undid', 'Undo', 'Änderung', 'Annul', 'Deshecha', 'Отмена', 'Anulowanie',
+                'Reverted', 'Révocation', 'Revertidos', 'Wijzigingen', 'Откат', 'Wycofano',
+                'AWB', 'TW', 'Twinkle', 'HG', 'Huggle', 'HotCat', 'FILL', 'Fill', 'Refill', 'IABot']
+
+
+def _compile(tag_patterns):
+    groups = [f'(?P<{tag}>{"|".join(patterns)})' for tag, patterns in tag_patterns.items()]
+    return re.compile('|'.join(groups))
+
+
+_AUTOSUMMARY = re.compile('|'.join(AUTOSUMMARY_PATTERNS))
+_TAGS = _compile(TAG_PATTERNS)
+_TAG_KEYWORDS = re.compile('|'.join(TAG_KEYWORDS))
+
+_AUTOSUMMARY_COMMENT = Comment('', '', (AUTOSUMMARY_TAG,))
+
+# Twice as fast as calling Comment(), which matters here.
+_new_tuple = tuple.__new__
+
+
+def classify(comment):
+    """Return the Comment for an (unescaped) edit summary.
+
+    text is what's left after the section link (not stripped, so it
+    usually starts with a space), or '' for an autosummary.  tags is a
+    sorted tuple.
+
+    """
+    if comment == '*' or _AUTOSUMMARY.match(comment):
+        return _AUTOSUMMARY_COMMENT
+    section = ''
+    text = comment
+    if comment.startswith('/*'):
+        end = comment.find('*/')
+        if end >= 0:
+            section = comment[2:end].strip()
+            text = comment[end + 2:]
+    tags = ()
+    if _TAG_KEYWORDS.search(text):
+        tags = tuple(sorted({match.lastgroup for match in _TAGS.finditer(text)}))
+    return _new_tuple(Comment, (section, text, tags))
+
+
+def get_human_text(text):
+    """Return the human-written part of an edit summary, or '' if there isn't one."""
+    return classify(text).text
+
+
+def get_section(text):
+    """Return the section name from a leading /* section */ in text, or ''."""
+    return classify(text).section
@@ -0,0 +1,257 @@
+"""
+Find repeated and near-duplicate summaries, and drop, collapse or tag them.
+
+Many summaries are boilerplate: "typo", "Reverted edits by X (talk)
+to last version by Y", and whatever tools write.  Deduplicator
+normalizes each summary (casefolding, and masking numbers, URLs and
+link targets), and looks it up in a table of templates by a 64-bit
+hash of the normalized text.  If that's new, it's looked up by its
+SimHash instead, which differs in only a few bits between summaries
+that differ in a word or two; the SimHashes are split into bands, so
+that candidates within distance bits share a band and can be found
+with dict lookups.
+
+A summary becomes a template once it (or near-duplicates of it) has
+been seen min_count times, and from then on its documents are
+
+- dropped, or
+- collapsed: left out, and counted in the ct field of a single
+  document sent for the template at the end, or
+- tagged 'template'.
+
+Memory is bounded by capacity, the number of entries in the table.
+When it's full, the least common summaries are forgotten (as in lossy
+counting), so for very large inputs the counts are approximate, but
+frequent templates survive.  report() summarizes what was saved.
+
+"""
+
+
+from functools import lru_cache
+from hashlib import blake2b
+import re
+
+from load.stats import STATS
+
+
+MODES = ('drop', 'collapse', 'tag')
+
+TEMPLATE_TAG = 'template'
+
+# SimHashes are computed from at most this many words, so the per-bit
+# counts fit in a byte each.
+MAX_WORDS = 127
+
+_DEDUPLICATED = {mode: STATS.key('docs_deduplicated', mode=mode) for mode in MODES}
+
+_URL = re.compile(r'https?://\S+')
+_LINK = re.compile(r'\[\[([^\[\]|:]*:)?[^\[\]]*\]\]')
+_NUMBER = re.compile(r'\d+')
+
+_LANE_ONES = int.from_bytes(b'\x01' * 64, 'big')
+_LANE_HIGH_BITS = int.from_bytes(b'\x80' * 64, 'big')
+_DIGITS_TO_LANES = bytes.maketrans(b'01', b'\x00\x01')
+_LANES_TO_DIGITS = bytes.maketrans(b'\x00\x80', b'01')
+
+
+def normalize(text):
+    """Return text with the parts which vary between uses of a template masked."""
+    if '://' in text:
+        text = _URL.sub('url', text)
+    if '[[' in text:
+        text = _LINK.sub(_mask_link, text)
+    text = _NUMBER.sub('0', text)
+    return ' '.join(text.casefold().split())
+
+
+def simhash(text):
+    """Return the 64-bit SimHash of the words in text.
+
+    Each bit is set if it's set in the hashes of more than half the
+    words.
+
+    """
+    words = text.split()[:MAX_WORDS]
+    if not words:
+        return 0
+    # Each word's hash is spread over 64 byte-wide lanes, one per bit,
+    # so adding them counts the words with each bit set.  Adding
+    # 128 - threshold to every lane then sets the top bit of the lanes
+    # which reached it.
+    total = sum(map(_spread_hash, words)) + (127 - len(words) // 2) * _LANE_ONES
+    digits = (total & _LANE_HIGH_BITS).to_bytes(64, 'big').translate(_LANES_TO_DIGITS)
+    return int(digits, 2)
+
+
+class Template:
+    """A summary (or family of near-duplicate summaries) and how often it's been seen."""
+    __slots__ = ('db', 'simhash', 'count', 'collapsed', 'document')
+
+
+    def __init__(self, db, simhash):
+        self.db = db
+        self.simhash = simhash
+        self.count = 0
+        self.collapsed = 0
+        self.document = None
+
+
+class Deduplicator:
+    """Drop, collapse or tag documents whose summaries are templates.
+
+    mode is one of MODES.  Summaries are only matched against others
+    from the same wiki, and near-duplicates are those whose SimHashes
+    are at most distance bits apart.
+
+    """
+    def __init__(self, mode, min_count=2, capacity=2**20, distance=3):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}, not {mode!r}')
+        if min_count < 1:
+            raise ValueError('min_count must be at least 1')
+        self.mode = mode
+        self.min_count = min_count
+        self.capacity = capacity
+        self.distance = distance
+        self.templates = {}
+        # distance + 1 bands, so two SimHashes that close agree in at
+        # least one of them.
+        width = 64 // (distance + 1)
+        self.band_shifts = [i * width for i in range(distance + 1)]
+        self.band_mask = (1 << width) - 1
+        self.bands = [{} for _ in range(distance + 1)]
+        self.doc_count = 0
+        self.template_doc_count = 0
+        self.sent_count = 0
+        self.doc_bytes = 0
+        self.sent_bytes = 0
+        self.prune_count = 0
+
+
+    def filter(self, documents):
+        """Iterate over documents, minus those dropped or collapsed, plus collapsed ones."""
+        mode = self.mode
+        for doc in documents:
+            if len(self.templates) >= self.capacity:
+                yield from self._prune()
+            self.doc_count += 1
+            size = _size(doc)
+            self.doc_bytes += size
+            template = self.find(doc['db'], doc['co'])
+            template.count += 1
+            if template.count >= self.min_count:
+                self.template_doc_count += 1
+                STATS.counters[_DEDUPLICATED[mode]] += 1
+                if mode == 'drop':
+                    continue
+                if mode == 'collapse':
+                    if template.document is None:
+                        template.document = doc
+                    template.collapsed += 1
+                    continue
+                # A new dict: doc may also be on its way into the cache.
+                doc = dict(doc, tg=sorted(set(doc['tg']) | {TEMPLATE_TAG}))
+            self.sent_count += 1
+            self.sent_bytes += size
+            yield doc
+        if mode == 'collapse':
+            yield from self._collapsed({id(template): template for template in self.templates.values()})
+
+
+    def find(self, db, text):
+        """Return the Template for a summary from the wiki db, adding one if it's new."""
+        normalized = normalize(text)
+        key = _hash(f'{db}\t{normalized}')
+        template = self.templates.get(key)
+        if template is not None:
+            return template
+        fingerprint = simhash(normalized)
+        mask = self.band_mask
+        bands = [(fingerprint >> shift) & mask for shift in self.band_shifts]
+        for band, table in zip(bands, self.bands):
+            for candidate in table.get(band, ()):
+                if candidate.db == db and (candidate.simhash ^ fingerprint).bit_count() <= self.distance:
+                    self.templates[key] = candidate
+                    return candidate
+        template = Template(db, fingerprint)
+        self.templates[key] = template
+        for band, table in zip(bands, self.bands):
+            table.setdefault(band, []).append(template)
+        return template
+
+
+    def report(self):
+        """Return a one-line summary of what deduplication saved."""
+        if not self.doc_count:
+            return 'deduplication: no documents'
+        templates = len({id(template) for template in self.templates.values()
+                         if template.count >= self.min_count})
+        action = {'drop': 'dropped', 'collapse': 'collapsed', 'tag': 'tagged'}[self.mode]
+        saved = 1 - self.sent_bytes / self.doc_bytes
+        return (f'deduplication: {self.template_doc_count} of {self.doc_count} docs {action} '
+                f'({templates} templates), {self.sent_count} docs sent, '
+                f'~{(self.doc_bytes - self.sent_bytes) / 2**20:.1f} MB ({saved:.1%}) of source saved')
+
+
+    def _prune(self):
+        """Forget the least common summaries until the table is half full.
+
+        In collapse mode, yield the documents for forgotten templates.
+
+        """
+        self.prune_count += 1
+        threshold = 1
+        forgotten = {}
+        while len(self.templates) > self.capacity // 2:
+            for key, template in list(self.templates.items()):
+                if template.count <= threshold:
+                    del self.templates[key]
+                    forgotten[id(template)] = template
+            threshold *= 2
+        kept = {id(template) for template in self.templates.values()}
+        if self.mode == 'collapse':
+            yield from self._collapsed({key: template for key, template in forgotten.items() if key not in kept})
+        for table in self.bands:
+            for band, candidates in list(table.items()):
+                candidates = [template for template in candidates if id(template) in kept]
+                if candidates:
+                    table[band] = candidates
+                else:
+                    del table[band]
+
+
+    def _collapsed(self, templates):
+        # Yield the document standing in for each collapsed template in
+        # the dict templates, and reset them.
+        for template in templates.values():
+            if not template.collapsed:
+                continue
+            doc = dict(template.document,
+                       ct=template.collapsed,
+                       tg=sorted(set(template.document['tg']) | {TEMPLATE_TAG}))
+            template.document = None
+            template.collapsed = 0
+            self.sent_count += 1
+            self.sent_bytes += _size(doc)
+            yield doc
+
+
+def _hash(text):
+    return int.from_bytes(blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+@lru_cache(maxsize=2**16)
+def _spread_hash(word):
+    # The lanes are bytes, with lane i (counting from the right) holding
+    # bit i of the word's hash.
+    return int.from_bytes(f'{_hash(word):064b}'.encode().translate(_DIGITS_TO_LANES), 'big')
+
+
+def _mask_link(match):
+    return f'[[{match[1] or ""}]]'
+
+
+def _size(doc):
+    # Roughly the length of doc's JSON, for the report: there are
+    # about 8 bytes of quotes and punctuation per field.
+    return len(doc['co']) + len(doc['un']) + len(doc['se']) + len(doc['ts']) + 8 * len(doc) + 25
@@ -7,73 +7,227 @@ Extract edit comments.
 
 
 import argparse
-import bz2
 from collections import namedtuple
+from datetime import datetime
+from functools import partial
 import json
 from pathlib import Path
-
-from load.schema import field_names, unescape_tnr, escape_tnr, build_row
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from load.block_index import BlockFilter
+from load.cache import DocumentCache, default_directory, function_version
+from load.comment_classifier import classify, get_human_text
+from load.parquet_writer import write_parquet
+from load.pipeline import expand_paths, run
+from load.row_filter import DEFAULT_FILTER, RowFilter
+from load.schema import field_names, unescape_tnr, escape_tnr, build_row, make_decoder
+from load.stats import STATS, StatsReporter, profiling
 
 EscapedRow = namedtuple("EscapedRow", field_names)
 
+# Bump this whenever the output of process_as_tuples(), process_as_rows()
+# or get_records() changes, so cached output isn't reused.
+OUTPUT_VERSION = 3
+
+_DOCUMENTS = STATS.key('documents')
+_AUTOSUMMARY = STATS.key('rows_filtered', reason='autosummary')
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('filename',
-                        help='input file (must be in tsv-bz2 format)')
+                        nargs='+',
+                        help='input files or glob patterns (must be in tsv-bz2 format)')
     parser.add_argument('--tuple',
                         default=True,
                         action=argparse.BooleanOptionalAction,
                         help='Use the high-speed NamedTuple parsing strategy')
+    parser.add_argument('--bz2-workers',
+                        type=int,
+                        default=0,
+                        help='number of processes to decompress with (default: decompress inline)')
+    parser.add_argument('--ordered',
+                        default=True,
+                        action=argparse.BooleanOptionalAction,
+                        help='preserve input order when decompressing in parallel')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help='number of processes to parse with (default: parse inline)')
+    parser.add_argument('--entity',
+                        nargs='+',
+                        default=['revision'],
+                        help='event entities to keep (default: %(default)s)')
+    parser.add_argument('--namespace',
+                        type=int,
+                        nargs='+',
+                        help='page namespaces to keep (default: all)')
+    parser.add_argument('--since',
+                        type=timestamp,
+                        help='keep events at or after this time, e.g. 2023-01-01 or "2023-01-01 12:00:00"')
+    parser.add_argument('--until',
+                        type=timestamp,
+                        help='keep events before this time')
+    parser.add_argument('--include-bots',
+                        default=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='keep edits by bots')
+    parser.add_argument('--cache',
+                        default=True,
+                        action=argparse.BooleanOptionalAction,
+                        help='read and save processed input in the local cache')
+    parser.add_argument('--rebuild-cache',
+                        action='store_true',
+                        help='ignore (and replace) existing cache entries')
+    parser.add_argument('--cache-dir',
+                        default=default_directory(),
+                        help='cache directory (default: %(default)s)')
+    parser.add_argument('--cache-size',
+                        type=float,
+                        default=10,
+                        help='maximum total size of the cache, in GB (default: %(default)s)')
+    parser.add_argument('--stats-interval',
+                        type=float,
+                        default=60,
+                        help='seconds between stats lines on stderr (0: only at the end)')
+    parser.add_argument('--prometheus-file',
+                        help='also write stats to this file, in Prometheus text format')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='viztracer.json',
+                        help='trace the run with viztracer, writing to this file (default: %(const)s)')
+    parser.add_argument('--format',
+                        choices=['json', 'parquet'],
+                        default='json',
+                        help='output format (default: %(default)s)')
+    parser.add_argument('--output', '-o',
+                        help='output file (required for parquet; json goes to stdout)')
+    parser.add_argument('--row-group-size',
+                        type=int,
+                        default=1000000,
+                        help='number of records per parquet row group')
     args = parser.parse_args()
+    if args.format == 'parquet' and not args.output:
+        parser.error('--format parquet requires --output')
 
-    if args.tuple:
-        process_as_tuples(args.filename)
+    if args.format == 'parquet':
+        process = get_records
     else:
-        process_as_rows(args.filename)
-
-
-def process_as_tuples(filename):
-    for row in get_tuples(filename):
-        if row.event_entity == 'revision':
-            comment = unescape_tnr(row.event_comment_escaped)
-            if comment and not row.event_user_is_bot_by_string:
-                human_comment = get_human_text(comment)
-                if human_comment:
-                    data = {'timestamp': row.event_timestamp,
-                            'comment': human_comment,
-                            'username': unescape_tnr(row.event_user_text_escaped),
-                            }
-                    print(json.dumps(data))
-
-
-def get_tuples(filename):
-    with bz2.open(filename, 'rt') as f:
-        for line in f:
-            yield EscapedRow(*line.split('\t'))
-
-
-def process_as_rows(filename):
-    for row in get_rows(filename):
-            if row.event_entity == 'revision' and row.event_comment and not row.event_user_is_bot_by:
-                summary = get_human_text(row.event_comment)
-                if summary:
-                    print(escape_tnr(summary))
-
-
-def get_rows(filename):
-    with bz2.open(filename, 'rt') as f:
-        for line in f:
-            yield build_row(line)
-
-
-def get_human_text(text):
-    if text == '*':
-        return ''
-    if text.startswith('[[WP:AES|\u2190]]'):
-        return ''
-    if text.startswith('/*') and '*/' in text:
-        return text[text.find('*/') + 2:]
-    return text
+        process = process_as_tuples if args.tuple else process_as_rows
+    process = partial(process, row_filter=RowFilter(args.entity, args.namespace, args.include_bots,
+                                                    since=args.since, until=args.until))
+    # Dumps with a block index (see load.block_index) are only read
+    # where there can be rows in this range and these namespaces.
+    block_filter = None
+    if args.since or args.until or args.namespace:
+        block_filter = BlockFilter(args.since, args.until, args.namespace)
+    cache = None
+    if args.cache:
+        cache = DocumentCache(args.cache_dir,
+                              function_version(process, OUTPUT_VERSION),
+                              int(args.cache_size * 2**30),
+                              args.rebuild_cache)
+    with profiling(args.profile), StatsReporter(args.stats_interval, args.prometheus_file):
+        outputs = run(process,
+                      expand_paths(args.filename),
+                      args.workers,
+                      report=lambda summary: print(summary, file=sys.stderr),
+                      bz2_workers=args.bz2_workers,
+                      ordered=args.ordered,
+                      cache=cache,
+                      encoding=None,
+                      block_filter=block_filter)
+        if args.format == 'parquet':
+            count = write_parquet(outputs, args.output, args.row_group_size)
+            print(f'{count} records written to {args.output}', file=sys.stderr)
+        else:
+            sys.stdout.writelines(text + '\n' for text in outputs)
+
+
+def process_as_tuples(lines, row_filter=DEFAULT_FILTER):
+    """Iterate over the output records (as JSON strings) for lines."""
+    for row in get_tuples(row_filter.filter(lines)):
+        comment = unescape_tnr(row.event_comment_escaped)
+        human_comment = get_human_text(comment)
+        if not human_comment:
+            STATS.counters[_AUTOSUMMARY] += 1
+            continue
+        STATS.counters[_DOCUMENTS] += 1
+        data = {'timestamp': row.event_timestamp,
+                'comment': human_comment,
+                'username': unescape_tnr(row.event_user_text_escaped),
+                }
+        yield _dumps(data)
+
+
+def get_records(lines, row_filter=DEFAULT_FILTER):
+    """Iterate over the output records (as dicts of parquet_writer.COLUMNS) for lines.
+
+    Rows for entities other than revisions have a revision_id of None.
+
+    """
+    for row in get_tuples(row_filter.filter(lines)):
+        comment = classify(unescape_tnr(row.event_comment_escaped))
+        if not comment.text:
+            STATS.counters[_AUTOSUMMARY] += 1
+            continue
+        STATS.counters[_DOCUMENTS] += 1
+        yield {'wiki_db': row.wiki_db,
+               'revision_id': int(row.revision_id) if row.revision_id else None,
+               'timestamp': row.event_timestamp,
+               'user': unescape_tnr(row.event_user_text_escaped),
+               'page': unescape_tnr(row.page_title_escaped),
+               'section': comment.section,
+               'comment': comment.text,
+               'tags': list(comment.tags),
+               }
+
+
+def get_tuples(lines):
+    for line in lines:
+        yield EscapedRow(*line.split('\t'))
+
+
+def process_as_rows(lines, row_filter=DEFAULT_FILTER):
+    """Iterate over the output records (as escaped strings) for lines."""
+    for row in get_rows(row_filter.filter(lines), ['event_comment']):
+        summary = get_human_text(row.event_comment)
+        if not summary:
+            STATS.counters[_AUTOSUMMARY] += 1
+            continue
+        STATS.counters[_DOCUMENTS] += 1
+        yield escape_tnr(summary)
+
+
+def get_rows(lines, columns=None):
+    """Iterate over lines, decoded as rows.
+
+    If columns is given, only those Row fields are decoded (see
+    load.schema.make_decoder()); otherwise full Rows are built.
+
+    """
+    decode = build_row if columns is None else make_decoder(columns)
+    for line in lines:
+        yield decode(line)
+
+
+def timestamp(text):
+    """Return a date or date and time as an event_timestamp string, for comparing with them."""
+    try:
+        return datetime.fromisoformat(text).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a date or time: {text!r}') from None
+
+
+def _dumps(data):
+    # Compact and not ASCII-escaped, with or without orjson.
+    if orjson:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+"""
+Remember how far each wiki has been loaded, so the next load can skip it.
+
+A wiki's high-water mark is the (event_timestamp, revision_id) of the
+latest revision loaded from it.  The marks are kept in a JSON state
+file, and on the next run rows at or below a wiki's mark are skipped:
+whole input files, when their name says they only cover an earlier
+period, and otherwise rows, by load.row_filter.RowFilter before they
+are decoded.
+
+The mediawiki_history dumps are split into files by period, named
+like 2023-03.enwiki.2022.tsv.bz2 (a year) or 2023-03.enwiki.2023-02.tsv.bz2
+(a month); small wikis have a single .all-time. file, which is never
+skipped.
+
+A mark is the latest revision loaded, not a record of which files
+were, so period files must be loaded in chronological order: once a
+later period is loaded, earlier ones are skipped as if they had been
+too.  For the same reason marks don't work with the XML history dumps,
+whose files are split by page range, each covering all of time.
+
+"""
+
+
+import json
+import os
+from pathlib import Path
+import re
+
+
+STATE_VERSION = 1
+
+PERIOD_FILE = re.compile(r'(?:^|\.)(?P<wiki>[^.]+)\.(?P<year>\d{4})(?:-(?P<month>\d{2}))?\.tsv\.bz2$')
+
+
+class HighWaterMarks:
+    """The high-water marks in the state file at path.
+
+    marks holds those saved by earlier runs.  observe() each document
+    as it's loaded, and save() once the run has completed.
+
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.marks = self._load()
+        self.seen = {}
+
+
+    def covers(self, document):
+        """Return whether document is at or below its wiki's mark."""
+        mark = self.marks.get(document['db'])
+        return mark is not None and (document['ts'], int(document['id'])) <= mark
+
+
+    def covers_file(self, path):
+        """Return whether the file at path only covers a period before its wiki's mark."""
+        match = PERIOD_FILE.search(Path(path).name)
+        if match is None or match['wiki'] not in self.marks:
+            return False
+        year = int(match['year'])
+        if match['month']:
+            month = int(match['month'])
+            end = f'{year + month // 12:04}-{month % 12 + 1:02}'
+        else:
+            end = f'{year + 1:04}'
+        return self.marks[match['wiki']][0] >= end
+
+
+    def observe(self, document):
+        key = (document['ts'], int(document['id']))
+        if key > self.seen.get(document['db'], ('', 0)):
+            self.seen[document['db']] = key
+
+
+    def save(self):
+        """Save the marks, raised to cover everything observed."""
+        for wiki, mark in self.seen.items():
+            self.marks[wiki] = max(mark, self.marks.get(wiki, mark))
+        state = {'version': STATE_VERSION,
+                 'wikis': {wiki: {'event_timestamp': timestamp, 'revision_id': revision_id}
+                           for wiki, (timestamp, revision_id) in sorted(self.marks.items())},
+                 }
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        temp_path.write_text(json.dumps(state, indent=1) + '\n')
+        os.replace(temp_path, self.path)
+
+
+    def _load(self):
+        try:
+            state = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return {}
+        if state.get('version') != STATE_VERSION:
+            raise ValueError(f'{self.path}: unknown state file version {state.get("version")!r}')
+        return {wiki: (mark['event_timestamp'], mark['revision_id']) for wiki, mark in state['wikis'].items()}
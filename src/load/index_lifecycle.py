@@ -0,0 +1,126 @@
+"""
+Create, tune and publish the edit comment index around a bulk load.
+
+An index created here has an explicit mapping (INDEX_MAPPINGS) rather
+than whatever dynamic mapping guesses from the first document.
+
+While bulk_load_settings() is in effect, the index is never refreshed
+and has no replicas, so the cluster only writes each batch once and
+doesn't build searchable segments that are about to be merged away.
+At the end the previous settings are restored and the index is
+force-merged.
+
+To reload without taking the index away from searchers, load into a
+fresh versioned_name() index and then swap_alias() so the alias points
+at it instead of the old one, in one atomic update.
+
+"""
+
+
+from contextlib import contextmanager
+import time
+
+import opensearchpy
+
+
+# Matches the ts values produced by load.load_comments.get_documents().
+TIMESTAMP_FORMAT = 'yyyy-MM-dd HH:mm:ss.S'
+
+INDEX_SETTINGS = {
+    'analysis': {
+        'analyzer': {
+            # Comments are short, multilingual and full of wiki markup;
+            # fold case and accents, and split on punctuation.
+            'comment': {'type': 'custom',
+                        'tokenizer': 'standard',
+                        'filter': ['lowercase', 'asciifolding'],
+                        },
+        },
+    },
+}
+
+INDEX_MAPPINGS = {
+    'dynamic': 'strict',
+    'properties': {
+        'id': {'type': 'keyword'},
+        'db': {'type': 'keyword'},
+        'ts': {'type': 'date', 'format': TIMESTAMP_FORMAT},
+        'co': {'type': 'text', 'analyzer': 'comment'},
+        'un': {'type': 'keyword'},
+        'se': {'type': 'keyword'},
+        'tg': {'type': 'keyword'},
+        # Documents standing for ct others, with load-comments --dedup collapse.
+        'ct': {'type': 'integer'},
+    },
+}
+
+
+def create_index(client, name, shards=1, replicas=1):
+    """Create the index called name, with INDEX_SETTINGS and INDEX_MAPPINGS."""
+    body = {'settings': {'index': dict(INDEX_SETTINGS,
+                                       number_of_shards=shards,
+                                       number_of_replicas=replicas)},
+            'mappings': INDEX_MAPPINGS,
+            }
+    client.indices.create(index=name, body=body)
+
+
+def versioned_name(alias):
+    """Return a name for a new index to put behind alias."""
+    return f'{alias}-{time.strftime("%Y%m%d-%H%M%S")}'
+
+
+@contextmanager
+def bulk_load_settings(client, name, force_merge=True, merge_timeout=3600):
+    """Turn off refresh and replicas on the index called name during the with block.
+
+    On exit, the previous settings are restored and the index is
+    refreshed and, if the block finished without an exception and
+    force_merge is true, force-merged to a single segment.
+
+    """
+    settings = client.indices.get_settings(index=name)[name]['settings']['index']
+    # None resets a setting to its default, for ones not set explicitly.
+    previous = {'refresh_interval': settings.get('refresh_interval'),
+                'number_of_replicas': settings.get('number_of_replicas'),
+                }
+    print(f'suspending refresh and replicas on {name}')
+    client.indices.put_settings(index=name, body={'index': {'refresh_interval': '-1',
+                                                            'number_of_replicas': 0}})
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        print(f'restoring settings on {name}: {previous}')
+        client.indices.put_settings(index=name, body={'index': previous})
+        client.indices.refresh(index=name)
+        if completed and force_merge:
+            print(f'force-merging {name}')
+            client.indices.forcemerge(index=name, max_num_segments=1, request_timeout=merge_timeout)
+
+
+def swap_alias(client, alias, name, delete_old=False):
+    """Point alias at the index called name, and only at it.
+
+    Return the names of the indices it pointed at before, which are
+    deleted if delete_old is true.  Raises ValueError if there is an
+    index (rather than an alias) called alias.
+
+    """
+    if client.indices.exists(index=alias) and not client.indices.exists_alias(name=alias):
+        raise ValueError(f'{alias} is an index, not an alias; delete it or choose another name')
+    try:
+        old = sorted(client.indices.get_alias(name=alias))
+    except opensearchpy.exceptions.NotFoundError:
+        old = []
+    actions = [{'remove': {'index': index, 'alias': alias}} for index in old if index != name]
+    actions.append({'add': {'index': name, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+    print(f'{alias} now points at {name}' + (f' instead of {", ".join(old)}' if old else ''))
+    old = [index for index in old if index != name]
+    if delete_old:
+        for index in old:
+            print(f'deleting {index}')
+            client.indices.delete(index=index)
+    return old
@@ -7,33 +7,80 @@ Extract edit comments and load into opensearch.
 
 
 import argparse
-import bz2
+from array import array
+import asyncio
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from itertools import islice
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice, zip_longest
 import json
 import os
 from pathlib import Path
 from pprint import pprint
+import re
+import statistics
+import sys
+import threading
+import time
 
 import opensearchpy
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+from from_dumps.get_summaries import get_documents as get_xml_documents
+from load.cache import DocumentCache, default_directory, function_version
+from load.comment_classifier import classify
+from load.dedup import MODES as DEDUP_MODES, Deduplicator
+from load.high_water_mark import HighWaterMarks
+from load.index_lifecycle import bulk_load_settings, create_index, swap_alias, versioned_name
+from load.pipeline import expand_paths, run
+from load.row_filter import DEFAULT_FILTER, RowFilter
 from load.schema import field_names, unescape_tnr, escape_tnr, build_row
+from load.stats import STATS, StatsReporter, profiling
 
 EscapedRow = namedtuple("EscapedRow", field_names)
 
+# Bump this whenever the documents produced by get_documents() (or
+# from_dumps.get_summaries.get_documents()) change, so cached documents
+# aren't reused.
+DOCUMENT_VERSION = 3
+
+# Values of --op-type.  'index' replaces a document with the same _id,
+# while 'create' leaves it alone.
+OP_TYPES = ('index', 'create')
+
+# Per-item statuses which are worth retrying.  'N/A' is what the bulk
+# helpers report when the request failed to get a response at all.
+RETRY_STATUSES = {429, 502, 503, 504, 'N/A'}
+
+SUCCESS_STATUSES = range(200, 300)
+
+# TSV dumps are named like 2023-03.enwiki.2022-01.tsv.bz2, and XML
+# ones like enwiki-20230301-pages-meta-history1.xml-p1p844.bz2.
+_DUMP_FILE = re.compile(r'[^.]+\.(?P<tsv>[^.]+)\..*\.tsv\.bz2$|(?P<xml>[^-.]+)-.*\.xml.*\.bz2$')
+
+_DOCUMENTS = STATS.key('documents')
+_AUTOSUMMARY = STATS.key('rows_filtered', reason='autosummary')
+
 
 def main():
     args = parse_command_line()
     config = read_config()
-    auth = (config['auth']['user'], config['auth']['password'])
+    client_options = {'http_auth': (config['auth']['user'], config['auth']['password']),
+                      'use_ssl': True,
+                      'verify_certs': False,
+                      'ssl_show_warn': False,
+                      'http_compress': args.compress,
+                      }
     client = opensearchpy.OpenSearch(hosts=[f'{args.host}:{args.port}'],
-                                     http_auth=auth,
-                                     use_ssl=True,
-                                     verify_certs=False,
-                                     ssl_show_warn=False,
-                                     )
+                                     pool_maxsize=args.concurrency,
+                                     **client_options)
     index_name = args.index_name
 
     if args.unsafe_drop_index:
@@ -42,52 +89,155 @@ def main():
             client.indices.delete(index=index_name)
         except opensearchpy.exceptions.NotFoundError:
             print('index not found, ignoring')
+        except opensearchpy.exceptions.OpenSearchException as ex:
+            sys.exit(f'{type(ex).__name__}: {ex}')
 
     if args.filename:
+        checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+        skip = checkpoint.load() if args.resume else {}
+        dead_letter = open(args.dead_letter, 'a') if args.dead_letter else nullcontext()
+        paths = expand_paths(args.filename)
+        marks = HighWaterMarks(args.state_file) if args.state_file else None
+        if marks is not None:
+            for path in [path for path in paths if marks.covers_file(path)]:
+                print(f'skipping {path}: already loaded')
+                paths.remove(path)
+        if args.per_wiki:
+            paths = interleave_wikis(paths)
+        # Cached documents are for all of a file, whatever the marks
+        # were when it was cached, so with the cache, documents are
+        # checked against the marks as they come out instead.
+        row_filter = RowFilter(args.entity, args.namespace, args.include_bots,
+                               marks.marks if marks and not args.cache else None)
+        function = partial(get_documents, row_filter=row_filter)
+        encoding = None
+        workers = args.workers
+        if all('.xml' in Path(path).name for path in paths):
+            function = get_xml_documents
+            encoding = 'utf-8'
+            if len(paths) == 1:
+                # An XML file can't be cut up into batches of lines.
+                workers = 0
+        # With --alias, index_name is the alias, and documents go into a
+        # new index which replaces whatever it pointed at once loaded.
+        target = versioned_name(index_name) if args.alias else index_name
+        cache = None
+        if args.cache:
+            cache = DocumentCache(args.cache_dir,
+                                  function_version(function, DOCUMENT_VERSION),
+                                  int(args.cache_size * 2**30),
+                                  args.rebuild_cache)
         try:
-            indexer = BulkIndexer(client, index_name, args.batch_size)
-            with bz2.open(args.filename, 'rt') as fin:
-                for document in islice(get_documents(fin), args.max_count):
-                    if not args.dry_run:
-                        indexer.index(document)
-                    if args.verbose:
-                        print(f'{document=}')
-                indexer.flush()
+            if (args.alias or args.create_index) and args.per_wiki != 'index' and not args.dry_run \
+                    and not client.indices.exists(index=target):
+                print(f'creating index {target}')
+                create_index(client, target, args.shards, args.replicas)
+            tuning = nullcontext()
+            if args.bulk_settings and not args.dry_run:
+                tuning = bulk_load_settings(client, target, force_merge=args.force_merge)
+            reporter = StatsReporter(args.stats_interval, args.prometheus_file)
+            with dead_letter, profiling(args.profile), reporter, tuning:
+                indexer_class = BulkIndexer
+                indexer_client = client
+                if args.use_async and not args.dry_run:
+                    from load.async_loader import AsyncBulkIndexer, make_client
+                    indexer_class = AsyncBulkIndexer
+                    indexer_client = make_client([f'{args.host}:{args.port}'], args.concurrency, **client_options)
+                indexer_options = {'max_retries': args.max_retries,
+                                   'dead_letter': dead_letter if args.dead_letter else None,
+                                   'op_type': args.op_type,
+                                   }
+
+                def make_indexer(db, executor, slots):
+                    if args.per_wiki == 'routing':
+                        return BulkIndexer(client, target, args.batch_size, args.max_batch_bytes, args.concurrency,
+                                           routing=db, executor=executor, slots=slots, label=db, **indexer_options)
+                    name = wiki_index_name(target, db)
+                    if args.create_index and not client.indices.exists(index=name):
+                        print(f'creating index {name}')
+                        create_index(client, name, args.shards, args.replicas)
+                    return BulkIndexer(client, name, args.batch_size, args.max_batch_bytes, args.concurrency,
+                                       executor=executor, slots=slots, label=db, **indexer_options)
+
+                if args.per_wiki:
+                    indexer = WikiRouter(make_indexer, args.concurrency)
+                else:
+                    indexer = indexer_class(indexer_client,
+                                            target,
+                                            args.batch_size,
+                                            args.max_batch_bytes,
+                                            args.concurrency,
+                                            checkpoint=checkpoint,
+                                            **indexer_options)
+                documents = run(function,
+                                paths,
+                                workers,
+                                bz2_workers=args.bz2_workers,
+                                ordered=args.ordered,
+                                progress=checkpoint.progress if checkpoint else None,
+                                skip=skip,
+                                cache=cache,
+                                encoding=encoding)
+
+                def selected():
+                    for document in islice(documents, args.max_count):
+                        if marks is not None:
+                            if cache is not None and marks.covers(document):
+                                continue
+                            marks.observe(document)
+                        if args.verbose:
+                            print(f'{document=}')
+                        yield document
+
+                selection = selected()
+                deduplicator = None
+                if args.dedup:
+                    deduplicator = Deduplicator(args.dedup, args.dedup_min_count, args.dedup_capacity)
+                    selection = deduplicator.filter(selection)
+                if indexer_class is not BulkIndexer:
+                    asyncio.run(indexer.load(selection))
+                else:
+                    for document in selection:
+                        if not args.dry_run:
+                            indexer.index(document)
+                    indexer.close()
+                if deduplicator:
+                    print(deduplicator.report())
+            if args.alias and not args.dry_run:
+                swap_alias(client, index_name, target, args.delete_old_indices)
+            if marks is not None:
+                if args.dry_run or args.max_count or indexer.failure_count:
+                    print(f'not updating {args.state_file}: dry run, --max-count or failed documents')
+                else:
+                    marks.save()
         except opensearchpy.exceptions.OpenSearchException as ex:
-            pprint(ex.errors)
+            # Not only bulk requests: creating the index, changing its
+            # settings and swapping the alias end up here too.
+            sys.exit(f'{type(ex).__name__}: {ex}')
 
-def get_documents(fin):
+def get_documents(fin, row_filter=DEFAULT_FILTER):
     """Iterate over documents which should be inserted into the index.
 
+    fin's lines may be bytes or str.  Only the rows which pass
+    row_filter (a load.row_filter.RowFilter) are decoded.
+
     """
-    for line in fin:
+    for line in row_filter.filter(fin):
         row = EscapedRow(*line.split('\t'))
-        if row.event_entity != 'revision':
-            continue
-        if row.event_user_is_bot_by_string:
-            continue
-        comment = unescape_tnr(row.event_comment_escaped)
-        if not comment:
-            continue
-        human_comment = get_human_text(comment)
-        if not human_comment:
+        comment = classify(unescape_tnr(row.event_comment_escaped))
+        if not comment.text:
+            STATS.counters[_AUTOSUMMARY] += 1
             continue
 
+        STATS.counters[_DOCUMENTS] += 1
         yield {'id': row.revision_id,
+               'db': row.wiki_db,
                'ts': row.event_timestamp,
-               'co': human_comment,
+               'co': comment.text,
                'un': unescape_tnr(row.event_user_text_escaped),
+               'se': comment.section,
+               'tg': list(comment.tags),
                }
-        
-
-def get_human_text(text):
-    if text == '*':
-        return ''
-    if text.startswith('[[WP:AES|\u2190]]'):
-        return ''
-    if text.startswith('/*') and '*/' in text:
-        return text[text.find('*/') + 2:]
-    return text
 
 
 def parse_command_line():
@@ -117,6 +267,64 @@ def parse_command_line():
                         type=int,
                         default=1000,
                         help='Number of insertions per bulk operation')
+    parser.add_argument('--max-batch-bytes',
+                        type=int,
+                        help='Also send a bulk operation when its request body reaches this many bytes')
+    parser.add_argument('--compress',
+                        action='store_true',
+                        help='gzip bulk request bodies, to save network bandwidth at the cost of CPU')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=1,
+                        help='Number of bulk operations to have in flight at once')
+    parser.add_argument('--async',
+                        dest='use_async',
+                        action='store_true',
+                        help='''send bulk requests from an asyncio event loop, with parsing in a
+                        separate thread (needs aiohttp)''')
+    parser.add_argument('--max-retries',
+                        type=int,
+                        default=5,
+                        help='Number of times to retry documents which are rejected (e.g. HTTP 429)')
+    parser.add_argument('--op-type',
+                        choices=OP_TYPES,
+                        help='''give documents an _id from their wiki and revision id, and index them
+                        with this bulk operation, so loading the same input again doesn't
+                        duplicate them: index replaces existing documents, create skips them
+                        (default: let opensearch assign ids)''')
+    parser.add_argument('--dead-letter',
+                        help='file to append documents which could not be indexed to (default: print them)')
+    parser.add_argument('--checkpoint',
+                        help='file to record how far through the input has been indexed')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='skip the input which --checkpoint says has already been indexed')
+    parser.add_argument('--state-file',
+                        help='''file recording the latest revision loaded from each wiki.  Input
+                        at or below it is skipped, and it is updated after a complete run, so
+                        each run only loads what is new.  tsv input only; load period files
+                        oldest first, as a later period makes earlier ones look loaded''')
+    parser.add_argument('--per-wiki',
+                        choices=['index', 'routing'],
+                        help='''batch each wiki's documents separately, and send them to an index
+                        per wiki, named after --index-name and the wiki (index), or to one index
+                        with the wiki as their routing key, so each wiki is on a single shard
+                        (routing).  Input files are taken from each wiki in turn''')
+    parser.add_argument('--dedup',
+                        choices=DEDUP_MODES,
+                        help='''find summaries repeated at least --dedup-min-count times (allowing
+                        for differences in numbers, links and the odd word), and drop them,
+                        collapse them into one document per summary with the count in ct, or
+                        tag them template''')
+    parser.add_argument('--dedup-min-count',
+                        type=int,
+                        default=2,
+                        help='how many times a summary is seen before it counts as a duplicate (default: %(default)s)')
+    parser.add_argument('--dedup-capacity',
+                        type=int,
+                        default=2**20,
+                        help='''number of distinct summaries --dedup remembers; the rarest are
+                        forgotten beyond that (default: %(default)s)''')
     parser.add_argument('--unsafe-drop-index',
                        action='store_true',
                        help=
@@ -124,11 +332,115 @@ def parse_command_line():
                         with --filename, index is dropped first, then new data loaded.''')
     parser.add_argument('-f',
                        '--filename',
-                       help='input file (must be .tsv.bz2)')
+                       nargs='+',
+                       help='input files or glob patterns (must be .tsv.bz2, or .xml.bz2 page history dumps)')
     parser.add_argument('--index-name',
                         default='edit-comment',
-                        help='index name')
-    return parser.parse_args()
+                        help='index name (or alias name, with --alias)')
+    parser.add_argument('--create-index',
+                        action='store_true',
+                        help='create the index with an explicit mapping if it does not exist')
+    parser.add_argument('--alias',
+                        action='store_true',
+                        help='''load into a new index, created with an explicit mapping and named
+                        after --index-name and the time, then atomically point the --index-name
+                        alias at it instead of at the indices it pointed at before''')
+    parser.add_argument('--delete-old-indices',
+                        action='store_true',
+                        help='with --alias, delete the indices the alias pointed at before')
+    parser.add_argument('--shards',
+                        type=int,
+                        default=1,
+                        help='number of primary shards for indices this creates (default: %(default)s)')
+    parser.add_argument('--replicas',
+                        type=int,
+                        default=1,
+                        help='number of replicas for indices this creates (default: %(default)s)')
+    parser.add_argument('--bulk-settings',
+                        default=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='turn off refresh and replicas during the load, and restore them after')
+    parser.add_argument('--force-merge',
+                        default=True,
+                        action=argparse.BooleanOptionalAction,
+                        help='with --bulk-settings, force-merge the index to one segment after the load')
+    parser.add_argument('--bz2-workers',
+                        type=int,
+                        default=0,
+                        help='number of processes to decompress with (default: decompress inline)')
+    parser.add_argument('--ordered',
+                        default=True,
+                        action=argparse.BooleanOptionalAction,
+                        help='preserve input order when decompressing in parallel')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help='number of processes to parse with (default: parse inline)')
+    parser.add_argument('--entity',
+                        nargs='+',
+                        default=['revision'],
+                        help='''event entities to keep (default: %(default)s; tsv input only).  Only
+                        revisions have an id, so other entities can't be used with --op-type
+                        or --state-file''')
+    parser.add_argument('--namespace',
+                        type=int,
+                        nargs='+',
+                        help='page namespaces to keep (default: all; tsv input only)')
+    parser.add_argument('--include-bots',
+                        default=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='keep edits by bots (tsv input only)')
+    parser.add_argument('--cache',
+                        default=False,
+                        action=argparse.BooleanOptionalAction,
+                        help='read and save processed input in the local cache (default: off)')
+    parser.add_argument('--rebuild-cache',
+                        action='store_true',
+                        help='ignore (and replace) existing cache entries')
+    parser.add_argument('--cache-dir',
+                        default=default_directory(),
+                        help='cache directory (default: %(default)s)')
+    parser.add_argument('--cache-size',
+                        type=float,
+                        default=10,
+                        help='maximum total size of the cache, in GB (default: %(default)s)')
+    parser.add_argument('--stats-interval',
+                        type=float,
+                        default=60,
+                        help='seconds between stats lines on stderr (0: only at the end)')
+    parser.add_argument('--prometheus-file',
+                        help='also write stats to this file, in Prometheus text format')
+    parser.add_argument('--profile',
+                        nargs='?',
+                        const='viztracer.json',
+                        help='trace the run with viztracer, writing to this file (default: %(const)s)')
+    args = parser.parse_args()
+    if args.resume and not args.checkpoint:
+        parser.error('--resume requires --checkpoint')
+    if args.checkpoint and not args.ordered:
+        # Checkpoints count lines, which only identify the same input
+        # again if it's read in the same order.
+        parser.error('--checkpoint requires --ordered')
+    if args.alias and args.unsafe_drop_index:
+        parser.error('--alias replaces the index without dropping it; leave out --unsafe-drop-index')
+    if args.alias and args.resume:
+        parser.error('--alias loads into a new index each time, so it cannot --resume')
+    if args.delete_old_indices and not args.alias:
+        parser.error('--delete-old-indices requires --alias')
+    if args.per_wiki and (args.checkpoint or args.use_async):
+        parser.error('--per-wiki cannot be combined with --checkpoint or --async')
+    if args.per_wiki == 'index' and (args.alias or args.bulk_settings or args.unsafe_drop_index):
+        parser.error('--per-wiki index cannot be combined with --alias, --bulk-settings or --unsafe-drop-index')
+    if args.state_file and any('.xml' in Path(pattern).name for pattern in args.filename or []):
+        # XML history files are split by page range, not by time, so
+        # each covers its wikis' whole history.
+        parser.error('--state-file only works with tsv input')
+    if set(args.entity) != {'revision'} and (args.op_type or args.state_file):
+        # Both key documents by revision id, which other rows don't have.
+        parser.error('--op-type and --state-file only work with --entity revision')
+    if args.dedup == 'collapse' and args.checkpoint:
+        parser.error('--dedup collapse sends the collapsed documents at the end, so it cannot --checkpoint')
+    return args
 
 
 def read_config():
@@ -142,31 +454,404 @@ def read_config():
     return config
 
 
+class Checkpoint:
+    """Record how far through the input files has been indexed.
+
+    progress is kept up to date by load.pipeline.run() as documents are
+    produced.  Each batch takes a snapshot of it when it's sent, and the
+    snapshot is written to path once that batch and all the batches
+    before it have been acknowledged, so the file never claims more
+    than has really been indexed.
+
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.progress = {}
+        self.lock = threading.Lock()
+        self.batch_count = 0
+        self.saved_count = 0
+        self.finished = {}
+
+
+    def load(self):
+        """Return the line counts saved by an earlier run."""
+        try:
+            return json.loads(self.path.read_text())['lines']
+        except FileNotFoundError:
+            return {}
+
+
+    def start_batch(self):
+        """Return a sequence number and progress snapshot for a new batch."""
+        self.batch_count += 1
+        return self.batch_count - 1, dict(self.progress)
+
+
+    def finish_batch(self, batch):
+        sequence, snapshot = batch
+        with self.lock:
+            self.finished[sequence] = snapshot
+            if self.saved_count not in self.finished:
+                return
+            while self.saved_count in self.finished:
+                snapshot = self.finished.pop(self.saved_count)
+                self.saved_count += 1
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            temp_path.write_text(json.dumps({'lines': snapshot}))
+            os.replace(temp_path, self.path)
+
+
+class BulkRequest(namedtuple('BulkRequest', ['docs', 'body', 'offsets'])):
+    """A batch of documents, and the NDJSON _bulk request body which indexes them.
+
+    offsets[i] is where the action and source lines for docs[i] start
+    in body.
+
+    """
+    __slots__ = ()
+
+
+    def select(self, indexes):
+        """Return a BulkRequest for just the documents at indexes, to retry them."""
+        ends = self.offsets[1:] + array('Q', [len(self.body)])
+        docs = []
+        chunks = []
+        offsets = array('Q')
+        position = 0
+        for i in indexes:
+            docs.append(self.docs[i])
+            chunks.append(self.body[self.offsets[i]:ends[i]])
+            offsets.append(position)
+            position += len(chunks[-1])
+        return BulkRequest(docs, b''.join(chunks), offsets)
+
+
 class BulkIndexer:
-    def __init__(self, client, index, batch_size):
+    """Send documents to an index in batches.
+
+    A batch is sent when it reaches batch_size documents or, if
+    max_bytes is given, once its NDJSON request body (action and source
+    lines, before any HTTP compression) reaches max_bytes; the document
+    which crosses the limit is included, so a body can overshoot by one
+    document.
+
+    With concurrency > 1, batches are sent from a pool of that many
+    threads, so parsing carries on while requests are in flight.
+    index() blocks once concurrency batches are in flight and as many
+    again are waiting, so a slow cluster slows down the reader instead
+    of letting batches pile up in memory.  Call close() at the end to
+    send the last batch and wait for everything to be acknowledged.
+
+    Documents which are rejected with a retryable status (typically 429,
+    when the cluster's write queue is full) are resent, up to
+    max_retries times, with exponential backoff.  Documents which fail
+    for any other reason, or run out of retries, are written as JSON
+    lines to the dead_letter file, or printed if there isn't one.  If a
+    Checkpoint is given, it's told about each batch as it completes.
+
+    By default opensearch assigns each document a new _id.  With an
+    op_type from OP_TYPES, documents get their document_id() instead,
+    so reloading replaces them ('index') or leaves them alone
+    ('create'; the conflicts this causes are counted, not failures).
+
+    Each document is serialized once, straight into the bytes of the
+    request body (with orjson, if it's installed).
+
+    If routing is given, every document is sent with it as its routing
+    key.  executor and slots let several BulkIndexers share a thread
+    pool and a limit on the batches in flight (see WikiRouter), and
+    label is put at the start of their progress messages.
+
+    """
+    def __init__(self, client, index, batch_size, max_bytes=None, concurrency=1,
+                 max_retries=5, backoff=1.0, dead_letter=None, checkpoint=None, op_type=None,
+                 routing=None, executor=None, slots=None, label=None):
+        if op_type not in (None,) + OP_TYPES:
+            raise ValueError(f'op_type must be one of {OP_TYPES}, not {op_type!r}')
         self.client = client
         self.index_name = index
         self.batch_size = batch_size
-        self.actions = []
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dead_letter = dead_letter
+        self.checkpoint = checkpoint
+        self.op_type = op_type
+        self.docs = []
+        self.body = bytearray()
+        self.offsets = array('Q')
+        routing_field = f'"routing":{_dumps(routing).decode()}' if routing else ''
+        self.action_line = f'{{"index":{{{routing_field}}}}}\n'.encode()
+        if op_type:
+            self.action_prefix = f'{{"{op_type}":{{{routing_field + "," if routing else ""}"_id":'.encode()
         self.doc_count = 0
         self.insert_count = 0
+        self.retry_count = 0
+        self.existing_count = 0
+        self.failure_count = 0
+        self.latencies = array('d')
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.prefix = f'{label}: ' if label else ''
+        self.shared_executor = executor is not None
+        if executor is None and concurrency > 1:
+            executor = ThreadPoolExecutor(concurrency)
+        self.executor = executor
+        self.slots = slots or threading.BoundedSemaphore(2 * concurrency)
+        self.futures = set()
 
 
     def index(self, doc):
-        self.actions.append({'_index': self.index_name,
-                             '_source': doc,
-                             })
-        if len(self.actions) >= self.batch_size:
+        if self._add(doc):
             self.flush()
 
 
     def flush(self):
-        if self.actions:
-            ok, _ = opensearchpy.helpers.bulk(self.client, self.actions)
-            self.doc_count += len(self.actions)
-            self.insert_count += ok
-            self.actions = []
-            print(f'{self.doc_count} docs, {self.insert_count} inserted')
+        """Send the current batch."""
+        if not self.docs:
+            return
+        request, batch = self._take_batch()
+        if self.executor is None:
+            self._send(request, batch)
+            return
+        for future in [f for f in self.futures if f.done()]:
+            self.futures.remove(future)
+            future.result()
+        self.slots.acquire()
+        future = self.executor.submit(self._send, request, batch)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.add(future)
+
+
+    def close(self):
+        """Send the current batch and wait for all batches to complete."""
+        self.flush()
+        if self.executor is not None:
+            try:
+                for future in self.futures:
+                    future.result()
+            finally:
+                if not self.shared_executor:
+                    self.executor.shutdown(cancel_futures=True)
+        if self.checkpoint:
+            # Account for any input after the last document.
+            self.checkpoint.finish_batch(self.checkpoint.start_batch())
+        print(self.prefix + self.report())
+
+
+    def report(self):
+        """Return a one-line summary of the indexing throughput and latency."""
+        elapsed = time.perf_counter() - self.start_time
+        summary = (f'{self.doc_count} docs in {elapsed:.1f}s ({self.doc_count / elapsed:.0f} docs/s), '
+                   f'{self.retry_count} retried, {self.failure_count} failed')
+        if self.op_type == 'create':
+            summary += f', {self.existing_count} already indexed'
+        if len(self.latencies) >= 2:
+            percentiles = statistics.quantiles(self.latencies, n=100)
+            summary += (f', bulk latency p50={percentiles[49] * 1000:.0f}ms'
+                        f' p90={percentiles[89] * 1000:.0f}ms'
+                        f' p99={percentiles[98] * 1000:.0f}ms')
+        return summary
+
+
+    def _add(self, doc):
+        """Add doc to the current batch; return whether the batch is full."""
+        body = self.body
+        self.offsets.append(len(body))
+        if self.op_type:
+            body += self.action_prefix
+            body += _dumps(document_id(doc))
+            body += b'}}\n'
+        else:
+            body += self.action_line
+        body += _dumps(doc)
+        body += b'\n'
+        self.docs.append(doc)
+        return len(self.docs) >= self.batch_size or (self.max_bytes and len(body) >= self.max_bytes)
+
+
+    def _take_batch(self):
+        """Return the current BulkRequest and Checkpoint batch, and start a new batch."""
+        request = BulkRequest(self.docs, bytes(self.body), self.offsets)
+        self.docs = []
+        self.body.clear()
+        self.offsets = array('Q')
+        return request, self.checkpoint and self.checkpoint.start_batch()
+
+
+    def _send(self, request, batch=None):
+        doc_count = len(request.docs)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            t0 = time.perf_counter()
+            try:
+                items = bulk_items(self.client.bulk(body=request.body, index=self.index_name))
+            except opensearchpy.TransportError as ex:
+                items = [{'status': ex.status_code, 'error': str(ex)}] * len(request.docs)
+            request = self._handle_results(request, items, time.perf_counter() - t0, attempt)
+            if request is None:
+                break
+        self._finish_batch(doc_count, batch)
+
+
+    def _handle_results(self, request, items, latency, attempt):
+        """Record the results of a bulk request; return a BulkRequest to retry, or None."""
+        STATS.add_time('index', latency)
+        STATS.observe('bulk_latency', latency)
+        retries = []
+        failures = []
+        existing = 0
+        for i, info in enumerate(items):
+            status = info.get('status')
+            if status in SUCCESS_STATUSES:
+                continue
+            if status == 409 and self.op_type == 'create':
+                existing += 1
+            elif status in RETRY_STATUSES:
+                retries.append(i)
+            else:
+                failures.append(self._describe_failure(request.docs[i], info))
+        doc_count = len(request.docs)
+        STATS.count('bulk_requests')
+        STATS.count('docs_indexed', doc_count - len(retries) - len(failures) - existing)
+        STATS.count('docs_existing', existing)
+        with self.lock:
+            self.latencies.append(latency)
+            self.insert_count += doc_count - len(retries) - len(failures) - existing
+            self.existing_count += existing
+            if attempt < self.max_retries:
+                self.retry_count += len(retries)
+                STATS.count('docs_retried', len(retries))
+            else:
+                failures.extend(self._describe_failure(request.docs[i], {'error': 'too many retries'})
+                                for i in retries)
+            self._fail(failures)
+        if retries and attempt < self.max_retries:
+            return request.select(retries)
+        return None
+
+
+    def _finish_batch(self, doc_count, batch):
+        with self.lock:
+            self.doc_count += doc_count
+            print(f'{self.prefix}{self.doc_count} docs, {self.insert_count} inserted')
+        if batch:
+            self.checkpoint.finish_batch(batch)
+
+
+    def _fail(self, failures):
+        self.failure_count += len(failures)
+        STATS.count('docs_failed', len(failures))
+        if not failures:
+            return
+        if self.dead_letter is None:
+            pprint(failures)
+            return
+        for failure in failures:
+            self.dead_letter.write(json.dumps(failure) + '\n')
+        self.dead_letter.flush()
+
+
+    def _describe_failure(self, doc, info):
+        return {'index': self.index_name,
+                'id': document_id(doc) if self.op_type else None,
+                'status': info.get('status'),
+                'error': str(info.get('error')),
+                'source': doc,
+                }
+
+
+class WikiRouter:
+    """Send each document to the BulkIndexer for its wiki.
+
+    make_indexer(db, executor, slots) is called to create the
+    BulkIndexer the first time a document from the wiki db turns up,
+    so each wiki is batched separately and every bulk request goes to
+    one index (or routing key).  The BulkIndexers share a pool of
+    concurrency threads and a limit on the batches in flight, as a
+    single BulkIndexer would have, and a batch from any wiki is sent as
+    soon as it's full, so small wikis aren't held up behind big ones.
+
+    """
+    def __init__(self, make_indexer, concurrency=1):
+        self.make_indexer = make_indexer
+        self.executor = ThreadPoolExecutor(concurrency) if concurrency > 1 else None
+        self.slots = threading.BoundedSemaphore(2 * concurrency)
+        self.indexers = {}
+        self.start_time = time.perf_counter()
+
+
+    def index(self, doc):
+        indexer = self.indexers.get(doc['db'])
+        if indexer is None:
+            indexer = self.make_indexer(doc['db'], self.executor, self.slots)
+            self.indexers[doc['db']] = indexer
+        indexer.index(doc)
+
+
+    def close(self):
+        """Send every wiki's last batch and wait for all batches to complete."""
+        try:
+            for indexer in self.indexers.values():
+                indexer.close()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+        print(self.report())
+
+
+    @property
+    def failure_count(self):
+        return sum(indexer.failure_count for indexer in self.indexers.values())
+
+
+    def report(self):
+        """Return a one-line summary of the throughput over all wikis."""
+        elapsed = time.perf_counter() - self.start_time
+        doc_count = sum(indexer.doc_count for indexer in self.indexers.values())
+        return (f'{len(self.indexers)} wikis, {doc_count} docs in {elapsed:.1f}s '
+                f'({doc_count / elapsed:.0f} docs/s), {self.failure_count} failed')
+
+
+def wiki_index_name(index_name, db):
+    """Return the name of the index for the wiki db, with --per-wiki index."""
+    return f'{index_name}-{db}'
+
+
+def wiki_of_path(path):
+    """Return the wiki a dump file is for, from its name, or None if it isn't clear."""
+    match = _DUMP_FILE.match(Path(path).name)
+    return match and (match['tsv'] or match['xml'])
+
+
+def interleave_wikis(paths):
+    """Reorder paths to take a file from each wiki in turn.
+
+    Files are processed in order (or started in order, with workers),
+    so this stops one wiki with many files from holding up the rest.
+
+    """
+    by_wiki = {}
+    for path in paths:
+        by_wiki.setdefault(wiki_of_path(path), []).append(path)
+    return [path for paths in zip_longest(*by_wiki.values()) for path in paths if path is not None]
+
+
+def document_id(doc):
+    """Return the _id for a document: its wiki's database name and revision id."""
+    return f'{doc["db"]}:{doc["id"]}'
+
+
+def bulk_items(response):
+    """Return the result for each action in a _bulk response, in order."""
+    return [info for item in response['items'] for info in item.values()]
+
+
+def _dumps(value):
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,348 @@
+"""
+Read lines from .bz2 files, decompressing in parallel.
+
+A bzip2 file is a sequence of streams, each of which is a sequence of
+independently compressed blocks.  Blocks are not byte-aligned, but
+each one starts with a 48-bit magic number, as does the end-of-stream
+marker.  We find those by scanning the compressed data, then hand runs
+of blocks to a process pool, where each run is re-wrapped as a
+complete, stand-alone bzip2 stream and decompressed.
+
+The magic numbers can (very rarely) occur by chance inside compressed
+data.  A false boundary makes its chunk fail to decompress, in which
+case the ordered reader falls back to sequential decompression from
+the point it had reached.  The unordered reader can't tell which lines
+it has already returned, so it raises ValueError instead.
+
+"""
+
+
+import bz2
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import deque
+import heapq
+import io
+import mmap
+import time
+
+from load.stats import STATS
+
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+
+# What bz2.decompress() raises for a chunk cut at a false block boundary.
+_BAD_CHUNK_ERRORS = (OSError, ValueError, EOFError)
+
+
+class Bz2LineReader:
+    """Iterate over the lines of a .bz2 file.
+
+    With workers=0, this just wraps bz2.open().  Otherwise, blocks are
+    decompressed in a pool of that many processes, in chunks of about
+    chunk_size compressed bytes.  Lines are returned in file order
+    unless ordered is False, which lets chunks be consumed as soon as
+    they're ready.  Only the ordered reader recovers from a false block
+    boundary; the unordered one raises ValueError.
+
+    Lines are str (decoded as encoding) with their trailing newline, as
+    when iterating over a file opened in text mode; pass encoding=None
+    to get bytes.
+
+    """
+    def __init__(self, path, workers=0, ordered=True, encoding='utf-8', chunk_size=4 * 2**20):
+        self.path = path
+        self.workers = workers
+        self.ordered = ordered
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+        self.elapsed = 0.0
+
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        try:
+            if self.workers:
+                chunks = self._parallel_chunks()
+            else:
+                chunks = self._sequential_chunks()
+            for line in chunks:
+                yield line
+        finally:
+            self.elapsed = time.perf_counter() - t0
+
+
+    def report(self):
+        """Return a one-line summary of the decompression throughput."""
+        elapsed = self.elapsed or float('nan')
+        mb_in = self.compressed_bytes / 2**20
+        mb_out = self.decompressed_bytes / 2**20
+        return (f'{self.path}: {mb_in:.1f} MB -> {mb_out:.1f} MB in {elapsed:.1f}s '
+                f'({mb_in / elapsed:.1f} MB/s compressed, {mb_out / elapsed:.1f} MB/s decompressed, '
+                f'{self.workers} workers)')
+
+
+    def _sequential_chunks(self, skip=0, carry=b''):
+        with open(self.path, 'rb') as raw, bz2.open(raw) as f:
+            while skip:
+                skip -= len(f.read(min(skip, self.chunk_size)))
+            position = raw.tell()
+            while True:
+                t0 = time.perf_counter()
+                data = f.read(self.chunk_size)
+                STATS.add_time('decompress', time.perf_counter() - t0)
+                if not data:
+                    break
+                STATS.count('bytes_read', raw.tell() - position)
+                STATS.count('bytes_decompressed', len(data))
+                position = raw.tell()
+                self.decompressed_bytes += len(data)
+                self.compressed_bytes = position
+                carry = yield from self._split(carry + data)
+        if carry:
+            yield self._decode(carry)
+
+
+    def _parallel_chunks(self):
+        with ProcessPoolExecutor(self.workers) as executor:
+            spans = iter_chunks(self.path, self.chunk_size)
+            if self.ordered:
+                yield from self._ordered(executor, spans)
+            else:
+                yield from self._unordered(executor, spans)
+
+
+    def _ordered(self, executor, spans):
+        pending = deque()
+        carry = b''
+        emitted = 0
+        spans = iter(spans)
+        while True:
+            for span in spans:
+                pending.append((span, executor.submit(decompress_blocks, self.path, span)))
+                if len(pending) >= 2 * self.workers:
+                    break
+            if not pending:
+                break
+            span, future = pending.popleft()
+            t0 = time.perf_counter()
+            try:
+                data = future.result()
+            except _BAD_CHUNK_ERRORS:
+                for _, future in pending:
+                    future.cancel()
+                yield from self._sequential_chunks(skip=emitted, carry=carry)
+                return
+            STATS.add_time('decompress', time.perf_counter() - t0)
+            emitted += len(data)
+            self._count(span, data)
+            carry = yield from self._split(carry + data)
+        if carry:
+            yield self._decode(carry)
+
+
+    def _unordered(self, executor, spans):
+        # A line which crosses a chunk boundary is reassembled from the
+        # tail of one chunk and the head of the next once both are in.
+        # Chunks with no newline at all are held until the end.
+        heads = {}
+        tails = {-1: b''}
+        held = {}
+        pending = {}
+        count = 0
+        for index, span in enumerate(spans):
+            count = index + 1
+            pending[executor.submit(decompress_blocks, self.path, span)] = (index, span)
+            if len(pending) < 2 * self.workers:
+                continue
+            with STATS.timer('decompress'):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                yield from self._collect(item, self._result(future, item, pending), heads, tails, held)
+        for future in list(pending):
+            item = pending.pop(future)
+            with STATS.timer('decompress'):
+                data = self._result(future, item, pending)
+            yield from self._collect(item, data, heads, tails, held)
+
+        # Whatever is left crosses chunk boundaries; stitch it in order.
+        carry = b''
+        for index in range(-1, count):
+            if index in held:
+                carry += held[index]
+                continue
+            if index in heads:
+                yield from self._split(carry + heads[index])
+                carry = b''
+            if index in tails:
+                carry = tails[index]
+        if carry:
+            yield self._decode(carry)
+
+
+    def _result(self, future, item, pending):
+        """Return the data for an unordered chunk, or raise ValueError if it didn't decompress."""
+        try:
+            return future.result()
+        except _BAD_CHUNK_ERRORS as ex:
+            for future in pending:
+                future.cancel()
+            raise ValueError(f'{self.path}: chunk {item[0]} failed to decompress ({ex}), probably because '
+                             f'of a false block boundary; read it with ordered=True (--ordered)') from ex
+
+
+    def _collect(self, item, data, heads, tails, held):
+        index, span = item
+        self._count(span, data)
+        first = data.find(b'\n')
+        if first < 0:
+            held[index] = data
+            return
+        last = data.rfind(b'\n')
+        yield from self._split(data[first + 1:last + 1])
+        head = data[:first + 1]
+        tail = data[last + 1:]
+        if index - 1 in tails:
+            yield from self._split(tails.pop(index - 1) + head)
+        else:
+            heads[index] = head
+        if index + 1 in heads:
+            yield from self._split(tail + heads.pop(index + 1))
+        else:
+            tails[index] = tail
+
+
+    def _count(self, span, data):
+        compressed_bytes = (span[-1][1] - span[0][0]) // 8
+        self.compressed_bytes += compressed_bytes
+        self.decompressed_bytes += len(data)
+        STATS.count('bytes_read', compressed_bytes)
+        STATS.count('bytes_decompressed', len(data))
+
+
+    def _split(self, data):
+        """Yield the complete lines in data; return the incomplete remainder."""
+        end = data.rfind(b'\n') + 1
+        if self.encoding is None:
+            yield from io.BytesIO(data[:end])
+        else:
+            yield from io.StringIO(data[:end].decode(self.encoding), newline='\n')
+        return data[end:]
+
+
+    def _decode(self, data):
+        return data if self.encoding is None else data.decode(self.encoding)
+
+
+def iter_blocks(path):
+    """Iterate over the compressed blocks in the bzip2 file at path.
+
+    Each block is described by a (start, end, crc) tuple, where start
+    and end are bit offsets into the file and crc is the block's CRC as
+    recorded in its header.
+
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = crc = None
+        for position, magic in _find_magic(data):
+            if start is not None:
+                yield (start, position, crc)
+                start = None
+            if magic == BLOCK_MAGIC:
+                start = position
+                crc = _read_bits(data, position + MAGIC_BITS, 32)
+        if start is not None:
+            yield (start, len(data) * 8, crc)
+
+
+def iter_chunks(path, chunk_size):
+    """Group the blocks from iter_blocks() into runs of about chunk_size bytes."""
+    chunk = []
+    for block in iter_blocks(path):
+        chunk.append(block)
+        if (chunk[-1][1] - chunk[0][0]) // 8 >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decompress_blocks(path, blocks):
+    """Decompress a list of blocks, as returned by iter_blocks().
+
+    The blocks are re-assembled into a stand-alone bzip2 stream, with a
+    fresh header and end-of-stream marker.
+
+    """
+    bits = 0
+    length = 0
+    combined_crc = 0
+    with open(path, 'rb') as f:
+        for start, end in _contiguous_runs(blocks):
+            f.seek(start // 8)
+            data = f.read((end + 7) // 8 - start // 8)
+            value = int.from_bytes(data, 'big') >> ((-end) % 8)
+            value &= (1 << (end - start)) - 1
+            bits = (bits << (end - start)) | value
+            length += end - start
+    for _, _, crc in blocks:
+        combined_crc = ((combined_crc << 1) | (combined_crc >> 31)) & 0xffffffff
+        combined_crc ^= crc
+    bits = (bits << (MAGIC_BITS + 32)) | (EOS_MAGIC << 32) | combined_crc
+    length += MAGIC_BITS + 32
+    padding = (-length) % 8
+    stream = b'BZh9' + (bits << padding).to_bytes((length + padding) // 8, 'big')
+    return bz2.decompress(stream)
+
+
+def _contiguous_runs(blocks):
+    runs = []
+    for start, end, _ in blocks:
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+    return runs
+
+
+def _find_magic(data):
+    """Iterate over (bit position, magic) for every block and end-of-stream marker."""
+    searches = []
+    for magic in (BLOCK_MAGIC, EOS_MAGIC):
+        for shift in range(8):
+            searches.append(_search(data, magic, shift))
+    for position, magic in heapq.merge(*searches):
+        if _read_bits(data, position, MAGIC_BITS) == magic:
+            yield position, magic
+
+
+def _search(data, magic, shift):
+    """Iterate over candidate bit positions of magic starting shift bits into a byte.
+
+    Only the whole bytes of the magic are searched for; candidates must
+    be confirmed with _read_bits().
+
+    """
+    if shift == 0:
+        pattern = magic.to_bytes(6, 'big')
+        offset = 0
+    else:
+        pattern = ((magic >> shift) & (2**40 - 1)).to_bytes(5, 'big')
+        offset = 1
+    index = data.find(pattern, offset)
+    while index >= 0:
+        yield (8 * (index - offset) + shift, magic)
+        index = data.find(pattern, index + 1)
+
+
+def _read_bits(data, position, count):
+    start = position // 8
+    end = (position + count + 7) // 8
+    if end > len(data):
+        return None
+    value = int.from_bytes(data[start:end], 'big')
+    return (value >> (end * 8 - position - count)) & ((1 << count) - 1)
@@ -0,0 +1,69 @@
+"""
+Write extracted revisions as a Parquet file.
+
+This needs pyarrow, which is an optional dependency:
+
+    pip install 'edit-summaries[parquet]'
+
+"""
+
+
+# Columns of the records produced by extract_comments.get_records(), in
+# the order they're written.
+COLUMNS = ['wiki_db', 'revision_id', 'timestamp', 'user', 'page', 'section', 'comment', 'tags']
+
+# Columns with few distinct values, which compress well with dictionary
+# encoding.
+DICTIONARY_COLUMNS = ['wiki_db', 'user']
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.0'
+
+
+def write_parquet(records, path, row_group_size=1000000):
+    """Write records (dicts with COLUMNS keys) to a Parquet file at path.
+
+    Records are buffered and written a row group at a time, so memory
+    use is bounded by row_group_size.  Return the number of records
+    written.
+
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError as ex:
+        raise RuntimeError('Parquet output needs pyarrow; pip install "edit-summaries[parquet]"') from ex
+
+    # Every field is nullable: revision_id is null for rows about pages
+    # and users (see extract-comments --entity).
+    schema = pa.schema([('wiki_db', pa.string()),
+                        ('revision_id', pa.int64()),
+                        ('timestamp', pa.timestamp('s')),
+                        ('user', pa.string()),
+                        ('page', pa.string()),
+                        ('section', pa.string()),
+                        ('comment', pa.string()),
+                        ('tags', pa.list_(pa.string())),
+                        ])
+
+    def make_table(columns):
+        arrays = {name: pa.array(values, schema.field(name).type)
+                  for name, values in columns.items() if name != 'timestamp'}
+        # Missing timestamps are empty strings, which strptime() rejects.
+        timestamps = pa.array([value or None for value in columns['timestamp']], pa.string())
+        arrays['timestamp'] = pc.strptime(timestamps, format=TIMESTAMP_FORMAT, unit='s')
+        return pa.Table.from_pydict(arrays, schema=schema)
+
+    count = 0
+    with pq.ParquetWriter(path, schema, use_dictionary=DICTIONARY_COLUMNS, compression='zstd') as writer:
+        columns = {name: [] for name in COLUMNS}
+        for record in records:
+            for name in COLUMNS:
+                columns[name].append(record[name])
+            count += 1
+            if count % row_group_size == 0:
+                writer.write_table(make_table(columns))
+                columns = {name: [] for name in COLUMNS}
+        if columns['revision_id']:
+            writer.write_table(make_table(columns))
+    return count
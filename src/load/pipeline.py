@@ -0,0 +1,315 @@
+"""
+Run a line-processing function over dump files, optionally in parallel.
+
+The function is given an iterable of lines and yields results; it must
+be a module-level function so it can be sent to worker processes.
+
+"""
+
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import glob
+from itertools import islice
+import multiprocessing
+import queue
+import time
+import warnings
+
+
+from load.block_index import BlockReader, has_block_index
+from load.parallel_bz2 import Bz2LineReader
+from load.stats import STATS
+
+
+LINES_PER_BATCH = 2000
+
+_LINES = STATS.key('lines')
+
+
+def expand_paths(patterns):
+    """Expand glob patterns into a list of paths.
+
+    Patterns which match nothing are passed through unchanged, so that
+    a missing file is reported when it is opened.
+
+    """
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def run(function, paths, workers=0, report=print, bz2_workers=0, ordered=True, progress=None, skip=None,
+        cache=None, encoding='utf-8', block_filter=None):
+    """Yield everything function produces for the lines of each file in paths.
+
+    With workers=0 everything runs in this process, one file after
+    another.  Otherwise, a single file is split into batches of lines
+    which are processed by a pool of that many workers, and multiple
+    files are each given to a worker of their own.  In both cases the
+    amount of work in flight is bounded, so memory use stays flat no
+    matter how fast the results are consumed.
+
+    bz2_workers, ordered and encoding are passed to Bz2LineReader (so
+    with encoding=None, function is given bytes), and report is
+    called with each reader's throughput summary.  Lines read and the
+    time spent in function are recorded in load.stats.STATS.
+
+    If progress is given, it's a dict which is kept updated with the
+    number of lines of each path which are fully accounted for: all the
+    results from those lines have been yielded.  skip maps paths to a
+    number of lines to skip at the start, typically taken from an
+    earlier run's progress.
+
+    If cache (a load.cache.DocumentCache) is given, files with a cache
+    entry are read from there, and the results for the others are saved
+    to it once each file is finished.  Files being partially skipped
+    don't use the cache.
+
+    block_filter (a load.block_index.BlockFilter) is a promise that
+    function drops rows outside it, so for files with a block index,
+    blocks which can't have rows inside it aren't read.  Line counts
+    in progress and skip are then of the lines in the blocks read.
+
+    """
+    progress = {} if progress is None else progress
+    skip = skip or {}
+    for path in paths:
+        progress[path] = skip.get(path, 0)
+    if cache is not None:
+        uncached = []
+        for path in paths:
+            entry = None if skip.get(path) else cache.open(path)
+            if entry is None:
+                uncached.append(path)
+                continue
+            yield from entry
+            progress[path] = entry.line_count
+            STATS.count('cached_results', entry.document_count)
+            report(f'{path}: {entry.document_count} results read from cache')
+        paths = uncached
+    writers = _CacheWriters(cache, skip)
+    try:
+        if not workers or not paths:
+            for path in paths:
+                reader = open_lines(path, bz2_workers, ordered, encoding, block_filter)
+                lines = _LineCounter(reader, skip.get(path, 0))
+                for result in _timed(function(lines)):
+                    progress[path] = lines.count
+                    writers.add(path, result)
+                    yield result
+                progress[path] = lines.count
+                writers.commit(path, lines.count)
+                report(reader.report())
+        elif len(paths) == 1:
+            path = paths[0]
+            reader = open_lines(path, bz2_workers, ordered, encoding, block_filter)
+            lines = islice(reader, progress[path], None)
+            for count, results in map_batches(function, lines, workers, batched=True):
+                writers.add_all(path, results)
+                yield from results
+                progress[path] += count
+            writers.commit(path, progress[path])
+            report(reader.report())
+        else:
+            yield from map_files(function, paths, workers, report, bz2_workers, ordered, progress, skip, writers,
+                                 encoding, block_filter)
+    finally:
+        writers.abort()
+
+
+def open_lines(path, bz2_workers=0, ordered=True, encoding='utf-8', block_filter=None):
+    """Return a reader for the lines of path.
+
+    That's a BlockReader if block_filter is given and path has a block
+    index, and otherwise a Bz2LineReader.  An index which can't be used
+    (built for an older version of the dump, say) is warned about, and
+    the whole file is read.
+
+    """
+    if block_filter is not None and has_block_index(path):
+        try:
+            return BlockReader(path, block_filter, bz2_workers, encoding)
+        except ValueError as ex:
+            warnings.warn(f'{ex}; reading all of {path}')
+    return Bz2LineReader(path, bz2_workers, ordered, encoding)
+
+
+def map_batches(function, lines, workers, batch_size=LINES_PER_BATCH, batched=False):
+    """Apply function to batches of lines in a pool of worker processes.
+
+    Results are yielded in input order; with batched=True, as one
+    (number of lines, list of results) pair per batch of lines.
+
+    """
+    lines = iter(lines)
+    pending = deque()
+    with ProcessPoolExecutor(workers, initializer=_reset_stats) as executor:
+        try:
+            while True:
+                while len(pending) < 2 * workers and (batch := list(islice(lines, batch_size))):
+                    pending.append((len(batch), executor.submit(_apply, function, batch)))
+                if not pending:
+                    break
+                count, future = pending.popleft()
+                results, stats = future.result()
+                STATS.merge(stats)
+                STATS.counters[_LINES] += count
+                if batched:
+                    yield count, results
+                else:
+                    yield from results
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def map_files(function, paths, workers, report=print, bz2_workers=0, ordered=True, progress=None, skip=None,
+              writers=None, encoding='utf-8', block_filter=None):
+    """Apply function to each of paths, a file per worker process.
+
+    Results from the files are interleaved as they arrive, through a
+    bounded queue.  progress and skip are as for run().
+
+    """
+    progress = {} if progress is None else progress
+    skip = skip or {}
+    writers = writers or _CacheWriters(None, skip)
+    results = multiprocessing.Queue(4 * workers)
+    stop = multiprocessing.Event()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(results, stop)) as executor:
+        futures = [executor.submit(_process_file, function, path, bz2_workers, ordered, skip.get(path, 0), encoding,
+                                   block_filter)
+                   for path in paths]
+        remaining = len(paths)
+        try:
+            while remaining:
+                kind, value = results.get()
+                if kind == 'batch':
+                    path, count, batch, stats = value
+                    STATS.merge(stats)
+                    writers.add_all(path, batch)
+                    yield from batch
+                    progress[path] = count
+                else:
+                    remaining -= 1
+                    path, summary = value
+                    if summary is not None:
+                        writers.commit(path, progress[path])
+                        report(summary)
+            for future in futures:
+                future.result()
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+            # Keep the queue moving so that workers can see the stop flag.
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
+class _CacheWriters:
+    """The cache entries being written during a run, one per path."""
+    def __init__(self, cache, skip):
+        self.cache = cache
+        self.skip = skip
+        self.writers = {}
+
+
+    def add(self, path, result):
+        if self.cache is not None and not self.skip.get(path):
+            self._writer(path).add(result)
+
+
+    def add_all(self, path, results):
+        if self.cache is not None and not self.skip.get(path):
+            writer = self._writer(path)
+            for result in results:
+                writer.add(result)
+
+
+    def commit(self, path, line_count):
+        if self.cache is not None and not self.skip.get(path):
+            self._writer(path).commit(line_count)
+            del self.writers[path]
+
+
+    def abort(self):
+        for writer in self.writers.values():
+            writer.abort()
+        self.writers.clear()
+
+
+    def _writer(self, path):
+        if path not in self.writers:
+            self.writers[path] = self.cache.writer(path)
+        return self.writers[path]
+
+
+class _LineCounter:
+    """Iterate over lines after the first skip, counting them as we go."""
+    def __init__(self, lines, skip=0):
+        self.lines = islice(lines, skip, None)
+        self.count = skip
+
+
+    def __iter__(self):
+        for line in self.lines:
+            self.count += 1
+            STATS.counters[_LINES] += 1
+            yield line
+
+
+def _timed(results, stage='process'):
+    """Yield from results, adding the time spent producing them to stage."""
+    results = iter(results)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            result = next(results)
+        except StopIteration:
+            STATS.add_time(stage, time.perf_counter() - t0)
+            return
+        STATS.add_time(stage, time.perf_counter() - t0)
+        yield result
+
+
+def _apply(function, lines):
+    with STATS.timer('process'):
+        results = list(function(lines))
+    return results, STATS.take()
+
+
+def _reset_stats():
+    # A forked worker starts with a copy of its parent's STATS.
+    STATS.reset()
+
+
+_results = None
+_stop = None
+
+
+def _init_worker(results, stop):
+    global _results, _stop
+    _results = results
+    _stop = stop
+    STATS.reset()
+
+
+def _process_file(function, path, bz2_workers, ordered, skip, encoding, block_filter):
+    summary = None
+    try:
+        reader = open_lines(path, bz2_workers, ordered, encoding, block_filter)
+        lines = _LineCounter(reader, skip)
+        outputs = _timed(function(lines))
+        while not _stop.is_set() and (batch := list(islice(outputs, LINES_PER_BATCH))):
+            _results.put(('batch', (path, lines.count, batch, STATS.take())))
+        if not _stop.is_set():
+            _results.put(('batch', (path, lines.count, [], STATS.take())))
+            summary = reader.report()
+    finally:
+        _results.put(('done', (path, summary)))
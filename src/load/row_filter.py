@@ -0,0 +1,144 @@
+"""
+Reject unwanted history rows before decoding them.
+
+Most rows in a dump are dropped (other entities, bot edits, empty
+comments), and deciding that only needs a few of the leading columns.
+A RowFilter looks at just those, and works on raw bytes, so rejected
+rows are never decoded from UTF-8 or split into all their columns.
+
+"""
+
+
+from itertools import chain
+
+from load.schema import field_names
+from load.stats import STATS
+
+
+WIKI_INDEX = field_names.index('wiki_db')
+ENTITY_INDEX = field_names.index('event_entity')
+TIMESTAMP_INDEX = field_names.index('event_timestamp')
+COMMENT_INDEX = field_names.index('event_comment_escaped')
+BOT_INDEX = field_names.index('event_user_is_bot_by_string')
+NAMESPACE_INDEX = field_names.index('page_namespace')
+REVISION_INDEX = field_names.index('revision_id')
+
+_ENTITY = STATS.key('rows_filtered', reason='entity')
+_LOADED = STATS.key('rows_filtered', reason='loaded')
+_BOT = STATS.key('rows_filtered', reason='bot')
+_EMPTY = STATS.key('rows_filtered', reason='empty')
+_NAMESPACE = STATS.key('rows_filtered', reason='namespace')
+_TIME = STATS.key('rows_filtered', reason='time')
+
+
+class RowFilter:
+    """Select rows by entity, page namespace and whether the user is a bot.
+
+    entities are the event_entity values to keep.  namespaces, if
+    given, are the page_namespace numbers to keep.  Rows by bots are
+    dropped unless include_bots is true.  Rows with an empty comment
+    are always dropped.
+
+    after, if given, maps wiki_db values to high-water marks (see
+    load.high_water_mark): (event_timestamp, revision_id) pairs.  Rows
+    from those wikis are dropped unless they come after the mark.
+
+    since and until, if given, are event_timestamp strings such as
+    '2023-01-01 00:00:00': rows before since, or at or after until, are
+    dropped, as are rows with no timestamp.
+
+    """
+    def __init__(self, entities=('revision',), namespaces=None, include_bots=False, after=None,
+                 since=None, until=None):
+        self.entities = tuple(sorted(entities))
+        self.namespaces = None if namespaces is None else tuple(sorted(namespaces))
+        self.include_bots = include_bots
+        self.after = dict(sorted(after.items())) if after else None
+        self.since = since
+        self.until = until
+
+
+    def __repr__(self):
+        # This is part of the cache version (see load.cache.function_version).
+        return (f'RowFilter(entities={self.entities!r}, namespaces={self.namespaces!r}, '
+                f'include_bots={self.include_bots!r}, after={self.after!r}, '
+                f'since={self.since!r}, until={self.until!r})')
+
+
+    def filter(self, lines, encoding='utf-8'):
+        """Iterate over the lines which pass the filter.
+
+        lines may be bytes, which are decoded as encoding once they've
+        passed, or str.
+
+        """
+        lines = iter(lines)
+        first = next(lines, None)
+        if first is None:
+            return
+        lines = chain([first], lines)
+        if isinstance(first, bytes):
+            yield from self._filter(lines, b'\t', lambda s: s.encode(), encoding)
+        else:
+            yield from self._filter(lines, '\t', str, None)
+
+
+    def _filter(self, lines, tab, convert, encoding):
+        # Every entity prefix includes the tab after it, so that 'page'
+        # can't match 'pages', and is checked before anything is split.
+        prefixes = tuple(convert(entity) + tab for entity in self.entities)
+        namespaces = None if self.namespaces is None else {convert(str(n)) for n in self.namespaces}
+        include_bots = self.include_bots
+        maxsplit = max(COMMENT_INDEX, BOT_INDEX) + 1
+        since = None if self.since is None else convert(self.since)
+        until = None if self.until is None else convert(self.until)
+        timed = since is not None or until is not None
+        if namespaces is not None:
+            maxsplit = NAMESPACE_INDEX + 1
+        empty = convert('')
+        after = None
+        if self.after is not None:
+            after = {convert(wiki): (convert(timestamp), revision_id)
+                     for wiki, (timestamp, revision_id) in self.after.items()}
+        for line in lines:
+            if not line.startswith(prefixes, line.find(tab) + 1):
+                STATS.counters[_ENTITY] += 1
+                continue
+            fields = line.split(tab, maxsplit)
+            if timed and not _in_range(fields[TIMESTAMP_INDEX], since, until):
+                STATS.counters[_TIME] += 1
+                continue
+            if after is not None and not _is_after(line, fields, after, tab):
+                STATS.counters[_LOADED] += 1
+                continue
+            if not include_bots and fields[BOT_INDEX] != empty:
+                STATS.counters[_BOT] += 1
+                continue
+            if fields[COMMENT_INDEX] == empty:
+                STATS.counters[_EMPTY] += 1
+                continue
+            if namespaces is not None and fields[NAMESPACE_INDEX] not in namespaces:
+                STATS.counters[_NAMESPACE] += 1
+                continue
+            yield line.decode(encoding) if encoding else line
+
+
+def _in_range(timestamp, since, until):
+    if not timestamp:
+        return False
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+
+def _is_after(line, fields, after, tab):
+    mark = after.get(fields[WIKI_INDEX])
+    if mark is None:
+        return True
+    timestamp, revision_id = mark
+    if fields[TIMESTAMP_INDEX] != timestamp:
+        return fields[TIMESTAMP_INDEX] > timestamp
+    # Only split as far as revision_id for the rare rows in the same second.
+    row_revision_id = line.split(tab, REVISION_INDEX + 1)[REVISION_INDEX]
+    return bool(row_revision_id) and int(row_revision_id) > revision_id
+
+
+DEFAULT_FILTER = RowFilter()
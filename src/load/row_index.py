@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+"""
+Find the row for a revision or page in a .tsv.bz2 dump without reading it all.
+
+An index file (the dump's path plus INDEX_SUFFIX) maps revision_id and
+page_id to where each row starts: the number of the bzip2 block it
+starts in, and its offset in that block's decompressed data.  Blocks
+decompress independently (see load.parallel_bz2), so a lookup is a
+binary search of the index followed by decompressing a block or two.
+
+The index is a header, the dump's block table and two tables of
+fixed-width (id, block, offset) records, sorted by id, and is read
+through mmap.  While building it, records are sorted in runs which
+are spilled to temporary files and merged, so memory use doesn't grow
+with the size of the dump.
+
+Run from the src directory:
+
+    python -m load.row_index build history.tsv.bz2 [--workers 4]
+    python -m load.row_index lookup history.tsv.bz2 --revision 1135248453
+
+"""
+
+
+import argparse
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from functools import partial
+import heapq
+import json
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+import tempfile
+
+from load.parallel_bz2 import decompress_blocks, iter_blocks
+from load.schema import build_row, field_names
+
+
+INDEX_SUFFIX = '.rowidx'
+INDEX_VERSION = 1
+
+PAGE_INDEX = field_names.index('page_id')
+REVISION_INDEX = field_names.index('revision_id')
+
+# magic, version, dump size, block count, revision count, page count.
+_HEADER = struct.Struct('<4sIQQQQ')
+_MAGIC = b'RIDX'
+# start bit, end bit and CRC of a block, as from iter_blocks().
+_BLOCK = struct.Struct('<QQI4x')
+# id, block number, offset in the block.
+_RECORD = struct.Struct('<qII')
+
+# How many records build_index() sorts in memory at a time.
+_RUN_SIZE = 2**20
+
+# How many decompressed blocks a RowIndex keeps.
+_CACHED_BLOCKS = 4
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build',
+                                         help='index dumps')
+    build_parser.add_argument('filename',
+                              nargs='+',
+                              help='dumps to index (must be in tsv-bz2 format)')
+    build_parser.add_argument('--workers',
+                              type=int,
+                              default=0,
+                              help='number of processes to decompress with (default: decompress inline)')
+    lookup_parser = subparsers.add_parser('lookup',
+                                          help='print rows from indexed dumps')
+    lookup_parser.add_argument('filename',
+                               nargs='+',
+                               help='indexed dumps to search')
+    group = lookup_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--revision',
+                       type=int,
+                       help='revision_id to look up')
+    group.add_argument('--page',
+                       type=int,
+                       help='page_id to look up all rows for')
+    lookup_parser.add_argument('--raw',
+                               action='store_true',
+                               help='print the rows as they are in the dump, rather than as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for filename in args.filename:
+            revisions, pages = build_index(filename, workers=args.workers)
+            print(f'{filename}: indexed {revisions} revisions of {pages} rows with a page_id', file=sys.stderr)
+        return
+
+    found = False
+    for filename in args.filename:
+        with RowIndex(filename) as index:
+            if args.revision is not None:
+                locations = [index.find_revision(args.revision)]
+            else:
+                locations = index.find_page(args.page)
+            for location in filter(None, locations):
+                found = True
+                line = index.read_line(*location)
+                if args.raw:
+                    print(line, end='')
+                else:
+                    print(json.dumps(asdict(build_row(line)), ensure_ascii=False))
+    if not found:
+        sys.exit('not found')
+
+
+def build_index(path, index_path=None, workers=0):
+    """Index the dump at path, and return the number of revisions and pages indexed.
+
+    Each block is decompressed once, in a pool of workers processes if
+    workers isn't 0.  Rows with no revision_id (or page_id) are left
+    out of the revision (or page) table.
+
+    """
+    index_path = Path(index_path or str(path) + INDEX_SUFFIX)
+    blocks = list(iter_blocks(path))
+    revisions = _RecordSorter(index_path.parent)
+    pages = _RecordSorter(index_path.parent)
+    for line, block, offset in _iter_lines(path, blocks, workers):
+        fields = line.split(b'\t', REVISION_INDEX + 1)
+        if len(fields) <= REVISION_INDEX:
+            raise ValueError(f'{path}: row in block {block} at offset {offset} has too few fields')
+        if fields[REVISION_INDEX]:
+            revisions.add((int(fields[REVISION_INDEX]), block, offset))
+        if fields[PAGE_INDEX]:
+            pages.add((int(fields[PAGE_INDEX]), block, offset))
+
+    temp_path = index_path.with_name(index_path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, INDEX_VERSION, os.path.getsize(path),
+                             len(blocks), revisions.count, pages.count))
+        for block in blocks:
+            f.write(_BLOCK.pack(*block))
+        revisions.write_to(f)
+        pages.write_to(f)
+    os.replace(temp_path, index_path)
+    return revisions.count, pages.count
+
+
+class _RecordSorter:
+    """Sort (id, block, offset) records, spilling sorted runs to temporary files in directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.run_size = _RUN_SIZE
+        self.run = []
+        self.files = []
+        self.count = 0
+
+
+    def add(self, record):
+        self.run.append(record)
+        self.count += 1
+        if len(self.run) >= self.run_size:
+            self._spill()
+
+
+    def write_to(self, f):
+        """Write the packed records to f, in order, and delete the runs."""
+        if not self.files:
+            self.run.sort()
+            f.writelines(_RECORD.pack(*record) for record in self.run)
+            self.run = []
+            return
+        self._spill()
+        try:
+            runs = [_read_records(run) for run in self.files]
+            f.writelines(_RECORD.pack(*record) for record in heapq.merge(*runs))
+        finally:
+            for run in self.files:
+                run.close()
+            self.files = []
+
+
+    def _spill(self):
+        self.run.sort()
+        run = tempfile.TemporaryFile(dir=self.directory)
+        run.writelines(_RECORD.pack(*record) for record in self.run)
+        run.seek(0)
+        self.files.append(run)
+        self.run = []
+
+
+def _read_records(f):
+    for chunk in iter(partial(f.read, 4096 * _RECORD.size), b''):
+        yield from _RECORD.iter_unpack(chunk)
+
+
+def _iter_lines(path, blocks, workers):
+    """Iterate over (line, block number, offset) for the lines in the dump, without newlines."""
+    carry = b''
+    start = None
+    for number, data in enumerate(decompress_each(path, blocks, workers)):
+        position = 0
+        if start is not None:
+            end = data.find(b'\n')
+            if end < 0:
+                carry += data
+                continue
+            yield carry + data[:end], *start
+            position = end + 1
+            start = None
+        while (end := data.find(b'\n', position)) >= 0:
+            yield data[position:end], number, position
+            position = end + 1
+        if position < len(data):
+            carry = data[position:]
+            start = (number, position)
+    if start is not None:
+        yield carry, *start
+
+
+def decompress_each(path, blocks, workers):
+    """Iterate over the decompressed data of each block, in order."""
+    if not workers:
+        for block in blocks:
+            yield decompress_blocks(path, [block])
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        blocks = iter(blocks)
+        while True:
+            for block in blocks:
+                pending.append(executor.submit(decompress_blocks, path, [block]))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+            yield pending.popleft().result()
+
+
+class RowIndex:
+    """Look up rows in the dump at path, using the index built by build_index().
+
+    Raises ValueError if the index doesn't exist, isn't an index, or
+    was built for a different version of the dump.
+
+    """
+    def __init__(self, path, index_path=None):
+        self.path = path
+        index_path = index_path or str(path) + INDEX_SUFFIX
+        try:
+            with open(index_path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as ex:
+            raise ValueError(f'{index_path}: cannot open index ({ex}); build it with "dump-index build {path}"') from ex
+        try:
+            magic, version, size, block_count, revision_count, page_count = _HEADER.unpack_from(self.data)
+        except struct.error:
+            magic = version = None
+        if magic != _MAGIC or version != INDEX_VERSION:
+            self.close()
+            raise ValueError(f'{index_path}: not a version {INDEX_VERSION} row index')
+        if size != os.path.getsize(path):
+            self.close()
+            raise ValueError(f'{index_path}: built for a different version of {path}; rebuild it')
+        self.blocks = [_BLOCK.unpack_from(self.data, _HEADER.size + i * _BLOCK.size)
+                       for i in range(block_count)]
+        start = _HEADER.size + block_count * _BLOCK.size
+        self.revisions = _Records(self.data, start, revision_count)
+        self.pages = _Records(self.data, start + revision_count * _RECORD.size, page_count)
+        self._cache = OrderedDict()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        self.data.close()
+
+
+    def find_revision(self, revision_id):
+        """Return the (block, offset) of the row for revision_id, or None."""
+        i = bisect_left(self.revisions, revision_id)
+        if i < len(self.revisions) and self.revisions[i] == revision_id:
+            return self.revisions.location(i)
+        return None
+
+
+    def find_page(self, page_id):
+        """Return the (block, offset) of every row for page_id, in dump order."""
+        i = bisect_left(self.pages, page_id)
+        locations = []
+        while i < len(self.pages) and self.pages[i] == page_id:
+            locations.append(self.pages.location(i))
+            i += 1
+        return locations
+
+
+    def revision(self, revision_id):
+        """Return the Row for revision_id, or None if it isn't in the dump."""
+        location = self.find_revision(revision_id)
+        return None if location is None else build_row(self.read_line(*location))
+
+
+    def page(self, page_id):
+        """Return a list of the Rows for page_id, in dump order."""
+        return [build_row(self.read_line(*location)) for location in self.find_page(page_id)]
+
+
+    def read_line(self, block, offset):
+        """Return the line (with its newline, if it has one) starting at offset in block."""
+        data = self._block(block)[offset:]
+        while b'\n' not in data and block + 1 < len(self.blocks):
+            block += 1
+            data += self._block(block)
+        end = data.find(b'\n') + 1
+        return data[:end or len(data)].decode('utf-8')
+
+
+    def _block(self, number):
+        if number in self._cache:
+            self._cache.move_to_end(number)
+        else:
+            self._cache[number] = decompress_blocks(self.path, [self.blocks[number]])
+            if len(self._cache) > _CACHED_BLOCKS:
+                self._cache.popitem(last=False)
+        return self._cache[number]
+
+
+class _Records:
+    """The ids of a table of _RECORDs, as a sequence which bisect can search."""
+    def __init__(self, data, start, count):
+        self.data = data
+        self.start = start
+        self.count = count
+
+
+    def __len__(self):
+        return self.count
+
+
+    def __getitem__(self, i):
+        return _RECORD.unpack_from(self.data, self.start + i * _RECORD.size)[0]
+
+
+    def location(self, i):
+        _, block, offset = _RECORD.unpack_from(self.data, self.start + i * _RECORD.size)
+        return block, offset
+
+
+if __name__ == '__main__':
+    main()
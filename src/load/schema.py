@@ -5,6 +5,7 @@ for a description of the input format and schema.
 """
 
 from dataclasses import dataclass
+from functools import lru_cache
 import re
 
 field_names = [
@@ -180,34 +181,377 @@ def build_row(tsv_string):
     Row.event_comment, but that may change in the future.
 
     """
-    fields = tsv_string.split('\t')
-    name_types = Row.__annotations__
-    args = {}
-    for value, name, type in zip(fields, name_types.keys(), name_types.values()):
-        if type == str:
-            args[name] = unescape_tnr(value)
-        elif type == int:
-            args[name] = None if value == '' else int(value)
+    return _decode_full_row(tsv_string)
+
+
+# Row fields whose values repeat a lot across a dump, which make_decoder()
+# interns by default.  The comment, event timestamp and sha1 are nearly
+# always unique, so they aren't worth it.
+INTERNED_COLUMNS = [
+    'wiki_db', 'event_entity', 'event_type',
+    'event_user_text_historical', 'event_user_text',
+    'event_user_blocks_historical', 'event_user_blocks',
+    'event_user_groups_historical', 'event_user_groups',
+    'event_user_is_bot_by_historical', 'event_user_is_bot_by',
+    'event_user_registration_timestamp', 'event_user_creation_timestamp', 'event_user_first_edit_timestamp',
+    'page_title_historical', 'page_title', 'page_creation_timestamp', 'page_first_edit_timestamp',
+    'user_text_historical', 'user_text',
+    'user_blocks_historical', 'user_blocks',
+    'user_groups_historical', 'user_groups',
+    'user_is_bot_by_historical', 'user_is_bot_by',
+    'user_registration_timestamp', 'user_creation_timestamp', 'user_first_edit_timestamp',
+    'revision_deleted_parts', 'revision_content_model', 'revision_content_format',
+    'revision_deleted_by_page_deletion_timestamp', 'revision_tags',
+]
+
+# Default number of distinct values each interned column remembers.
+SYMBOL_TABLE_SIZE = 2**16
+
+
+def make_decoder(columns=None, row_class=None, intern=None, symbol_table_size=SYMBOL_TABLE_SIZE):
+    """Build a function which decodes a tsv record string.
+
+    The schema is examined once, here, and a specialized parse
+    function is generated with the converter for each column bound by
+    position, so no per-record type dispatch is done.
+
+    columns is an iterable of Row field names.  Only those columns are
+    converted, and the record is only split as far as the last of
+    them, so asking for just a few of the leading columns skips most of
+    the work.  The default is all columns.
+
+    The returned function produces row_class instances, constructed
+    with the converted values as positional arguments in column order.
+    The default is a compact __slots__ class from make_row_class().
+
+    intern is an iterable of str and list[str] columns whose values
+    are interned, or True for INTERNED_COLUMNS.  Each of those columns
+    gets a symbol table: an LRU cache of its most recent
+    symbol_table_size distinct values, so rows with the same value
+    share one object instead of each having a copy.  Interned list[str]
+    values are tuples, as shared values mustn't be modified.  The
+    symbol tables are the decoder's symbol_tables attribute, a dict of
+    functools.lru_cache functions by column, whose cache_info() shows
+    how well each is doing.
+
+    """
+    names = list(Row.__annotations__)
+    columns = names if columns is None else list(columns)
+    if not columns:
+        raise ValueError('at least one column is required')
+    intern = INTERNED_COLUMNS if intern is True else list(intern or [])
+    for name in columns + intern:
+        if name not in Row.__annotations__:
+            raise ValueError(f'unknown column {name!r}')
+    for name in intern:
+        if Row.__annotations__[name] not in (str, list[str]):
+            raise ValueError(f'only str and list[str] columns can be interned, not {name!r}')
+    if row_class is None:
+        row_class = make_row_class(columns)
+
+    namespace = {'_row_class': row_class}
+    symbol_tables = {}
+    args = []
+    for name in columns:
+        position = names.index(name)
+        converter = f'_convert_{position}'
+        namespace[converter] = _get_converter(name, Row.__annotations__[name])
+        if name in intern:
+            namespace[converter] = symbol_tables[name] = _make_symbol_table(namespace[converter],
+                                                                           symbol_table_size)
+        field = f'fields[{position}]'
+        if position == len(names) - 1:
+            field += ".rstrip('\\n')"
+        args.append(f'{converter}({field})')
+    maxsplit = max(names.index(name) for name in columns) + 1
+    source = (f'def decode(tsv_string):\n'
+              f'    fields = tsv_string.split(\'\\t\', {maxsplit})\n'
+              f'    return _row_class({", ".join(args)})\n')
+    exec(source, namespace)
+    decode = namespace['decode']
+    decode.symbol_tables = symbol_tables
+    return decode
+
+
+def _make_symbol_table(convert, size):
+    if convert is expand_string_array:
+        def convert(value):
+            return tuple(expand_string_array(value))
+    return lru_cache(maxsize=size)(convert)
+
+
+def decode_columns(lines, columns=None):
+    """Decode a block of tsv records into one array per column.
+
+    This needs numpy, which is an optional dependency:
+
+        pip install 'edit-summaries[columns]'
+
+    lines is either a bytes object holding whole lines, or an iterable
+    of lines (all str or all bytes).  columns is an iterable of Row
+    field names, as for make_decoder().  Returns a dict mapping each of
+    them to an array with one value per line:
+
+    - int fields: a numpy masked int64 array, masked where missing
+    - bool fields: an int8 array of 1 (true), 0 (false) or -1 (missing)
+    - *_timestamp fields: a datetime64[s] array, NaT where missing
+    - other str fields: an object array of unescaped strings
+    - list[str] fields: a StringLists, with offsets and values arrays
+
+    Field boundaries are found for the whole block at once, and int,
+    bool and timestamp columns are parsed with whole-array operations
+    on the raw bytes, so they never become Python objects.  Only the
+    str and list[str] columns asked for are decoded one value at a
+    time.  Use columns_to_arrow() to get a pyarrow Table.
+
+    """
+    try:
+        import numpy as np
+    except ImportError as ex:
+        raise RuntimeError('decode_columns() needs numpy; pip install "edit-summaries[columns]"') from ex
+
+    names = list(Row.__annotations__)
+    columns = names if columns is None else list(columns)
+    for name in columns:
+        if name not in Row.__annotations__:
+            raise ValueError(f'unknown column {name!r}')
+
+    if isinstance(lines, (bytes, bytearray, memoryview)):
+        block = bytes(lines)
+    else:
+        lines = list(lines)
+        block = ''.join(lines).encode() if lines and isinstance(lines[0], str) else b''.join(lines)
+    if block and not block.endswith(b'\n'):
+        block += b'\n'
+    data = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(data == ord('\n'))
+    tabs = np.flatnonzero(data == ord('\t'))
+    count = len(line_ends)
+    # Sliced to count, so an empty block has no line starting at 0.
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))[:count].astype(np.int64)
+    if len(tabs) != count * (len(names) - 1):
+        raise ValueError(f'every line must have {len(names)} fields')
+    tabs = tabs.reshape(count, len(names) - 1)
+    if count and ((tabs[:, 0] < line_starts).any() or (tabs[:, -1] > line_ends).any()):
+        raise ValueError(f'every line must have {len(names)} fields')
+    starts = np.column_stack((line_starts, tabs + 1))
+    ends = np.column_stack((tabs, line_ends))
+
+    result = {}
+    for name in columns:
+        position = names.index(name)
+        type = Row.__annotations__[name]
+        field_starts = starts[:, position]
+        field_ends = ends[:, position]
+        if type == int:
+            result[name] = _parse_ints(np, data, field_starts, field_ends, name)
         elif type == bool:
-            if value == '':
-                args[name] = None
-            elif value == 'true':
-                args[name] = True
-            elif value == 'false':
-                args[name] = False
+            result[name] = _parse_bools(np, data, field_starts, field_ends, name)
+        elif type == str and name.endswith('_timestamp'):
+            result[name] = _parse_timestamps(np, data, field_starts, field_ends, name)
+        else:
+            values = [block[start:end].decode() for start, end in zip(field_starts.tolist(), field_ends.tolist())]
+            if type == str:
+                result[name] = np.array([unescape_tnr(value) for value in values], dtype=object)
             else:
-                raise ValueError(f'{name=}, {type=}, value={repr(value)}')
-        elif type == list[str]:
-            args[name] = expand_string_array(value)
+                lists = [expand_string_array(value) for value in values]
+                offsets = np.zeros(count + 1, dtype=np.int64)
+                np.cumsum([len(strings) for strings in lists], out=offsets[1:])
+                result[name] = StringLists(offsets, np.array([string for strings in lists for string in strings],
+                                                             dtype=object))
+    return result
+
+
+def _gather(np, data, starts, ends, width, fill):
+    """Return a (len(starts), width) array of the last width bytes of each field, left-padded with fill."""
+    indexes = ends[:, None] - width + np.arange(width)
+    inside = indexes >= starts[:, None]
+    return np.where(inside, data[np.clip(indexes, 0, max(len(data) - 1, 0))], fill)
+
+
+def _parse_ints(np, data, starts, ends, name):
+    lengths = ends - starts
+    width = int(lengths.max(initial=0))
+    if width > 18:
+        raise ValueError(f'{name}: integer too long')
+    missing = lengths == 0
+    if not width:
+        return np.ma.MaskedArray(np.zeros(len(starts), dtype=np.int64), mask=missing)
+    chars = _gather(np, data, starts, ends, width, ord('0')).astype(np.int64)
+    first = np.arange(len(starts)), width - np.maximum(lengths, 1)
+    negative = chars[first] == ord('-')
+    chars[first] = np.where(negative, ord('0'), chars[first])
+    digits = chars - ord('0')
+    if ((digits < 0) | (digits > 9)).any() or (negative & (lengths == 1)).any():
+        row = np.flatnonzero(((digits < 0) | (digits > 9)).any(axis=1) | (negative & (lengths == 1)))[0]
+        raise ValueError(f'{name=}, value={bytes(data[starts[row]:ends[row]]).decode()!r}')
+    values = digits @ (10 ** np.arange(width - 1, -1, -1, dtype=np.int64))
+    return np.ma.MaskedArray(np.where(negative, -values, values), mask=missing)
+
+
+def _parse_bools(np, data, starts, ends, name):
+    lengths = ends - starts
+    chars = _gather(np, data, starts, ends, 5, 0)
+    true = (lengths == 4) & (chars[:, 1:] == np.frombuffer(b'true', np.uint8)).all(axis=1)
+    false = (lengths == 5) & (chars == np.frombuffer(b'false', np.uint8)).all(axis=1)
+    invalid = ~(true | false | (lengths == 0))
+    if invalid.any():
+        row = np.flatnonzero(invalid)[0]
+        raise ValueError(f'{name=}, type={bool}, value={bytes(data[starts[row]:ends[row]]).decode()!r}')
+    flags = np.full(len(starts), -1, dtype=np.int8)
+    flags[true] = 1
+    flags[false] = 0
+    return flags
+
+
+def _parse_timestamps(np, data, starts, ends, name):
+    # Timestamps look like 2001-01-15 19:27:13.0; only whole seconds are kept.
+    lengths = ends - starts
+    present = lengths > 0
+    chars = _gather(np, data, starts, starts + 19, 19, ord('0')).astype(np.int64)
+    separators = chars[:, [4, 7, 10, 13, 16]]
+    expected = np.frombuffer(b'-- ::', np.uint8)
+    invalid = present & ((lengths < 19) | (separators != expected).any(axis=1))
+    digits = chars - ord('0')
+    invalid |= present & ((digits[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]] < 0)
+                          | (digits[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]] > 9)).any(axis=1)
+    if invalid.any():
+        row = np.flatnonzero(invalid)[0]
+        raise ValueError(f'{name=}, value={bytes(data[starts[row]:ends[row]]).decode()!r}')
+
+    def number(first, last):
+        return digits[:, first:last] @ (10 ** np.arange(last - first - 1, -1, -1, dtype=np.int64))
+
+    year = np.where(present, number(0, 4), 1970)
+    month = np.where(present, number(5, 7), 1)
+    day = np.where(present, number(8, 10), 1)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+    seconds = number(11, 13) * 3600 + number(14, 16) * 60 + number(17, 19)
+    timestamps = days.astype('datetime64[s]') + seconds
+    timestamps[~present] = np.datetime64('NaT')
+    return timestamps
+
+
+class StringLists:
+    """A column of list[str] values, stored as offsets into one array of strings.
+
+    The strings of item i are values[offsets[i]:offsets[i + 1]], as in
+    an Arrow list array.
+
+    """
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, index):
+        return list(self.values[self.offsets[index]:self.offsets[index + 1]])
+
+
+    def lengths(self):
+        """Return the number of strings in each item."""
+        return self.offsets[1:] - self.offsets[:-1]
+
+
+def columns_to_arrow(columns):
+    """Convert the result of decode_columns() to a pyarrow Table.
+
+    Missing values become nulls.  This needs pyarrow:
+
+        pip install 'edit-summaries[parquet]'
+
+    """
+    import numpy as np
+    try:
+        import pyarrow as pa
+    except ImportError as ex:
+        raise RuntimeError('columns_to_arrow() needs pyarrow; pip install "edit-summaries[parquet]"') from ex
+
+    arrays = {}
+    for name, values in columns.items():
+        type = Row.__annotations__[name]
+        if type == int:
+            arrays[name] = pa.array(values.data, mask=np.ma.getmaskarray(values), type=pa.int64())
+        elif type == bool:
+            arrays[name] = pa.array(values == 1, mask=values == -1, type=pa.bool_())
+        elif type == str and name.endswith('_timestamp'):
+            arrays[name] = pa.array(values, type=pa.timestamp('s'))
+        elif type == str:
+            arrays[name] = pa.array(values, type=pa.string())
         else:
-            raise RuntimeError(f'{type=}.  This should never happen!')
-    return Row(**args)
+            arrays[name] = pa.ListArray.from_arrays(pa.array(values.offsets, type=pa.int32()),
+                                                    pa.array(values.values, type=pa.string()))
+    return pa.table(arrays)
+
+
+def make_row_class(columns, name='CompactRow'):
+    """Build a class with one __slots__ attribute per column.
+
+    Instances have no __dict__, which makes them much smaller than
+    Row instances when large numbers of them are kept in memory.
+
+    """
+    columns = tuple(columns)
+    body = ''.join(f'    self.{column} = {column}\n' for column in columns) or '    pass\n'
+    namespace = {}
+    exec(f'def __init__(self, {", ".join(columns)}):\n{body}', namespace)
+
+    def __repr__(self):
+        values = ', '.join(f'{column}={getattr(self, column)!r}' for column in columns)
+        return f'{name}({values})'
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, column) == getattr(other, column) for column in columns)
+
+    return type(name, (), {'__slots__': columns,
+                           '_fields': columns,
+                           '__init__': namespace['__init__'],
+                           '__repr__': __repr__,
+                           '__eq__': __eq__,
+                           '__hash__': None,
+                           })
+
+
+def _get_converter(name, type):
+    if type == str:
+        return unescape_tnr
+    if type == int:
+        return _convert_int
+    if type == bool:
+        def convert_bool(value):
+            if value == 'true':
+                return True
+            if value == 'false':
+                return False
+            if value == '':
+                return None
+            raise ValueError(f'{name=}, {type=}, value={repr(value)}')
+        return convert_bool
+    if type == list[str]:
+        return expand_string_array
+    raise RuntimeError(f'{type=}.  This should never happen!')
+
+
+def _convert_int(value):
+    return None if value == '' else int(value)
 
 
 def unescape_tnr(s):
     r"""Expand literal \t, \n, and \r in s.
 
+    Most fields have no escapes at all, so s itself is returned if it
+    has no backslashes.
+
     """
+    if '\\' not in s:
+        return s
     return s.replace('\\t', '\t').replace('\\n', '\n').replace('\\r', '\r')
 
 
@@ -215,17 +559,26 @@ def unescape_tnr_comma(input_string):
     r"""Expand literal \t, \n, ,\r, and \, in input_string.
 
     """
+    if '\\' not in input_string:
+        return input_string
     return unescape_tnr(input_string).replace('\\,', ',')
 
 
+_ARRAY_SEPARATOR = re.compile(r'(?<!\\),')
+
+
 def expand_string_array(input_string):
     """Expand encoded string arrays.
 
+    Without backslashes there are no escaped commas to worry about, so
+    a plain split does.
+
     """
     if input_string == '':
         return []
-    strings = re.split(r'(?<!\\),', input_string)
-    return [unescape_tnr_comma(s) for s in strings]
+    if '\\' not in input_string:
+        return input_string.split(',')
+    return [unescape_tnr_comma(s) for s in _ARRAY_SEPARATOR.split(input_string)]
 
 
 def escape_tnr(s):
@@ -233,3 +586,6 @@ def escape_tnr(s):
 
     """
     return s.replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+_decode_full_row = make_decoder(row_class=Row)
@@ -0,0 +1,262 @@
+"""
+Counters and timers for the stages of a run.
+
+Everything in a process records into the module-level STATS.  Worker
+processes started by load.pipeline send what they've recorded back with
+their results, so in the main process STATS covers the whole run.
+
+The stages timed are decompress (waiting for bz2 data), process
+(running the line-processing function, including the decompression it
+waits for) and index (bulk requests).
+
+A StatsReporter logs STATS periodically as a line of JSON, and can also
+write it to a file in the Prometheus text format (e.g. for the
+node_exporter textfile collector).
+
+"""
+
+
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_PREFIX = 'edit_summaries_'
+
+
+class Stats:
+    """Named counters, per-stage timers and latency histograms.
+
+    A counter is identified by the key() for its name and labels.
+    Adding to counters[key] directly is cheap enough to do for every
+    line; count() is simpler when that doesn't matter.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+        self.histograms = {}
+        self.start_time = time.perf_counter()
+
+
+    def key(self, name, **labels):
+        """Register a counter and return its key."""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters.setdefault(key, 0)
+        return key
+
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+
+
+    @contextmanager
+    def timer(self, stage):
+        """Add the time spent in the with block to stage."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - t0)
+
+
+    def observe(self, name, seconds):
+        """Add a latency to the histogram called name."""
+        with self.lock:
+            buckets, total = self.histograms.get(name, ([0] * (len(LATENCY_BUCKETS) + 1), 0.0))
+            buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.histograms[name] = (buckets, total + seconds)
+
+
+    def snapshot(self):
+        """Return a copy of everything recorded, which can be passed to merge()."""
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'timers': dict(self.timers),
+                    'histograms': {name: (list(buckets), total)
+                                   for name, (buckets, total) in self.histograms.items()},
+                    }
+
+
+    def take(self):
+        """Return a snapshot() and reset everything to zero."""
+        with self.lock:
+            snapshot = {'counters': dict(self.counters),
+                        'timers': self.timers,
+                        'histograms': self.histograms,
+                        }
+            self._clear()
+        return snapshot
+
+
+    def reset(self):
+        with self.lock:
+            self._clear()
+            self.start_time = time.perf_counter()
+
+
+    def merge(self, snapshot):
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for stage, seconds in snapshot['timers'].items():
+                self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+            for name, (buckets, total) in snapshot['histograms'].items():
+                mine, my_total = self.histograms.get(name, ([0] * len(buckets), 0.0))
+                self.histograms[name] = ([a + b for a, b in zip(mine, buckets)], my_total + total)
+
+
+    def summary(self):
+        """Return everything recorded so far as a line of JSON."""
+        snapshot = self.snapshot()
+        elapsed = time.perf_counter() - self.start_time
+        record = {'elapsed': round(elapsed, 1)}
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            record['.'.join([name] + [label for _, label in labels])] = value
+        lines = record.get('lines', 0)
+        record['lines_per_s'] = round(lines / elapsed) if elapsed else 0
+        for stage, seconds in sorted(snapshot['timers'].items()):
+            record[f'{stage}_seconds'] = round(seconds, 2)
+        for name, (buckets, total) in sorted(snapshot['histograms'].items()):
+            count = sum(buckets)
+            record[f'{name}_count'] = count
+            if count:
+                record[f'{name}_mean'] = round(total / count, 4)
+                for percentile in (50, 90, 99):
+                    record[f'{name}_p{percentile}'] = _bucket_percentile(buckets, percentile)
+        return json.dumps(record)
+
+
+    def prometheus(self):
+        """Return everything recorded so far in the Prometheus text format."""
+        snapshot = self.snapshot()
+        lines = []
+        names = {}
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            names.setdefault(name, []).append((labels, value))
+        for name, values in names.items():
+            metric = f'{PROMETHEUS_PREFIX}{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for labels, value in values:
+                lines.append(f'{metric}{_labels(labels)} {value}')
+        metric = f'{PROMETHEUS_PREFIX}stage_seconds_total'
+        lines.append(f'# TYPE {metric} counter')
+        for stage, seconds in sorted(snapshot['timers'].items()):
+            lines.append(f'{metric}{_labels([("stage", stage)])} {seconds:.6f}')
+        for name, (buckets, total) in sorted(snapshot['histograms'].items()):
+            metric = f'{PROMETHEUS_PREFIX}{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels([("le", bound)])} {cumulative}')
+            lines.append(f'{metric}_sum {total:.6f}')
+            lines.append(f'{metric}_count {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+    def write_prometheus(self, path):
+        """Replace the file at path with prometheus()."""
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(self.prometheus())
+        os.replace(temp_path, path)
+
+
+    def _clear(self):
+        self.counters = dict.fromkeys(self.counters, 0)
+        self.timers = {}
+        self.histograms = {}
+
+
+STATS = Stats()
+
+
+class StatsReporter:
+    """Log STATS.summary() (and write it to prometheus_file) every interval seconds.
+
+    Use as a context manager around the run; a final report is made on
+    exit.  With interval=0, only the final report is made.
+
+    """
+    def __init__(self, interval=60, prometheus_file=None, stats=STATS, file=None):
+        self.interval = interval
+        self.prometheus_file = prometheus_file
+        self.stats = stats
+        self.file = file
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+
+    def __enter__(self):
+        if self.interval:
+            self.thread.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.report()
+
+
+    def report(self):
+        print(f'stats {self.stats.summary()}', file=self.file or sys.stderr, flush=True)
+        if self.prometheus_file:
+            self.stats.write_prometheus(self.prometheus_file)
+
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+
+def profiling(output_file):
+    """Return a context manager which traces the run with viztracer into output_file.
+
+    If output_file is None, nothing is traced.
+
+    """
+    if not output_file:
+        return nullcontext()
+    try:
+        from viztracer import VizTracer
+    except ImportError as ex:
+        raise RuntimeError('--profile needs viztracer; pip install viztracer') from ex
+    # verbose=0 keeps viztracer's messages out of the output on stdout.
+    return VizTracer(output_file=output_file, verbose=0)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+def _bucket_percentile(buckets, percentile):
+    """Return the upper bound of the bucket holding percentile, or None if it's beyond the last."""
+    target = sum(buckets) * percentile / 100
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return None
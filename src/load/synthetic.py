@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""
+Generate synthetic history dumps, for benchmarks and tests.
+
+Rows have the columns of schema.field_names, and look like the real
+thing in the ways that matter to the parsers: the mix of entities, how
+many edits are by bots, how many comments are empty, autosummaries or
+start with a section link, how many contain escaped tabs and newlines,
+and how long comments are.  Output is the same for the same seed.
+
+Run from the src directory:
+
+    python -m load.synthetic history.tsv.bz2 --lines 1000000
+
+"""
+
+
+import argparse
+import bz2
+from datetime import datetime, timedelta
+import math
+import random
+
+from load.schema import field_names, escape_tnr
+
+
+FIELD_INDEX = {name: index for index, name in enumerate(field_names)}
+
+START_TIME = datetime(2001, 1, 15)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.0'
+
+WORDS = ('the of and in to a is was for on as by with he at from that his it an were are which this '
+         'be or has had first one their its after new who they two her she been other when time during '
+         'there into school more may years over only year most would world city some where between later '
+         'fix typo link links ref refs cite citation source sources added removed update updated '
+         'copyedit grammar category infobox image template see also external wikilink reverted vandalism '
+         'expand cleanup section clarify minor changes per talk consensus').split()
+
+SECTIONS = ['History', 'Early life', 'Career', 'References', 'External links', 'Background',
+            'Reception', 'Plot', 'Personal life', 'Geography', 'Demographics', 'See also']
+
+AUTOSUMMARIES = ['[[WP:AES|←]]Redirected page to [[{title}]]',
+                 '[[WP:AES|←]]Created page with \'{words}\'',
+                 '*']
+
+# (entity, event type, weight) for events which aren't revisions.
+OTHER_EVENTS = [('user', 'create', 4),
+                ('user', 'alterblocks', 1),
+                ('user', 'altergroups', 1),
+                ('user', 'rename', 1),
+                ('page', 'create', 4),
+                ('page', 'move', 2),
+                ('page', 'delete', 1),
+                ]
+
+BOT_GROUPS = ['bot', 'bot,extendedconfirmed']
+USER_GROUPS = ['', '', '', 'extendedconfirmed', 'autoreviewer,extendedconfirmed',
+               'extendedconfirmed,ipblock-exempt,rollbacker']
+
+NAMESPACES = [(0, 70), (1, 8), (2, 8), (3, 6), (4, 3), (10, 2), (14, 3)]
+
+# The keyword arguments of generate_lines(), with their defaults.
+GENERATOR_OPTIONS = {'seed': 0,
+                     'wiki_db': 'enwiki',
+                     'non_revision_ratio': 0.15,
+                     'bot_ratio': 0.1,
+                     'empty_ratio': 0.05,
+                     'autosummary_ratio': 0.1,
+                     'section_ratio': 0.3,
+                     'escape_density': 0.05,
+                     'comment_length': 40,
+                     }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename',
+                        help='file to write (.tsv.bz2)')
+    parser.add_argument('--lines',
+                        type=int,
+                        default=1000000,
+                        help='number of rows to generate (default: %(default)s)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='random seed (default: %(default)s)')
+    parser.add_argument('--wiki-db',
+                        default='enwiki',
+                        help='wiki_db column value (default: %(default)s)')
+    parser.add_argument('--non-revision-ratio',
+                        type=float,
+                        default=0.15,
+                        help='fraction of rows which are user or page events (default: %(default)s)')
+    parser.add_argument('--bot-ratio',
+                        type=float,
+                        default=0.1,
+                        help='fraction of revisions made by bots (default: %(default)s)')
+    parser.add_argument('--empty-ratio',
+                        type=float,
+                        default=0.05,
+                        help='fraction of revisions with no comment (default: %(default)s)')
+    parser.add_argument('--autosummary-ratio',
+                        type=float,
+                        default=0.1,
+                        help='fraction of revisions with an automatic summary (default: %(default)s)')
+    parser.add_argument('--section-ratio',
+                        type=float,
+                        default=0.3,
+                        help='fraction of revisions whose comment starts with a section (default: %(default)s)')
+    parser.add_argument('--escape-density',
+                        type=float,
+                        default=0.05,
+                        help='fraction of comments containing tabs or newlines (default: %(default)s)')
+    parser.add_argument('--comment-length',
+                        type=int,
+                        default=40,
+                        help='median comment length in characters (default: %(default)s)')
+    parser.add_argument('--compresslevel',
+                        type=int,
+                        default=9,
+                        help='bzip2 compression level (default: %(default)s, as in the real dumps)')
+    args = parser.parse_args()
+
+    options = {name: getattr(args, name) for name in GENERATOR_OPTIONS}
+    write_dump(args.filename, args.lines, args.compresslevel, **options)
+
+
+def write_dump(path, count, compresslevel=9, **options):
+    """Write count generated lines to a .tsv.bz2 file at path."""
+    with bz2.open(path, 'wt', compresslevel=compresslevel, encoding='utf-8') as f:
+        for line in generate_lines(count, **options):
+            f.write(line)
+
+
+def generate_lines(count, seed=0, wiki_db='enwiki', non_revision_ratio=0.15, bot_ratio=0.1,
+                   empty_ratio=0.05, autosummary_ratio=0.1, section_ratio=0.3, escape_density=0.05,
+                   comment_length=40):
+    """Iterate over count lines of a history dump, each with a trailing newline.
+
+    Events are in timestamp order, a few minutes apart on average, as
+    in a real dump file.
+
+    """
+    rng = random.Random(seed)
+    generator = _Generator(rng, wiki_db, bot_ratio, empty_ratio, autosummary_ratio, section_ratio,
+                           escape_density, comment_length)
+    event_types = [(entity, type) for entity, type, _ in OTHER_EVENTS]
+    weights = [weight for _, _, weight in OTHER_EVENTS]
+    timestamp = START_TIME
+    for _ in range(count):
+        timestamp += timedelta(seconds=rng.expovariate(1 / 300))
+        if rng.random() < non_revision_ratio:
+            entity, event_type = rng.choices(event_types, weights)[0]
+            fields = generator.other(entity, event_type, timestamp)
+        else:
+            fields = generator.revision(timestamp)
+        yield '\t'.join(fields) + '\n'
+
+
+class _Generator:
+    def __init__(self, rng, wiki_db, bot_ratio, empty_ratio, autosummary_ratio, section_ratio,
+                 escape_density, comment_length):
+        self.rng = rng
+        self.wiki_db = wiki_db
+        self.bot_ratio = bot_ratio
+        self.empty_ratio = empty_ratio
+        self.autosummary_ratio = autosummary_ratio
+        self.section_ratio = section_ratio
+        self.escape_density = escape_density
+        self.comment_length = comment_length
+        self.revision_id = 1000
+        self.page_revisions = {}
+
+
+    def revision(self, timestamp):
+        rng = self.rng
+        fields = self._event('revision', 'create', timestamp)
+        is_bot = rng.random() < self.bot_ratio
+        self._user(fields, 'event_user', is_bot)
+        page_id = self._page(fields)
+        parent_id = self.page_revisions.get(page_id, 0)
+        self.revision_id += rng.randint(1, 50)
+        self.page_revisions[page_id] = self.revision_id
+        text_bytes = rng.randint(100, 100000)
+        fields[FIELD_INDEX['event_comment_escaped']] = escape_tnr(self._comment(fields))
+        self._set(fields,
+                  revision_id=self.revision_id,
+                  revision_parent_id=parent_id,
+                  revision_minor_edit=_bool(rng.random() < 0.3),
+                  revision_deleted_parts_are_suppressed='false',
+                  revision_text_bytes=text_bytes,
+                  revision_text_bytes_diff=rng.randint(-text_bytes // 10, text_bytes // 10),
+                  revision_text_sha1=''.join(rng.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=31)),
+                  revision_is_deleted_by_page_deletion='false',
+                  revision_is_identity_reverted=_bool(rng.random() < 0.05),
+                  revision_is_identity_revert=_bool(rng.random() < 0.05),
+                  revision_is_from_before_page_creation='false',
+                  revision_tags_string=rng.choice(['', '', '', 'mobile edit,mobile web edit', 'visualeditor']),
+                  )
+        return fields
+
+
+    def other(self, entity, event_type, timestamp):
+        rng = self.rng
+        fields = self._event(entity, event_type, timestamp)
+        self._user(fields, 'event_user', rng.random() < self.bot_ratio)
+        if entity == 'user':
+            self._user(fields, 'user', False)
+            if event_type != 'create':
+                fields[FIELD_INDEX['event_comment_escaped']] = escape_tnr(self._words(self.comment_length))
+        else:
+            self._page(fields)
+            if event_type != 'create':
+                fields[FIELD_INDEX['event_comment_escaped']] = escape_tnr(self._words(self.comment_length))
+        return fields
+
+
+    def _event(self, entity, event_type, timestamp):
+        fields = [''] * len(field_names)
+        self._set(fields,
+                  wiki_db=self.wiki_db,
+                  event_entity=entity,
+                  event_type=event_type,
+                  event_timestamp=timestamp.strftime(TIMESTAMP_FORMAT),
+                  )
+        return fields
+
+
+    def _user(self, fields, prefix, is_bot):
+        rng = self.rng
+        anonymous = not is_bot and rng.random() < 0.2
+        if anonymous:
+            name = '.'.join(str(rng.randint(1, 254)) for _ in range(4))
+            self._set(fields, **{f'{prefix}_text_historical_escaped': name,
+                                 f'{prefix}_text_escaped': name,
+                                 f'{prefix}_is_anonymous': 'true',
+                                 })
+            return
+        # A few users make most of the edits.
+        user_id = int(rng.paretovariate(1.1) * 1000)
+        name = f'Bot{user_id}' if is_bot else f'User_{user_id}'
+        groups = rng.choice(BOT_GROUPS) if is_bot else rng.choice(USER_GROUPS)
+        bot_by = rng.choice(['name,group', 'group']) if is_bot else ''
+        created = (START_TIME + timedelta(days=user_id % 7000)).strftime(TIMESTAMP_FORMAT)
+        self._set(fields, **{f'{prefix}_id': user_id,
+                             f'{prefix}_text_historical_escaped': name,
+                             f'{prefix}_text_escaped': name,
+                             f'{prefix}_groups_historical_string': groups,
+                             f'{prefix}_groups_string': groups,
+                             f'{prefix}_is_bot_by_historical_string': bot_by,
+                             f'{prefix}_is_bot_by_string': bot_by,
+                             f'{prefix}_is_created_by_self': 'true',
+                             f'{prefix}_is_created_by_system': 'false',
+                             f'{prefix}_is_created_by_peer': 'false',
+                             f'{prefix}_is_anonymous': 'false',
+                             f'{prefix}_registration_timestamp': created,
+                             f'{prefix}_creation_timestamp': created,
+                             f'{prefix}_first_edit_timestamp': created,
+                             })
+        if prefix == 'event_user':
+            self._set(fields,
+                      event_user_revision_count=rng.randint(1, 100000),
+                      event_user_seconds_since_previous_revision=rng.randint(1, 10**6))
+
+
+    def _page(self, fields):
+        rng = self.rng
+        page_id = int(rng.paretovariate(0.8) * 100)
+        namespace = rng.choices([n for n, _ in NAMESPACES], [w for _, w in NAMESPACES])[0]
+        title = '_'.join(self._words(12).title().split()) or 'Main_Page'
+        is_content = _bool(namespace == 0)
+        created = (START_TIME + timedelta(hours=page_id % 100000)).strftime(TIMESTAMP_FORMAT)
+        self._set(fields,
+                  page_id=page_id,
+                  page_title_historical_escaped=title,
+                  page_title_escaped=title,
+                  page_namespace_historical=namespace,
+                  page_namespace_is_content_historical=is_content,
+                  page_namespace=namespace,
+                  page_namespace_is_content=is_content,
+                  page_is_redirect=_bool(rng.random() < 0.1),
+                  page_is_deleted='false',
+                  page_creation_timestamp=created,
+                  page_first_edit_timestamp=created,
+                  page_revision_count=rng.randint(1, 5000),
+                  page_seconds_since_previous_revision=rng.randint(1, 10**7),
+                  )
+        return page_id
+
+
+    def _comment(self, fields):
+        rng = self.rng
+        choice = rng.random()
+        if choice < self.empty_ratio:
+            return ''
+        choice -= self.empty_ratio
+        if choice < self.autosummary_ratio:
+            title = fields[FIELD_INDEX['page_title_escaped']].replace('_', ' ')
+            return rng.choice(AUTOSUMMARIES).format(title=title, words=self._words(self.comment_length))
+        length = min(500, max(1, int(rng.lognormvariate(math.log(self.comment_length), 0.8))))
+        comment = self._words(length)
+        if rng.random() < self.escape_density:
+            words = comment.split(' ')
+            for _ in range(rng.randint(1, 3)):
+                words.insert(rng.randint(0, len(words)), rng.choice(['\t', '\n', '\n|']))
+            comment = ' '.join(words)
+        if rng.random() < self.section_ratio:
+            comment = f'/* {rng.choice(SECTIONS)} */ {comment}'
+        return comment
+
+
+    def _words(self, length):
+        words = []
+        size = 0
+        while size < length:
+            word = self.rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join(words)[:length].strip()
+
+
+    def _set(self, fields, **values):
+        for name, value in values.items():
+            fields[FIELD_INDEX[name]] = str(value)
+
+
+def _bool(value):
+    return 'true' if value else 'false'
+
+
+if __name__ == '__main__':
+    main()
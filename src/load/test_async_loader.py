@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import pytest
+
+from load.bulk_stub import BulkStub
+from load.test_load_comments import FlakyStub, make_document
+
+
+@pytest.fixture
+def async_loader():
+    pytest.importorskip('opensearchpy')
+    pytest.importorskip('aiohttp')
+    from load import async_loader
+    return async_loader
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_async_indexer_sends_all_documents(async_loader, concurrency):
+    with BulkStub(latency=0.01) as stub:
+        client = async_loader.make_client([stub.url], concurrency)
+        indexer = async_loader.AsyncBulkIndexer(client, 'test', 100, concurrency=concurrency)
+        asyncio.run(indexer.load(make_document(i) for i in range(1050)))
+    assert stub.action_count == 1050
+    assert stub.request_count == 11
+    assert indexer.insert_count == 1050
+    assert len(indexer.latencies) == 11
+
+
+def test_async_indexer_retries_rejections_and_records_failures(async_loader, tmp_path):
+    dead_letter_path = tmp_path / 'dead.jsonl'
+    with FlakyStub() as stub, open(dead_letter_path, 'w') as dead_letter:
+        client = async_loader.make_client([stub.url], 2)
+        indexer = async_loader.AsyncBulkIndexer(client, 'test', 10, concurrency=2,
+                                                backoff=0.01, dead_letter=dead_letter)
+        asyncio.run(indexer.load(dict(make_document(i), bad=(i == 3)) for i in range(25)))
+    assert indexer.insert_count == 24
+    assert indexer.retry_count == 24
+    assert indexer.failure_count == 1
+    failure, = [json.loads(line) for line in dead_letter_path.read_text().splitlines()]
+    assert failure['source']['id'] == '3'
+
+
+def test_async_indexer_raises_input_errors(async_loader):
+    def documents():
+        for i in range(25):
+            yield make_document(i)
+        raise ValueError('bad input')
+
+    with BulkStub() as stub:
+        client = async_loader.make_client([stub.url], 2)
+        indexer = async_loader.AsyncBulkIndexer(client, 'test', 10, concurrency=2)
+        with pytest.raises(ValueError, match='bad input'):
+            asyncio.run(indexer.load(documents()))
+    assert stub.action_count <= 20
@@ -0,0 +1,76 @@
+import bz2
+
+import pytest
+
+from load.block_index import BlockFilter, BlockReader, build_block_index, read_block_index
+from load.pipeline import run
+from load.row_filter import RowFilter, TIMESTAMP_INDEX
+from load.stats import STATS
+from load.synthetic import generate_lines
+
+
+LINES = list(generate_lines(3000, seed=3))
+
+
+@pytest.fixture
+def dump(tmp_path):
+    path = tmp_path / 'dump.tsv.bz2'
+    # Two streams of small blocks, so rows cross block boundaries.
+    data = ''.join(LINES).encode()
+    path.write_bytes(bz2.compress(data[:700001], 1) + bz2.compress(data[700001:], 1))
+    return path
+
+
+def test_summaries(dump):
+    summaries = build_block_index(dump)
+    assert summaries == read_block_index(dump)
+    assert len(summaries) > 4
+    assert sum(summary.row_count for summary in summaries) == len(LINES)
+    timestamps = [line.split('\t')[TIMESTAMP_INDEX] for line in LINES]
+    assert summaries[0].min_timestamp == min(timestamps)
+    assert max(summary.max_timestamp for summary in summaries) == max(timestamps)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+@pytest.mark.parametrize('block_filter', [BlockFilter('2001-01-18 00:00:00', '2001-01-20 00:00:00', None),
+                                          BlockFilter('2001-01-24 00:00:00', None, [4, 10]),
+                                          BlockFilter(None, None, [99])])
+def test_reader_keeps_matching_rows(dump, workers, block_filter):
+    build_block_index(dump)
+    row_filter = RowFilter(namespaces=block_filter.namespaces, since=block_filter.since,
+                           until=block_filter.until, include_bots=True)
+    expected = list(row_filter.filter(LINES))
+    assert expected or block_filter.namespaces == [99]
+    STATS.reset()
+    reader = BlockReader(dump, block_filter, workers)
+    assert list(row_filter.filter(reader)) == expected
+    assert STATS.counters[STATS.key('blocks_skipped')] > 0
+    assert reader.decompressed_bytes < sum(map(len, LINES))
+    assert 'blocks' in reader.report()
+
+
+def test_run_without_index_reads_everything(dump):
+    block_filter = BlockFilter('2001-01-24 00:00:00', None, None)
+    assert list(run(list, [dump], report=lambda summary: None, block_filter=block_filter)) == LINES
+    build_block_index(dump)
+    lines = list(run(list, [dump], report=lambda summary: None, block_filter=block_filter))
+    assert len(lines) < len(LINES)
+    assert lines == LINES[-len(lines):]
+
+
+def test_stale_index(dump):
+    with pytest.raises(ValueError, match='build it with "block-index build '):
+        read_block_index(dump)
+    build_block_index(dump)
+    dump.write_bytes(dump.read_bytes() + bz2.compress(LINES[0].encode()))
+    with pytest.raises(ValueError, match='rebuild'):
+        read_block_index(dump)
+
+
+def test_run_with_stale_index_reads_everything(dump):
+    build_block_index(dump)
+    dump.write_bytes(dump.read_bytes() + bz2.compress(LINES[0].encode()))
+    block_filter = BlockFilter('2001-01-24 00:00:00', None, None)
+    with pytest.warns(UserWarning, match='rebuild it; reading all of'):
+        lines = list(run(list, [dump], report=lambda summary: None, block_filter=block_filter))
+    assert lines == LINES + LINES[:1]
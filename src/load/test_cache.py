@@ -0,0 +1,105 @@
+import bz2
+import os
+
+import pytest
+
+from load import cache as cache_module
+from load.cache import CacheReader, DocumentCache
+from load.pipeline import run
+
+
+def first_fields(lines):
+    for line in lines:
+        yield {'id': line.split('\t')[0]}
+
+
+def write_dump(path, count):
+    text = ''.join(f'{i}\tline {i}\n' for i in range(count))
+    path.write_bytes(bz2.compress(text.encode(), 1))
+    return str(path)
+
+
+@pytest.fixture
+def dump(tmp_path):
+    return write_dump(tmp_path / 'part.tsv.bz2', 25000)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DocumentCache(tmp_path / 'cache', 'test:1')
+
+
+def test_round_trip(dump, cache):
+    documents = [{'id': i, 'text': f'comment {i}'} for i in range(25000)]
+    writer = cache.writer(dump)
+    for document in documents:
+        writer.add(document)
+    writer.commit(123)
+    reader = cache.open(dump)
+    assert list(reader) == documents
+    assert reader.document_count == 25000
+    assert reader.line_count == 123
+    assert len(reader.chunks) == 3
+
+
+def test_abort_leaves_nothing(dump, cache):
+    writer = cache.writer(dump)
+    writer.add({'id': 1})
+    writer.abort()
+    assert cache.open(dump) is None
+    assert os.listdir(cache.directory) == []
+
+
+def test_key_includes_version_and_mtime(dump, cache):
+    writer = cache.writer(dump)
+    writer.commit(0)
+    assert cache.open(dump) is not None
+    assert DocumentCache(cache.directory, 'test:2').open(dump) is None
+    assert DocumentCache(cache.directory, 'test:1', rebuild=True).open(dump) is None
+    os.utime(dump, ns=(0, 0))
+    assert cache.open(dump) is None
+
+
+def test_evict_removes_least_recently_used(tmp_path, cache):
+    paths = [write_dump(tmp_path / f'part{n}.tsv.bz2', 10) for n in range(3)]
+    for n, path in enumerate(paths):
+        writer = cache.writer(path)
+        writer.add({'id': n})
+        writer.commit(10)
+        os.utime(cache.entry_path(path), (n, n))
+    cache.max_bytes = 2 * cache.entry_path(paths[0]).stat().st_size
+    cache.evict()
+    assert cache.open(paths[0]) is None
+    assert cache.open(paths[1]) is not None
+    assert cache.open(paths[2]) is not None
+
+
+def test_zlib_fallback(dump, cache, monkeypatch):
+    monkeypatch.setattr(cache_module, 'zstandard', None)
+    writer = cache.writer(dump)
+    writer.add({'id': 1})
+    writer.commit(1)
+    assert CacheReader(cache.entry_path(dump)).codec == b'z'
+    assert list(cache.open(dump)) == [{'id': 1}]
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_run_reads_from_cache(dump, cache, workers):
+    expected = [{'id': str(i)} for i in range(25000)]
+    assert list(run(first_fields, [dump], workers, report=lambda _: None, cache=cache)) == expected
+
+    reports = []
+    progress = {}
+    results = run(lambda lines: pytest.fail('should have used the cache'), [dump], workers,
+                  report=reports.append, progress=progress, cache=cache)
+    assert list(results) == expected
+    assert progress == {dump: 25000}
+    assert reports == [f'{dump}: 25000 results read from cache']
+
+
+def test_run_abandoned_early_is_not_cached(dump, cache):
+    results = run(first_fields, [dump], report=lambda _: None, cache=cache)
+    next(results)
+    results.close()
+    assert cache.open(dump) is None
+    assert os.listdir(cache.directory) == []
@@ -0,0 +1,45 @@
+import pytest
+
+from load.comment_classifier import TAG_PATTERNS, classify, get_human_text, get_section
+
+
+@pytest.mark.parametrize('text,human,section', [
+    ('*', '', ''),
+    ('fix typo', 'fix typo', ''),
+    ('/* History */ fix typo', ' fix typo', 'History'),
+    ('/* unterminated', '/* unterminated', ''),
+    ('[[WP:AES|←]]Redirected page to [[X]]', '', ''),
+    ('[[Wikipedia:Zusammenfassung|←]]Weiterleitung nach [[X]] erstellt', '', ''),
+    ("Created page with 'X is a'", '', ''),
+])
+def test_get_human_text_and_section(text, human, section):
+    assert get_human_text(text) == human
+    assert get_section(text) == section
+
+
+TAG_EXAMPLES = [
+    ('Undid revision 1134 by [[Special:Contributions/X|X]] ([[User talk:X|talk]])', ('undo',)),
+    ('Änderung 2251 von [[Spezial:Beiträge/X|X]] rückgängig gemacht; Grund', ('undo',)),
+    ('Annulation des modifications 2080 de [[Spécial:Contributions/X|X]]', ('undo',)),
+    ('Отмена правки 1296 участника [[Служебная:Вклад/X|X]]', ('undo',)),
+    ('Reverted edits by [[Special:Contributions/X|X]] to last version by Y', ('rollback',)),
+    ('Reverted 2 edits by [[Special:Contributions/X|X]]: vandalism ([[WP:TW|TW]])', ('rollback', 'twinkle')),
+    ('Révocation des modifications de [[Spécial:Contributions/X|X]]', ('rollback',)),
+    ('Revertidos los cambios de [[Especial:Contribuciones/X|X]]', ('rollback',)),
+    ('/* Career */ [[WP:AWB/T|Typo fixing]], using [[Project:AWB|AWB]]', ('awb',)),
+    ('Reverting possible vandalism by X ([[WP:HG|HG]]) (3.4.12)', ('huggle',)),
+    ('removed [[Category:X]]; added [[Category:Y]] using [[WP:HC|HotCat]]', ('hotcat',)),
+    ('Filled in 3 bare reference(s) with [[:en:WP:REFILL|reFill 2]]', ('refill',)),
+    ('Rescuing 1 sources and tagging 0 as dead.) #IABot (v2.0.9.2', ('iabot',)),
+    ('Taiwan, TWD and Hugging are not tools', ()),
+    ('fix typo', ()),
+]
+
+
+@pytest.mark.parametrize('text,tags', TAG_EXAMPLES)
+def test_tags(text, tags):
+    assert classify(text).tags == tags
+
+
+def test_every_tag_has_an_example():
+    assert set(TAG_PATTERNS) <= {tag for _, tags in TAG_EXAMPLES for tag in tags}
@@ -0,0 +1,94 @@
+import bz2
+
+import pytest
+
+from load.cache import DocumentCache
+from load.dedup import Deduplicator, normalize, simhash
+from load.index_lifecycle import INDEX_MAPPINGS
+from load.pipeline import run
+
+
+def make_document(i, comment, db='enwiki'):
+    return {'id': str(i), 'db': db, 'ts': '2023-01-31 21:32:07.0', 'co': comment, 'un': 'Example',
+            'se': '', 'tg': []}
+
+
+REVERT = 'Reverted edits by [[Special:Contributions/{0}|{0}]] ([[User talk:{0}|talk]]) to last version by Bot{1}'
+
+DOCUMENTS = [make_document(0, 'typo'),
+             make_document(1, REVERT.format('1.2.3.4', 1)),
+             make_document(2, 'Typo '),
+             make_document(3, 'expanded the history section'),
+             make_document(4, REVERT.format('Vandal', 2)),
+             make_document(5, 'typo', db='dewiki'),
+             make_document(6, 'typo'),
+             ]
+
+
+def test_normalize():
+    assert normalize(REVERT.format('1.2.3.4', 7)) == normalize(REVERT.format('Someone', 12))
+    assert normalize('See  http://example.org/x, [[Paris|the capital]]') == 'see url [[]]'
+
+
+def test_simhash_of_near_duplicates():
+    words = ' '.join(f'word{i}' for i in range(40))
+    assert (simhash(words) ^ simhash(words.replace('word7', 'other'))).bit_count() <= 3
+    assert (simhash(words) ^ simhash('something else entirely')).bit_count() > 3
+    assert simhash('') == 0
+
+
+def test_drop():
+    deduplicator = Deduplicator('drop')
+    kept = list(deduplicator.filter(dict(document) for document in DOCUMENTS))
+    assert [document['id'] for document in kept] == ['0', '1', '3', '5']
+    assert deduplicator.template_doc_count == 3
+    assert 'of source saved' in deduplicator.report()
+
+
+def test_collapse():
+    deduplicator = Deduplicator('collapse', min_count=2)
+    documents = list(deduplicator.filter(dict(document) for document in DOCUMENTS))
+    assert [(document['id'], document.get('ct')) for document in documents] == [
+        ('0', None), ('1', None), ('3', None), ('5', None), ('2', 2), ('4', 1)]
+    assert documents[-1]['tg'] == ['template']
+    assert set(documents[-1]) <= set(INDEX_MAPPINGS['properties'])
+
+
+def test_tag():
+    deduplicator = Deduplicator('tag', min_count=3)
+    documents = list(deduplicator.filter(dict(document) for document in DOCUMENTS))
+    assert len(documents) == len(DOCUMENTS)
+    assert [document['id'] for document in documents if document['tg']] == ['6']
+
+
+@pytest.mark.parametrize('mode', ['drop', 'collapse'])
+def test_memory_is_bounded(mode):
+    deduplicator = Deduplicator(mode, capacity=100)
+    words = [chr(ord('a') + i // 26) + chr(ord('a') + i % 26) for i in range(26 * 26)]
+    documents = [make_document(i, f'comment {words[i % 500]} {words[i // 500]}') for i in range(1000)]
+    documents += [make_document(1000 + i, 'typo') for i in range(50)]
+    documents = [document for pair in zip(documents[:50], documents[-50:]) for document in pair] + documents[50:-50]
+    output = list(deduplicator.filter(documents))
+    assert deduplicator.prune_count > 0
+    assert len(deduplicator.templates) <= 100
+    # Every document is sent, or dropped, or counted in a collapsed one.
+    dropped = deduplicator.template_doc_count if mode == 'drop' else 0
+    assert sum(document.get('ct', 1) for document in output) + dropped == 1050
+    assert [document['co'] for document in output].count('typo') == 1 + (mode == 'collapse')
+
+
+def test_tag_leaves_cached_documents_alone(tmp_path):
+    dump = tmp_path / 'dump.tsv.bz2'
+    dump.write_bytes(bz2.compress(''.join(f'{i}\ttypo\n' for i in range(5)).encode()))
+    cache = DocumentCache(tmp_path / 'cache', 'test:1')
+    documents = run(_documents, [str(dump)], report=lambda summary: None, cache=cache)
+    tagged = list(Deduplicator('tag').filter(documents))
+    assert [document['tg'] for document in tagged] == [[]] + [['template']] * 4
+    cached = list(run(_documents, [str(dump)], report=lambda summary: None, cache=cache))
+    assert [document['tg'] for document in cached] == [[]] * 5
+
+
+def _documents(lines):
+    for line in lines:
+        i, comment = line.rstrip('\n').split('\t')
+        yield make_document(i, comment)
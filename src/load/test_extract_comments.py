@@ -0,0 +1,68 @@
+import bz2
+
+import pytest
+
+from load.benchmark import SAMPLE_LINES
+from load.extract_comments import get_records
+from load.row_filter import ENTITY_INDEX, REVISION_INDEX, RowFilter
+
+
+REVISION = SAMPLE_LINES[1].replace('\tbot\tbot\tname,group\tname,group\t', '\t\t\t\t\t')
+
+
+def as_page_row(line):
+    fields = line.split('\t')
+    fields[ENTITY_INDEX] = 'page'
+    fields[REVISION_INDEX] = ''
+    return '\t'.join(fields)
+
+
+def test_get_records():
+    records = list(get_records([SAMPLE_LINES[0], SAMPLE_LINES[1], REVISION, SAMPLE_LINES[2]]))
+    assert records == [{'wiki_db': 'enwiki',
+                        'revision_id': 1136732310,
+                        'timestamp': '2023-01-31 21:32:07.0',
+                        'user': 'BattyBot',
+                        'page': 'Dmitry_Bukhman',
+                        'section': 'top',
+                        'comment': '[[WP:AWB/GF|General fixes]], replaced: | nationality    \t= [[Israel]]\n| → | nationality    \t= Israeli\n|',
+                        'tags': ['awb'],
+                        }]
+
+
+def test_write_parquet(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from load.parquet_writer import write_parquet
+
+    records = list(get_records([REVISION])) * 5
+    path = tmp_path / 'out.parquet'
+    assert write_parquet(records, path, row_group_size=2) == 5
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.num_row_groups == 3
+    table = pq.read_table(path, columns=['user', 'timestamp'])
+    assert table.column('user').to_pylist() == ['BattyBot'] * 5
+    assert str(table.column('timestamp')[0]) == '2023-01-31 21:32:07'
+
+
+def test_write_parquet_with_empty_timestamp(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    from load.parquet_writer import write_parquet
+
+    record, = get_records([REVISION])
+    path = tmp_path / 'out.parquet'
+    assert write_parquet([record, dict(record, timestamp='')], path) == 2
+    timestamps = pq.read_table(path, columns=['timestamp']).column('timestamp').to_pylist()
+    assert str(timestamps[0]) == '2023-01-31 21:32:07'
+    assert timestamps[1] is None
+
+
+def test_get_records_for_page_rows(tmp_path):
+    record, = get_records([as_page_row(REVISION)], row_filter=RowFilter(['page']))
+    assert record['revision_id'] is None
+    assert record['page'] == 'Dmitry_Bukhman'
+    pq = pytest.importorskip('pyarrow.parquet')
+    from load.parquet_writer import write_parquet
+
+    path = tmp_path / 'out.parquet'
+    assert write_parquet([record], path) == 1
+    assert pq.read_table(path).column('revision_id').to_pylist() == [None]
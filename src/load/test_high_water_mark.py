@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from load.high_water_mark import HighWaterMarks
+
+
+def document(db, ts, id):
+    return {'id': str(id), 'db': db, 'ts': ts, 'co': 'comment', 'un': 'Example'}
+
+
+def test_marks_are_saved_and_reloaded(tmp_path):
+    path = tmp_path / 'state.json'
+    marks = HighWaterMarks(path)
+    assert marks.marks == {}
+    marks.observe(document('enwiki', '2023-01-31 21:32:07.0', 20))
+    marks.observe(document('enwiki', '2023-01-31 21:32:07.0', 10))
+    marks.observe(document('dewiki', '2022-12-01 00:00:00.0', 5))
+    marks.save()
+    assert json.loads(path.read_text())['wikis']['enwiki'] == {'event_timestamp': '2023-01-31 21:32:07.0',
+                                                                'revision_id': 20}
+
+    marks = HighWaterMarks(path)
+    assert marks.covers(document('enwiki', '2023-01-31 21:32:07.0', 20))
+    assert not marks.covers(document('enwiki', '2023-01-31 21:32:07.0', 21))
+    assert marks.covers(document('enwiki', '2022-01-01 00:00:00.0', 100))
+    assert not marks.covers(document('frwiki', '2001-01-01 00:00:00.0', 1))
+    # An earlier document doesn't lower the mark.
+    marks.observe(document('dewiki', '2020-01-01 00:00:00.0', 1))
+    marks.save()
+    assert HighWaterMarks(path).marks['dewiki'] == ('2022-12-01 00:00:00.0', 5)
+
+
+@pytest.mark.parametrize('name,covered', [
+    ('2023-03.enwiki.2022.tsv.bz2', True),
+    ('2023-03.enwiki.2023-01.tsv.bz2', True),
+    ('2023-03.enwiki.2023-02.tsv.bz2', False),
+    ('2023-03.enwiki.2023.tsv.bz2', False),
+    ('2023-03.dewiki.2022.tsv.bz2', False),
+    ('2023-03.enwiki.all-time.tsv.bz2', False),
+    ('history.tsv.bz2', False),
+])
+def test_covers_file(tmp_path, name, covered):
+    marks = HighWaterMarks(tmp_path / 'state.json')
+    marks.marks = {'enwiki': ('2023-02-01 00:00:00.0', 100)}
+    assert marks.covers_file(f'/dumps/{name}') == covered
@@ -0,0 +1,65 @@
+import pytest
+
+from load.bulk_stub import BulkStub
+
+
+@pytest.fixture
+def lifecycle():
+    pytest.importorskip('opensearchpy')
+    from load import index_lifecycle
+    return index_lifecycle
+
+
+@pytest.fixture
+def stub():
+    with BulkStub() as stub:
+        yield stub
+
+
+@pytest.fixture
+def client(lifecycle, stub):
+    return lifecycle.opensearchpy.OpenSearch(hosts=[stub.url])
+
+
+def test_create_index(lifecycle, stub, client):
+    lifecycle.create_index(client, 'comments-1', shards=2, replicas=1)
+    index = stub.indices['comments-1']
+    assert index['mappings'] == lifecycle.INDEX_MAPPINGS
+    assert index['settings']['number_of_shards'] == '2'
+    assert index['settings']['analysis']['analyzer']['comment']['tokenizer'] == 'standard'
+
+
+def test_bulk_load_settings_are_restored(lifecycle, stub, client):
+    lifecycle.create_index(client, 'comments-1')
+    with lifecycle.bulk_load_settings(client, 'comments-1'):
+        assert stub.indices['comments-1']['settings']['refresh_interval'] == '-1'
+        assert stub.indices['comments-1']['settings']['number_of_replicas'] == '0'
+    settings = stub.indices['comments-1']['settings']
+    assert 'refresh_interval' not in settings
+    assert settings['number_of_replicas'] == '1'
+    assert stub.admin_calls[-1] == ('POST', 'comments-1/_forcemerge')
+
+
+def test_bulk_load_settings_skip_force_merge_after_failure(lifecycle, stub, client):
+    lifecycle.create_index(client, 'comments-1', replicas=2)
+    with pytest.raises(RuntimeError):
+        with lifecycle.bulk_load_settings(client, 'comments-1'):
+            raise RuntimeError('load failed')
+    assert stub.indices['comments-1']['settings']['number_of_replicas'] == '2'
+    assert ('POST', 'comments-1/_forcemerge') not in stub.admin_calls
+
+
+def test_swap_alias(lifecycle, stub, client):
+    lifecycle.create_index(client, 'comments-1')
+    assert lifecycle.swap_alias(client, 'comments', 'comments-1') == []
+    lifecycle.create_index(client, 'comments-2')
+    assert lifecycle.swap_alias(client, 'comments', 'comments-2', delete_old=True) == ['comments-1']
+    assert stub.aliases['comments'] == {'comments-2'}
+    assert 'comments-1' not in stub.indices
+
+
+def test_swap_alias_refuses_to_replace_an_index(lifecycle, client):
+    lifecycle.create_index(client, 'comments')
+    lifecycle.create_index(client, 'comments-1')
+    with pytest.raises(ValueError):
+        lifecycle.swap_alias(client, 'comments', 'comments-1')
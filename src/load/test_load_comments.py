@@ -0,0 +1,247 @@
+import json
+from urllib.request import Request, urlopen
+
+import pytest
+
+from load.bulk_stub import BulkStub
+from load.row_filter import RowFilter
+
+
+@pytest.fixture
+def opensearchpy():
+    return pytest.importorskip('opensearchpy')
+
+
+@pytest.fixture
+def BulkIndexer(opensearchpy):
+    from load.load_comments import BulkIndexer
+    return BulkIndexer
+
+
+def make_document(i):
+    return {'id': str(i), 'db': 'enwiki', 'ts': '2023-01-31 21:32:07.0', 'co': f'comment {i}', 'un': 'Example'}
+
+
+def test_bulk_stub_acknowledges_actions():
+    body = b'{"index": {"_index": "x"}}\n{"a": 1}\n{"create": {"_index": "x", "_id": "7"}}\n{"a": 2}\n'
+    with BulkStub() as stub:
+        with urlopen(Request(f'{stub.url}/_bulk', data=body, method='POST')) as response:
+            result = json.load(response)
+    assert result['errors'] is False
+    assert [item.get('index', item.get('create'))['status'] for item in result['items']] == [201, 201]
+    assert result['items'][1]['create']['_id'] == '7'
+    assert stub.action_count == 2
+
+
+@pytest.mark.parametrize('concurrency', [1, 4])
+def test_bulk_indexer_sends_all_documents(opensearchpy, BulkIndexer, concurrency):
+    with BulkStub(latency=0.01) as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url], pool_maxsize=concurrency)
+        indexer = BulkIndexer(client, 'test', 100, concurrency=concurrency)
+        for i in range(1050):
+            indexer.index(make_document(i))
+        indexer.close()
+    assert stub.action_count == 1050
+    assert stub.request_count == 11
+    assert indexer.insert_count == 1050
+    assert len(indexer.latencies) == 11
+
+
+def test_bulk_indexer_batches_by_bytes(opensearchpy, BulkIndexer):
+    with BulkStub() as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        indexer = BulkIndexer(client, 'test', 1000, max_bytes=2000)
+        for i in range(100):
+            indexer.index(make_document(i))
+        indexer.close()
+    assert stub.action_count == 100
+    assert stub.request_count > 1
+    assert stub.body_bytes / stub.request_count < 2000 + 200
+
+
+@pytest.mark.parametrize('op_type', ['index', 'create'])
+def test_bulk_indexer_reloads_without_duplicates(opensearchpy, BulkIndexer, op_type):
+    with BulkStub() as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        for _ in range(2):
+            indexer = BulkIndexer(client, 'test', 10, op_type=op_type)
+            for i in range(25):
+                indexer.index(make_document(i))
+            indexer.close()
+    assert stub.ids == {f'enwiki:{i}' for i in range(25)}
+    assert indexer.failure_count == 0
+    if op_type == 'create':
+        assert (indexer.insert_count, indexer.existing_count) == (0, 25)
+    else:
+        assert (indexer.insert_count, indexer.existing_count) == (25, 0)
+
+
+def test_bulk_indexer_builds_ndjson_body(opensearchpy, BulkIndexer):
+    indexer = BulkIndexer(None, 'test', 10, op_type='create')
+    documents = [make_document(i) for i in range(3)]
+    for document in documents:
+        indexer._add(dict(document, co='é'))
+    request, _ = indexer._take_batch()
+    lines = [json.loads(line) for line in request.body.splitlines()]
+    assert lines[0::2] == [{'create': {'_id': f'enwiki:{i}'}} for i in range(3)]
+    assert lines[1::2] == [dict(document, co='é') for document in documents]
+    retry = request.select([2, 0])
+    assert [json.loads(line) for line in retry.body.splitlines()] == lines[4:6] + lines[0:2]
+    assert retry.docs == [request.docs[2], request.docs[0]]
+    assert retry.body[retry.offsets[1]:] == request.body[:request.offsets[1]]
+
+
+def test_bulk_indexer_compresses_requests(opensearchpy, BulkIndexer):
+    with BulkStub() as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url], http_compress=True)
+        indexer = BulkIndexer(client, 'test', 100)
+        for i in range(250):
+            indexer.index(make_document(i))
+        indexer.close()
+    assert stub.action_count == 250
+    assert indexer.insert_count == 250
+    assert stub.wire_bytes < stub.body_bytes / 2
+
+
+@pytest.mark.parametrize('per_wiki', ['index', 'routing'])
+def test_wiki_router_batches_each_wiki_separately(opensearchpy, BulkIndexer, per_wiki):
+    from load.load_comments import WikiRouter, wiki_index_name
+
+    with BulkStub(latency=0.01) as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url], pool_maxsize=3)
+
+        def make_indexer(db, executor, slots):
+            if per_wiki == 'index':
+                return BulkIndexer(client, wiki_index_name('test', db), 10, executor=executor, slots=slots, label=db)
+            return BulkIndexer(client, 'test', 10, routing=db, executor=executor, slots=slots, label=db)
+
+        router = WikiRouter(make_indexer, concurrency=3)
+        wikis = ['enwiki'] * 8 + ['dewiki', 'frwiki']
+        for i in range(100):
+            router.index(dict(make_document(i), db=wikis[i % len(wikis)]))
+        router.close()
+    assert stub.action_count == 100
+    assert all(len(targets) == 1 for targets in stub.targets)
+    if per_wiki == 'index':
+        expected = {('test-dewiki', None), ('test-enwiki', None), ('test-frwiki', None)}
+    else:
+        expected = {('test', 'dewiki'), ('test', 'enwiki'), ('test', 'frwiki')}
+    assert set().union(*stub.targets) == expected
+    assert {db: indexer.insert_count for db, indexer in router.indexers.items()} == {
+        'enwiki': 80, 'dewiki': 10, 'frwiki': 10}
+    assert router.failure_count == 0
+
+
+@pytest.mark.parametrize('options', [['--checkpoint', 'progress.json', '--no-ordered'],
+                                     ['--checkpoint', 'progress.json', '--resume', '--no-ordered']])
+def test_checkpoint_requires_ordered_input(opensearchpy, monkeypatch, capsys, options):
+    from load.load_comments import parse_command_line
+    monkeypatch.setattr('sys.argv', ['load-comments', '--host', 'localhost', '-f', 'dump.tsv.bz2'] + options)
+    with pytest.raises(SystemExit):
+        parse_command_line()
+    assert '--checkpoint requires --ordered' in capsys.readouterr().err
+    monkeypatch.setattr('sys.argv', ['load-comments', '--host', 'localhost', '-f', 'dump.tsv.bz2'] + options[:-1])
+    assert parse_command_line().ordered
+
+
+@pytest.mark.parametrize('options', [['--op-type', 'create'], ['--state-file', 'state.json']])
+def test_other_entities_need_no_revision_id(opensearchpy, monkeypatch, capsys, options):
+    from load.load_comments import parse_command_line
+    argv = ['load-comments', '--host', 'localhost', '-f', 'dump.tsv.bz2'] + options
+    monkeypatch.setattr('sys.argv', argv + ['--entity', 'revision', 'page'])
+    with pytest.raises(SystemExit):
+        parse_command_line()
+    assert 'only work with --entity revision' in capsys.readouterr().err
+    monkeypatch.setattr('sys.argv', argv)
+    assert parse_command_line().entity == ['revision']
+
+
+def test_state_file_needs_tsv_input(opensearchpy, monkeypatch, capsys):
+    from load.load_comments import parse_command_line
+    monkeypatch.setattr('sys.argv', ['load-comments', '--host', 'localhost', '--state-file', 'state.json',
+                                     '-f', 'enwiki-20230301-pages-meta-history1.xml-p1p844.bz2'])
+    with pytest.raises(SystemExit):
+        parse_command_line()
+    assert '--state-file only works with tsv input' in capsys.readouterr().err
+
+
+def test_interleave_wikis():
+    from load.load_comments import interleave_wikis
+
+    paths = ['2023-03.enwiki.2021.tsv.bz2', '2023-03.enwiki.2022.tsv.bz2', '2023-03.enwiki.2023-01.tsv.bz2',
+             '2023-03.dewiki.all-time.tsv.bz2', 'dewiki-20230301-pages-meta-history.xml.bz2']
+    assert interleave_wikis(paths) == [paths[0], paths[3], paths[1], paths[4], paths[2]]
+
+
+def test_get_documents_include_wiki():
+    from load.benchmark import SAMPLE_LINES
+    from load.load_comments import document_id, get_documents
+
+    document, = get_documents(SAMPLE_LINES, RowFilter(include_bots=True))
+    assert document['db'] == 'enwiki'
+    assert document_id(document) == f'enwiki:{document["id"]}'
+
+
+class FlakyStub(BulkStub):
+    """Reject each document with 429 the first time it's seen, and fail 'bad' documents."""
+    def __init__(self):
+        super().__init__()
+        self.seen = set()
+
+
+    def status(self, op_type, meta, source):
+        if source.get('bad'):
+            return 400
+        if source['id'] not in self.seen:
+            self.seen.add(source['id'])
+            return 429
+        return 201
+
+
+def test_bulk_indexer_retries_rejections_and_records_failures(opensearchpy, BulkIndexer, tmp_path):
+    dead_letter_path = tmp_path / 'dead.jsonl'
+    with FlakyStub() as stub, open(dead_letter_path, 'w') as dead_letter:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        indexer = BulkIndexer(client, 'test', 10, backoff=0.01, dead_letter=dead_letter)
+        for i in range(25):
+            indexer.index(dict(make_document(i), bad=(i == 3)))
+        indexer.close()
+    assert indexer.insert_count == 24
+    assert indexer.retry_count == 24
+    assert indexer.failure_count == 1
+    failure, = [json.loads(line) for line in dead_letter_path.read_text().splitlines()]
+    assert failure['status'] == 400
+    assert failure['source']['id'] == '3'
+
+
+def test_bulk_indexer_gives_up_after_max_retries(opensearchpy, BulkIndexer, tmp_path):
+    with FlakyStub() as stub, open(tmp_path / 'dead.jsonl', 'w') as dead_letter:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        indexer = BulkIndexer(client, 'test', 10, max_retries=0, dead_letter=dead_letter)
+        for i in range(5):
+            indexer.index(make_document(i))
+        indexer.close()
+    assert indexer.insert_count == 0
+    assert indexer.failure_count == 5
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_checkpoint_records_acknowledged_input(opensearchpy, BulkIndexer, tmp_path, concurrency):
+    from load.load_comments import Checkpoint
+
+    checkpoint = Checkpoint(tmp_path / 'checkpoint.json')
+    assert checkpoint.load() == {}
+    with BulkStub() as stub:
+        client = opensearchpy.OpenSearch(hosts=[stub.url])
+        indexer = BulkIndexer(client, 'test', 10, concurrency=concurrency, checkpoint=checkpoint)
+        for i in range(95):
+            checkpoint.progress['input'] = 2 * i + 1
+            indexer.index(make_document(i))
+            if i == 49:
+                indexer.flush()
+                for future in list(indexer.futures):
+                    future.result()
+                assert checkpoint.load() == {'input': 99}
+        checkpoint.progress['input'] = 200
+        indexer.close()
+    assert checkpoint.load() == {'input': 200}
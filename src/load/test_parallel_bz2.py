@@ -0,0 +1,78 @@
+import bz2
+
+import pytest
+
+import parallel_bz2
+from parallel_bz2 import Bz2LineReader, decompress_blocks, iter_blocks
+
+
+LINES = [f'{i}\tline {i} ' + 'é' * (i % 50) + 'x' * (i * 7919 % 300) + '\n' for i in range(12000)]
+DATA = ''.join(LINES).encode()
+
+
+@pytest.fixture
+def single_stream(tmp_path):
+    path = tmp_path / 'single.bz2'
+    path.write_bytes(bz2.compress(DATA, 1))
+    return path
+
+
+@pytest.fixture
+def multi_stream(tmp_path):
+    path = tmp_path / 'multi.bz2'
+    path.write_bytes(bz2.compress(DATA[:250001], 1) + bz2.compress(DATA[250001:], 1))
+    return path
+
+
+@pytest.mark.parametrize('fixture', ['single_stream', 'multi_stream'])
+def test_blocks_decompress_independently(fixture, request):
+    path = request.getfixturevalue(fixture)
+    blocks = list(iter_blocks(path))
+    assert len(blocks) > 1
+    assert b''.join(decompress_blocks(path, [block]) for block in blocks) == DATA
+
+
+@pytest.mark.parametrize('fixture', ['single_stream', 'multi_stream'])
+@pytest.mark.parametrize('workers', [0, 2])
+def test_reader_returns_lines_in_order(fixture, workers, request):
+    path = request.getfixturevalue(fixture)
+    reader = Bz2LineReader(path, workers=workers, chunk_size=30000)
+    assert list(reader) == LINES
+    assert reader.decompressed_bytes == len(DATA)
+
+
+def test_unordered_reader_returns_all_lines(single_stream):
+    reader = Bz2LineReader(single_stream, workers=2, ordered=False, chunk_size=20000)
+    assert sorted(reader) == sorted(LINES)
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_reader_handles_lines_longer_than_chunks(tmp_path, ordered):
+    data = b'a' * 2000000 + b'\n' + b'b' * 10 + b'\n' + b'c' * 2000000
+    path = tmp_path / 'long.bz2'
+    path.write_bytes(bz2.compress(data, 1))
+    reader = Bz2LineReader(path, workers=2, ordered=ordered, encoding=None, chunk_size=10000)
+    assert sorted(reader) == sorted(data.splitlines(keepends=True))
+
+
+def split_a_block(path, chunk_size):
+    # Chunks as iter_chunks() makes them, but with a block cut in two,
+    # as a false block magic number would.
+    blocks = list(iter_blocks(path))
+    start, end, crc = blocks[1]
+    middle = (start + end) // 2
+    blocks[1:2] = [(start, middle, crc), (middle, end, crc)]
+    return [blocks[i:i + 2] for i in range(0, len(blocks), 2)]
+
+
+def test_ordered_reader_recovers_from_false_block_boundary(single_stream, monkeypatch):
+    monkeypatch.setattr(parallel_bz2, 'iter_chunks', split_a_block)
+    reader = Bz2LineReader(single_stream, workers=2, chunk_size=30000)
+    assert list(reader) == LINES
+
+
+def test_unordered_reader_fails_on_false_block_boundary(single_stream, monkeypatch):
+    monkeypatch.setattr(parallel_bz2, 'iter_chunks', split_a_block)
+    reader = Bz2LineReader(single_stream, workers=2, ordered=False, chunk_size=30000)
+    with pytest.raises(ValueError, match='ordered=True'):
+        list(reader)
@@ -0,0 +1,65 @@
+import bz2
+from itertools import islice
+
+import pytest
+
+from load.pipeline import expand_paths, map_batches, run
+
+
+def first_fields(lines):
+    for line in lines:
+        yield line.split('\t')[0]
+
+
+def write_dump(path, start, count):
+    text = ''.join(f'{i}\tline {i}\n' for i in range(start, start + count))
+    path.write_bytes(bz2.compress(text.encode(), 1))
+    return str(path)
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    return [write_dump(tmp_path / f'part{n}.tsv.bz2', n * 10000, 10000) for n in range(3)]
+
+
+def test_expand_paths_expands_globs(dumps, tmp_path):
+    assert expand_paths([str(tmp_path / '*.bz2'), 'missing.bz2']) == dumps + ['missing.bz2']
+
+
+def test_map_batches_preserves_order():
+    lines = [f'{i}\tx\n' for i in range(5000)]
+    assert list(map_batches(first_fields, lines, 2, batch_size=300)) == [str(i) for i in range(5000)]
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_run_single_file(dumps, workers):
+    reports = []
+    results = list(run(first_fields, dumps[:1], workers, report=reports.append))
+    assert results == [str(i) for i in range(10000)]
+    assert len(reports) == 1
+
+
+@pytest.mark.parametrize('bz2_workers', [0, 2])
+def test_run_multiple_files(dumps, bz2_workers):
+    reports = []
+    results = run(first_fields, dumps, 2, report=reports.append, bz2_workers=bz2_workers)
+    assert sorted(results, key=int) == [str(i) for i in range(30000)]
+    assert len(reports) == 3
+
+
+def test_run_can_be_abandoned(dumps):
+    results = run(first_fields, dumps, 2)
+    assert len(list(islice(results, 10))) == 10
+    results.close()
+
+
+@pytest.mark.parametrize('workers,files', [(0, 1), (0, 3), (2, 1), (2, 3)])
+def test_run_tracks_progress_and_skips(dumps, workers, files):
+    paths = dumps[:files]
+    progress = {}
+    results = list(run(first_fields, paths, workers, progress=progress))
+    assert progress == {path: 10000 for path in paths}
+
+    skip = {path: 9990 for path in paths}
+    results = run(first_fields, paths, workers, progress=progress, skip=skip)
+    assert sorted(results, key=int) == [str(n * 10000 + i) for n in range(files) for i in range(9990, 10000)]
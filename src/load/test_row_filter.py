@@ -0,0 +1,77 @@
+from functools import partial
+
+import pytest
+
+from load.benchmark import SAMPLE_LINES
+from load.cache import function_version
+from load.extract_comments import process_as_tuples
+from load.row_filter import (BOT_INDEX, COMMENT_INDEX, ENTITY_INDEX, NAMESPACE_INDEX, REVISION_INDEX,
+                              TIMESTAMP_INDEX, RowFilter)
+from load.synthetic import generate_lines
+
+
+LINES = list(generate_lines(2000))
+
+
+def reference(lines, entities=('revision',), namespaces=None, include_bots=False):
+    for line in lines:
+        fields = line.split('\t')
+        if (fields[ENTITY_INDEX] in entities
+                and (include_bots or not fields[BOT_INDEX])
+                and fields[COMMENT_INDEX]
+                and (namespaces is None or int(fields[NAMESPACE_INDEX]) in namespaces)):
+            yield line
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'include_bots': True},
+    {'entities': ['revision', 'user']},
+    {'namespaces': [0, 2]},
+])
+def test_filter_matches_full_split(options):
+    expected = list(reference(LINES, **options))
+    assert 0 < len(expected) < len(LINES)
+    row_filter = RowFilter(**options)
+    assert list(row_filter.filter(LINES)) == expected
+    assert list(row_filter.filter(line.encode() for line in LINES)) == expected
+
+
+def test_filter_drops_samples():
+    assert list(RowFilter().filter(SAMPLE_LINES)) == [SAMPLE_LINES[0]]
+    assert list(RowFilter(include_bots=True).filter(SAMPLE_LINES)) == SAMPLE_LINES[:2]
+    assert list(RowFilter().filter([])) == []
+
+
+def test_filter_is_part_of_cache_version():
+    function = lambda row_filter: partial(process_as_tuples, row_filter=row_filter)
+    assert (function_version(function(RowFilter()), 1)
+            != function_version(function(RowFilter(include_bots=True)), 1))
+
+
+def test_filter_after_high_water_mark():
+    def key(line):
+        fields = line.split('\t')
+        return fields[TIMESTAMP_INDEX], int(fields[REVISION_INDEX])
+
+    kept = list(reference(LINES))
+    mark = key(kept[len(kept) // 2])
+    expected = [line for line in kept if key(line) > mark]
+    assert 0 < len(expected) < len(kept)
+    row_filter = RowFilter(after={'enwiki': mark})
+    assert list(row_filter.filter(LINES)) == expected
+    assert list(row_filter.filter(line.encode() for line in LINES)) == expected
+    assert list(RowFilter(after={'dewiki': mark}).filter(LINES)) == kept
+
+
+def test_filter_time_range():
+    kept = list(reference(LINES))
+    since = kept[len(kept) // 3].split('\t')[TIMESTAMP_INDEX][:19]
+    until = kept[len(kept) // 2].split('\t')[TIMESTAMP_INDEX][:19]
+    expected = [line for line in kept if since <= line.split('\t')[TIMESTAMP_INDEX] < until]
+    assert 0 < len(expected) < len(kept)
+    row_filter = RowFilter(since=since, until=until)
+    assert list(row_filter.filter(LINES)) == expected
+    assert list(row_filter.filter(line.encode() for line in LINES)) == expected
+    assert list(RowFilter(until=since).filter(LINES)) == [line for line in kept
+                                                          if line.split('\t')[TIMESTAMP_INDEX] < since]
@@ -0,0 +1,54 @@
+import bz2
+
+import pytest
+
+from load import row_index
+from load.row_index import RowIndex, build_index
+from load.schema import build_row
+from load.synthetic import generate_lines
+
+
+LINES = list(generate_lines(3000, seed=3))
+
+
+@pytest.fixture
+def dump(tmp_path):
+    path = tmp_path / 'dump.tsv.bz2'
+    # Two streams of small blocks, so rows cross block boundaries.
+    data = ''.join(LINES).encode()
+    path.write_bytes(bz2.compress(data[:700001], 1) + bz2.compress(data[700001:], 1))
+    return path
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+@pytest.mark.parametrize('run_size', [2**20, 100])
+def test_lookup_revisions(dump, workers, run_size, monkeypatch):
+    # A small run size makes build_index() sort in runs and merge them.
+    monkeypatch.setattr(row_index, '_RUN_SIZE', run_size)
+    rows = [build_row(line) for line in LINES]
+    revisions = [row for row in rows if row.revision_id is not None]
+    assert build_index(dump, workers=workers) == (len(revisions), sum(row.page_id is not None for row in rows))
+    with RowIndex(dump) as index:
+        assert len(index.blocks) > 2
+        for row in revisions[::7] + revisions[-1:]:
+            assert index.revision(row.revision_id) == row
+        assert index.revision(-1) is None
+
+
+def test_lookup_page(dump, monkeypatch):
+    monkeypatch.setattr(row_index, '_RUN_SIZE', 100)
+    build_index(dump)
+    rows = [build_row(line) for line in LINES]
+    page_id = rows[100].page_id
+    with RowIndex(dump) as index:
+        assert index.page(page_id) == [row for row in rows if row.page_id == page_id]
+        assert index.page(-1) == []
+
+
+def test_stale_index(dump):
+    with pytest.raises(ValueError, match='build it with "dump-index build '):
+        RowIndex(dump)
+    build_index(dump)
+    dump.write_bytes(dump.read_bytes() + bz2.compress(LINES[0].encode()))
+    with pytest.raises(ValueError, match='rebuild'):
+        RowIndex(dump)
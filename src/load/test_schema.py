@@ -1,6 +1,7 @@
 import pytest
 
-from schema import Row, build_row, unescape_tnr, unescape_tnr_comma, escape_tnr
+from schema import (Row, build_row, make_decoder, make_row_class, unescape_tnr, unescape_tnr_comma, escape_tnr,
+                    expand_string_array, decode_columns, columns_to_arrow)
 
 
 ROW_1 = r'enwiki	revision	create	2001-01-15 19:27:13.0	*	11313587	Office.bomis.com	Office.bomis.com							false	false	true	false	2009-12-28 09:06:07.0	2009-12-28 09:06:09.0	2001-01-15 19:27:13.0	1		26323569	HomePage	HomePage	0	true	0	true	true	false	2010-02-24 14:25:49.0	2001-01-15 19:27:13.0	1																		908493298	0	false		false	26	26	hjnc5wxv75ckwvos9wsd0as31nmnice			false		false			false	true	'
@@ -122,6 +123,19 @@ def test_unescape_tnr_comma(input, expected):
     assert unescape_tnr_comma(input) == expected
 
 
+@pytest.mark.parametrize('input,expected', [
+    ('', []),
+    ('bot', ['bot']),
+    ('name,group', ['name', 'group']),
+    ('a,,b', ['a', '', 'b']),
+    ('foo\\,bar,baz', ['foo,bar', 'baz']),
+    ('foo\\tbar,baz\\n', ['foo\tbar', 'baz\n']),
+    ('foo\\x,bar', ['foo\\x', 'bar']),
+])
+def test_expand_string_array(input, expected):
+    assert expand_string_array(input) == expected
+
+
 def test_build_row_constructs_row():
     row = build_row(ROW_1)
     assert isinstance(row, Row)
@@ -146,3 +160,132 @@ def test_build_row_handles_string_arrays():
 def test_build_row_raises_value_error_on_malformed_boolean():
     with pytest.raises(ValueError):
         build_row(ROW_1.replace('true', 'xxx'))
+
+
+def test_build_row_strips_trailing_newline():
+    row = build_row(ROW_2 + '\n')
+    assert row.revision_tags == ['AWB']
+
+
+def test_make_decoder_decodes_all_columns():
+    row = make_decoder()(ROW_1)
+    assert not isinstance(row, Row)
+    assert tuple(getattr(row, name) for name in row._fields) == ROW_1_FIELDS
+
+
+def test_make_decoder_decodes_selected_columns():
+    decode = make_decoder(['event_user_id', 'event_comment', 'user_groups'])
+    row = decode(ROW_2)
+    assert row._fields == ('event_user_id', 'event_comment', 'user_groups')
+    assert row.event_user_id == 15996738
+    assert row.event_comment.startswith('/* top */')
+    assert row.user_groups == []
+
+
+def test_make_decoder_rows_have_no_dict():
+    row = make_decoder(['wiki_db'])(ROW_1)
+    assert not hasattr(row, '__dict__')
+
+
+def test_make_decoder_raises_value_error_on_unknown_column():
+    with pytest.raises(ValueError):
+        make_decoder(['event_comment_escaped'])
+
+
+def test_make_decoder_raises_value_error_on_malformed_boolean():
+    decode = make_decoder(['page_is_redirect'])
+    with pytest.raises(ValueError):
+        decode(ROW_1.replace('true', 'xxx'))
+
+
+def test_make_row_class_compares_by_value():
+    cls = make_row_class(['a', 'b'])
+    assert cls(1, [2]) == cls(1, [2])
+    assert cls(1, [2]) != cls(1, [3])
+
+
+def test_decode_columns_matches_build_row():
+    np = pytest.importorskip('numpy')
+    lines = [ROW_1 + '\n', ROW_2 + '\n', ROW_3 + '\n']
+    rows = [build_row(line) for line in lines]
+    columns = decode_columns(lines)
+    for name, column in columns.items():
+        type = Row.__annotations__[name]
+        for index, row in enumerate(rows):
+            expected = getattr(row, name)
+            if type == int:
+                assert (None if column.mask[index] else column[index]) == expected, name
+            elif type == bool:
+                assert {1: True, 0: False, -1: None}[column[index]] == expected, name
+            elif name.endswith('_timestamp'):
+                value = column[index]
+                assert ('' if np.isnat(value) else str(value).replace('T', ' ') + '.0') == expected, name
+            else:
+                assert column[index] == expected, name
+
+
+def test_decode_columns_selected_columns_from_bytes():
+    np = pytest.importorskip('numpy')
+    block = '\n'.join([ROW_1, ROW_2, ROW_3]).encode()
+    columns = decode_columns(block, ['event_timestamp', 'revision_text_bytes_diff', 'user_groups',
+                                     'revision_minor_edit'])
+    assert list(columns) == ['event_timestamp', 'revision_text_bytes_diff', 'user_groups', 'revision_minor_edit']
+    assert columns['event_timestamp'][1] == np.datetime64('2023-01-31T21:32:07')
+    assert columns['revision_text_bytes_diff'].tolist() == [26, -3, None]
+    assert columns['revision_minor_edit'].tolist() == [0, 0, -1]
+    assert columns['user_groups'][2] == ['extendedconfirmed', 'ipblock-exempt']
+    assert columns['user_groups'].lengths().tolist() == [0, 0, 2]
+
+
+@pytest.mark.parametrize('lines', [[], b''])
+def test_decode_columns_of_empty_block(lines):
+    pytest.importorskip('numpy')
+    columns = decode_columns(lines)
+    assert list(columns) == list(Row.__annotations__)
+    assert all(len(column) == 0 for column in columns.values())
+
+
+def test_decode_columns_raises_value_error():
+    pytest.importorskip('numpy')
+    with pytest.raises(ValueError):
+        decode_columns([ROW_1.replace('true', 'xxx')], ['page_is_redirect'])
+    with pytest.raises(ValueError):
+        decode_columns([ROW_1.replace('11313587', '113x3587')], ['event_user_id'])
+    with pytest.raises(ValueError):
+        decode_columns([ROW_1.replace('\t', ' ', 1)])
+    with pytest.raises(ValueError):
+        decode_columns([ROW_1], ['event_comment_escaped'])
+
+
+def test_columns_to_arrow():
+    pytest.importorskip('numpy')
+    pa = pytest.importorskip('pyarrow')
+    table = columns_to_arrow(decode_columns([ROW_1 + '\n', ROW_2 + '\n', ROW_3 + '\n'],
+                                            ['event_user_id', 'page_is_redirect', 'event_timestamp',
+                                             'event_comment', 'user_groups']))
+    assert table.schema.field('event_user_id').type == pa.int64()
+    assert table.schema.field('event_timestamp').type == pa.timestamp('s')
+    assert table.column('event_user_id').to_pylist() == [11313587, 15996738, None]
+    assert table.column('page_is_redirect').to_pylist() == [True, False, None]
+    assert table.column('user_groups').to_pylist() == [[], [], ['extendedconfirmed', 'ipblock-exempt']]
+
+
+def test_make_decoder_interns_repeated_values():
+    decode = make_decoder(intern=True)
+    rows = [decode(line) for line in (ROW_1, ROW_2, ROW_3, ROW_1)]
+    for row, expected in zip(rows, [build_row(ROW_1), build_row(ROW_2), build_row(ROW_3), build_row(ROW_1)]):
+        for name in Row.__annotations__:
+            value = getattr(row, name)
+            assert (list(value) if isinstance(value, tuple) else value) == getattr(expected, name), name
+    assert rows[3].user_groups == ()
+    assert rows[2].user_groups == ('extendedconfirmed', 'ipblock-exempt')
+    assert rows[0].wiki_db is rows[1].wiki_db
+    assert rows[0].page_title is rows[3].page_title
+    assert decode.symbol_tables['page_title'].cache_info().hits == 1
+
+
+def test_make_decoder_interns_only_string_columns():
+    decode = make_decoder(['wiki_db', 'user_groups'], intern=['wiki_db'], symbol_table_size=1)
+    assert list(decode.symbol_tables) == ['wiki_db']
+    with pytest.raises(ValueError):
+        make_decoder(intern=['page_id'])
@@ -0,0 +1,104 @@
+import bz2
+import io
+import json
+
+import pytest
+
+from load.benchmark import SAMPLE_LINES
+from load.extract_comments import process_as_tuples
+from load.pipeline import run
+from load.stats import STATS, Stats, StatsReporter
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    STATS.reset()
+    yield
+    STATS.reset()
+
+
+def first_fields(lines):
+    for line in lines:
+        yield line.split('\t')[0]
+
+
+def write_dump(path, start, count):
+    text = ''.join(f'{i}\tline {i}\n' for i in range(start, start + count))
+    path.write_bytes(bz2.compress(text.encode(), 1))
+    return str(path)
+
+
+def counter(stats, name, **labels):
+    return stats.snapshot()['counters'].get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_take_and_merge():
+    worker = Stats()
+    key = worker.key('rows_filtered', reason='bot')
+    worker.counters[key] += 2
+    worker.add_time('process', 1.5)
+    worker.observe('bulk_latency', 0.02)
+    snapshot = worker.take()
+    assert counter(worker, 'rows_filtered', reason='bot') == 0
+    assert worker.snapshot()['timers'] == {}
+
+    main = Stats()
+    main.merge(snapshot)
+    main.merge(snapshot)
+    assert counter(main, 'rows_filtered', reason='bot') == 4
+    assert main.snapshot()['timers'] == {'process': 3.0}
+    buckets, total = main.snapshot()['histograms']['bulk_latency']
+    assert sum(buckets) == 2
+    assert total == pytest.approx(0.04)
+
+
+def test_summary_and_prometheus():
+    stats = Stats()
+    stats.count('lines', 10)
+    stats.count('rows_filtered', 3, reason='bot')
+    stats.add_time('decompress', 0.25)
+    for latency in [0.004, 0.02, 0.3]:
+        stats.observe('bulk_latency', latency)
+
+    summary = json.loads(stats.summary())
+    assert summary['lines'] == 10
+    assert summary['rows_filtered.bot'] == 3
+    assert summary['decompress_seconds'] == 0.25
+    assert summary['bulk_latency_count'] == 3
+    assert summary['bulk_latency_p50'] == 0.025
+
+    text = stats.prometheus()
+    assert 'edit_summaries_lines_total 10\n' in text
+    assert 'edit_summaries_rows_filtered_total{reason="bot"} 3\n' in text
+    assert 'edit_summaries_stage_seconds_total{stage="decompress"} 0.250000\n' in text
+    assert 'edit_summaries_bulk_latency_seconds_bucket{le="0.005"} 1\n' in text
+    assert 'edit_summaries_bulk_latency_seconds_bucket{le="+Inf"} 3\n' in text
+    assert 'edit_summaries_bulk_latency_seconds_count 3\n' in text
+
+
+def test_reporter_writes_final_report(tmp_path):
+    out = io.StringIO()
+    prometheus_file = tmp_path / 'metrics.prom'
+    with StatsReporter(0, prometheus_file, file=out):
+        STATS.count('lines', 5)
+    line, = out.getvalue().splitlines()
+    assert line.startswith('stats ')
+    assert json.loads(line[len('stats '):])['lines'] == 5
+    assert 'edit_summaries_lines_total 5' in prometheus_file.read_text()
+
+
+def test_filter_reasons():
+    assert list(process_as_tuples(SAMPLE_LINES)) == []
+    assert counter(STATS, 'rows_filtered', reason='autosummary') == 1
+    assert counter(STATS, 'rows_filtered', reason='bot') == 1
+    assert counter(STATS, 'rows_filtered', reason='entity') == 1
+    assert counter(STATS, 'documents') == 0
+
+
+@pytest.mark.parametrize('workers,files', [(0, 1), (2, 1), (2, 2)])
+def test_run_collects_worker_stats(tmp_path, workers, files):
+    paths = [write_dump(tmp_path / f'part{n}.tsv.bz2', n * 5000, 5000) for n in range(files)]
+    assert len(list(run(first_fields, paths, workers, report=lambda _: None))) == 5000 * files
+    assert counter(STATS, 'lines') == 5000 * files
+    assert counter(STATS, 'bytes_decompressed') == sum(len(bz2.open(path).read()) for path in paths)
+    assert STATS.snapshot()['timers']['process'] > 0
@@ -0,0 +1,34 @@
+from load.benchmark_suite import STAGES, run_stage
+from load.extract_comments import process_as_tuples
+from load.schema import build_row, field_names
+from load.synthetic import generate_lines, write_dump
+
+
+def test_lines_parse():
+    lines = list(generate_lines(1000))
+    assert all(line.endswith('\n') and line.count('\t') == len(field_names) - 1 for line in lines)
+    rows = [build_row(line) for line in lines]
+    timestamps = [row.event_timestamp for row in rows]
+    assert timestamps == sorted(timestamps)
+    revisions = [row for row in rows if row.event_entity == 'revision']
+    assert 750 < len(revisions) < 950
+    assert any('\t' in row.event_comment or '\n' in row.event_comment for row in revisions)
+
+
+def test_deterministic():
+    assert list(generate_lines(100, seed=1)) == list(generate_lines(100, seed=1))
+    assert list(generate_lines(100, seed=1)) != list(generate_lines(100, seed=2))
+
+
+def test_ratios():
+    lines = list(generate_lines(1000, non_revision_ratio=0, bot_ratio=0, empty_ratio=0,
+                                autosummary_ratio=0))
+    assert len(list(process_as_tuples(lines))) == 1000
+
+
+def test_run_stage(tmp_path):
+    path = tmp_path / 'dump.tsv.bz2'
+    write_dump(path, 500, compresslevel=1)
+    for name in ['decompress', 'parse: build_row', 'filter: load_comments']:
+        assert name in STAGES
+        assert run_stage(name, str(path))['lines'] == 500